@@ -1,15 +1,19 @@
-import requests
-import json
-import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from async_ollama_client import run_parallel
+from llm_scheduler import request_class
+from ollama_client import OllamaError, get_client, print_token
 
 
 class AIMusicStudio:
     def __init__(self):
-        self.ollama_url = "http://localhost:11434/api/generate"
+        self.client = get_client()
+        self.last_stream_stats = None
 
-    def analyze_emotion_for_music(self, text):
-        """分析文本情绪用于音乐创作"""
-        prompt = f"""
+    def emotion_prompt(self, text):
+        """情绪分析提示词"""
+        return f"""
         分析以下文本的情绪，为音乐创作提供指导：
         "{text}"
 
@@ -23,24 +27,9 @@ class AIMusicStudio:
         }}
         """
 
-        data = {
-            "model": "qwen2:0.5b",
-            "prompt": prompt,
-            "stream": False
-        }
-
-        try:
-            response = requests.post(self.ollama_url, json=data, timeout=60)
-            if response.status_code == 200:
-                return response.json()['response']
-            else:
-                return "情绪分析失败"
-        except:
-            return "AI服务不可用"
-
-    def generate_lyrics(self, theme, style="流行"):
-        """生成歌词"""
-        prompt = f"""
+    def lyrics_prompt(self, theme, style="流行"):
+        """歌词创作提示词"""
+        return f"""
         以"{theme}"为主题，创作一段{style}风格的歌词。
 
         要求：
@@ -52,21 +41,71 @@ class AIMusicStudio:
         请直接输出歌词内容。
         """
 
-        data = {
-            "model": "qwen2:0.5b",
-            "prompt": prompt,
-            "stream": False
-        }
+    def guidance_prompt(self, theme):
+        """音乐创作指导提示词"""
+        return f"""
+        为主题"{theme}"提供详细的音乐创作指导。
+
+        包括：
+        - 和声进行建议
+        - 节奏模式
+        - 乐器编排
+        - 动态变化
+        - 制作提示
 
+        用专业但易懂的中文描述。
+        """
+
+    @request_class("background")
+    def analyze_emotion_for_music(self, text):
+        """分析文本情绪用于音乐创作"""
         try:
-            response = requests.post(self.ollama_url, json=data, timeout=60)
-            if response.status_code == 200:
-                return response.json()['response']
-            else:
-                return "歌词生成失败"
+            return self.client.generate_text(self.emotion_prompt(text), timeout=60, use_cache=True)
+        except OllamaError:
+            return "情绪分析失败"
+        except:
+            return "AI服务不可用"
+
+    @request_class("background")
+    def generate_lyrics(self, theme, style="流行", on_token=None):
+        """生成歌词，传入 on_token 时边生成边回调每个 token"""
+        try:
+            prompt = self.lyrics_prompt(theme, style)
+            if on_token is None:
+                return self.client.generate_text(prompt, timeout=60)
+            stream = self.client.stream(prompt, timeout=60)
+            lyrics = stream.consume(on_token)
+            self.last_stream_stats = stream.stats()
+            return lyrics
+        except OllamaError:
+            return "歌词生成失败"
         except:
             return "AI服务不可用"
 
+    @request_class("background")
+    def generate_project_parts(self, theme, parts=("emotion", "lyrics", "guidance")):
+        """并行生成项目的各个部分（情绪分析、歌词、创作指导互不依赖），按 parts 顺序返回"""
+        builders = {
+            "emotion": (self.emotion_prompt, "情绪分析失败"),
+            "lyrics": (self.lyrics_prompt, "歌词生成失败"),
+            "guidance": (self.guidance_prompt, "创作指导生成失败"),
+        }
+        prompts = [builders[name][0](theme) for name in parts]
+        # 同一主题的情绪分析结果可以复用，歌词和指导每次重新创作
+        use_cache = [name == "emotion" for name in parts]
+
+        results = run_parallel(prompts, timeout=60, use_cache=use_cache)
+
+        outputs = []
+        for name, result in zip(parts, results):
+            if isinstance(result, OllamaError):
+                outputs.append(builders[name][1])
+            elif isinstance(result, Exception):
+                outputs.append("AI服务不可用")
+            else:
+                outputs.append(result)
+        return outputs
+
     def create_music_project(self):
         """创建完整音乐项目"""
         print("🎵 AI音乐工作室")
@@ -76,47 +115,28 @@ class AIMusicStudio:
         theme = input("请输入音乐主题: ").strip()
 
         print(f"\n正在为'{theme}'创建音乐项目...")
+        start_time = time.time()
 
-        # 1. 情绪分析
-        print("\n1. 🎭 情绪分析...")
-        emotion_analysis = self.analyze_emotion_for_music(theme)
-        print(emotion_analysis)
+        # 情绪分析和创作指导在后台并行生成，歌词在前台流式显示
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            background = pool.submit(self.generate_project_parts, theme, ("emotion", "guidance"))
 
-        # 2. 生成歌词
-        print("\n2. 📝 生成歌词...")
-        lyrics = self.generate_lyrics(theme)
-        print(lyrics)
+            # 1. 生成歌词
+            print("\n1. 📝 生成歌词...")
+            lyrics = self.generate_lyrics(theme, on_token=print_token)
+            print()
 
-        # 3. 音乐创作指导
-        print("\n3. 🎼 音乐创作指导...")
-        guidance_prompt = f"""
-        为主题"{theme}"提供详细的音乐创作指导。
-
-        包括：
-        - 和声进行建议
-        - 节奏模式
-        - 乐器编排
-        - 动态变化
-        - 制作提示
+            emotion_analysis, guidance = background.result()
 
-        用专业但易懂的中文描述。
-        """
+        # 2. 情绪分析
+        print("\n2. 🎭 情绪分析...")
+        print(emotion_analysis)
 
-        data = {
-            "model": "qwen2:0.5b",
-            "prompt": guidance_prompt,
-            "stream": False
-        }
+        # 3. 音乐创作指导
+        print("\n3. 🎼 音乐创作指导...")
+        print(guidance)
 
-        try:
-            response = requests.post(self.ollama_url, json=data, timeout=60)
-            if response.status_code == 200:
-                guidance = response.json()['response']
-                print(guidance)
-            else:
-                print("创作指导生成失败")
-        except:
-            print("AI服务不可用")
+        print(f"\n⏱️ 生成耗时: {time.time() - start_time:.2f}秒")
 
         # 保存项目
         self.save_project(project_name, theme, emotion_analysis, lyrics)
@@ -156,8 +176,9 @@ class AIMusicStudio:
             elif choice == "3":
                 theme = input("请输入歌词主题: ").strip()
                 style = input("请输入风格 (流行/摇滚/民谣): ").strip() or "流行"
-                lyrics = self.generate_lyrics(theme, style)
-                print(f"\n📝 生成的歌词:\n{lyrics}")
+                print("\n📝 生成的歌词:")
+                self.generate_lyrics(theme, style, on_token=print_token)
+                print()
             elif choice == "4":
                 print("再见！")
                 break
@@ -1,14 +1,30 @@
+import asyncio
 import requests
-import json
 import time
 
+from async_ollama_client import AsyncOllamaClient
+from ollama_client import OllamaError, get_client
+
 
 class APIDemo:
     def __init__(self):
-        self.ollama_url = "http://localhost:11434/api/generate"
+        self.client = get_client()
+
+    async def _timed_gather(self, jobs, timeout=30):
+        """并行执行 (prompt, model) 任务，返回每个任务的 (回答或异常, 耗时)"""
+        async with AsyncOllamaClient() as client:
+            async def timed(prompt, model):
+                start_time = time.time()
+                try:
+                    answer = await client.generate_text(prompt, model=model, timeout=timeout)
+                except Exception as e:
+                    answer = e
+                return answer, time.time() - start_time
+
+            return await asyncio.gather(*(timed(prompt, model) for prompt, model in jobs))
 
     def test_basic_chat(self):
-        """测试基础对话API"""
+        """测试基础对话API（多个问题并行发送）"""
         print("💬 测试基础对话API")
         print("-" * 40)
 
@@ -18,84 +34,56 @@ class APIDemo:
             "什么是人工智能？"
         ]
 
-        for i, prompt in enumerate(prompts, 1):
-            print(f"\n{i}. 你的问题: {prompt}")
-
-            data = {
-                "model": "qwen2:0.5b",
-                "prompt": prompt,
-                "stream": False
-            }
+        start_time = time.time()
+        results = asyncio.run(self._timed_gather([(prompt, None) for prompt in prompts]))
+        total_time = time.time() - start_time
 
-            try:
-                start_time = time.time()
-                response = requests.post(self.ollama_url, json=data, timeout=30)
-                end_time = time.time()
+        for i, (prompt, (answer, elapsed)) in enumerate(zip(prompts, results), 1):
+            print(f"\n{i}. 你的问题: {prompt}")
 
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"   AI回答: {result['response'][:100]}...")
-                    print(f"   响应时间: {end_time - start_time:.2f}秒")
-                else:
-                    print(f"   ❌ 请求失败: {response.status_code}")
+            if isinstance(answer, OllamaError):
+                print(f"   ❌ 请求失败: {answer.status_code}")
+            elif isinstance(answer, Exception):
+                print(f"   ❌ 错误: {answer}")
+            else:
+                print(f"   AI回答: {answer[:100]}...")
+                print(f"   响应时间: {elapsed:.2f}秒")
 
-            except Exception as e:
-                print(f"   ❌ 错误: {e}")
+        print(f"\n⏱️ 总耗时: {total_time:.2f}秒（并行），各请求耗时之和: {sum(r[1] for r in results):.2f}秒")
 
     def test_with_different_models(self):
-        """测试不同模型"""
+        """测试不同模型（各模型并行请求）"""
         print("\n🤖 测试不同模型")
         print("-" * 40)
 
         models = ["qwen2:0.5b"]  # 你可以添加更多模型，如 "llama2", "codellama:7b"
 
-        for model in models:
+        results = asyncio.run(self._timed_gather([("请写一首关于春天的短诗", model) for model in models]))
+
+        for model, (answer, elapsed) in zip(models, results):
             print(f"\n测试模型: {model}")
 
-            data = {
-                "model": model,
-                "prompt": "请写一首关于春天的短诗",
-                "stream": False
-            }
-
-            try:
-                response = requests.post(self.ollama_url, json=data, timeout=30)
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"   回答: {result['response'][:80]}...")
-                else:
-                    print(f"   ❌ {model} 请求失败")
-            except Exception as e:
-                print(f"   ❌ {model} 错误: {e}")
+            if isinstance(answer, OllamaError):
+                print(f"   ❌ {model} 请求失败")
+            elif isinstance(answer, Exception):
+                print(f"   ❌ {model} 错误: {answer}")
+            else:
+                print(f"   回答: {answer[:80]}...")
 
     def test_streaming(self):
         """测试流式输出（如果支持）"""
         print("\n🌀 测试流式输出")
         print("-" * 40)
 
-        data = {
-            "model": "qwen2:0.5b",
-            "prompt": "请详细解释机器学习",
-            "stream": True  # 流式输出
-        }
-
         try:
-            response = requests.post(self.ollama_url, json=data, stream=True, timeout=30)
-
-            if response.status_code == 200:
-                print("流式输出: ", end="", flush=True)
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            json_data = json.loads(line)
-                            if 'response' in json_data:
-                                print(json_data['response'], end="", flush=True)
-                        except json.JSONDecodeError:
-                            continue
-                print()  # 换行
-            else:
-                print("❌ 流式请求失败")
-
+            print("流式输出: ", end="", flush=True)
+            for chunk in self.client.generate_stream("请详细解释机器学习", timeout=30):
+                if 'response' in chunk:
+                    print(chunk['response'], end="", flush=True)
+            print()  # 换行
+
+        except OllamaError:
+            print("❌ 流式请求失败")
         except Exception as e:
             print(f"❌ 流式输出错误: {e}")
 
@@ -105,18 +93,14 @@ class APIDemo:
         print("-" * 40)
 
         try:
-            # 检查服务是否运行
-            response = requests.get("http://localhost:11434/", timeout=5)
+            # 检查服务是否运行，并获取可用模型
+            models = self.client.list_models()
             print("✅ Ollama服务正在运行")
 
-            # 检查可用模型
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
-            models = response.json().get('models', [])
-
             if models:
                 print("📚 可用模型:")
                 for model in models:
-                    print(f"   - {model.get('name')}")
+                    print(f"   - {model}")
             else:
                 print("❌ 没有找到模型，请下载: ollama pull qwen2:0.5b")
 
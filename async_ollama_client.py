@@ -0,0 +1,341 @@
+import asyncio
+import json
+import os
+import time
+
+import metrics
+from llm_scheduler import QueueRejected, current_class, get_scheduler
+from ollama_client import OllamaClient, OllamaConfig, OllamaError, build_payload, cache_key, flight_key, get_client
+from single_flight import AsyncSingleFlight
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 连接失败、超时等可重试的传输层异常（requests 的异常本身是 OSError 子类）
+_TRANSPORT_ERRORS = (OSError, asyncio.TimeoutError)
+if aiohttp is not None:
+    _TRANSPORT_ERRORS += (aiohttp.ClientError,)
+if httpx is not None:
+    _TRANSPORT_ERRORS += (httpx.TransportError,)
+
+
+class _AiohttpBackend:
+    """aiohttp 实现：一个 ClientSession 复用连接"""
+
+    name = "aiohttp"
+
+    def __init__(self, config, limit):
+        self.config = config
+        self.limit = limit
+        self._session = None
+
+    @property
+    def session(self):
+        # ClientSession 必须在事件循环中创建
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _timeout(self, timeout):
+        return aiohttp.ClientTimeout(total=timeout, connect=self.config.connect_timeout)
+
+    async def request_json(self, method, path, payload, timeout):
+        async with self.session.request(method, self.config.base_url + path, json=payload,
+                                        timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise OllamaError(await response.text(), status_code=response.status)
+            return await response.json(content_type=None)
+
+    async def stream_lines(self, path, payload, timeout):
+        async with self.session.post(self.config.base_url + path, json=payload,
+                                     timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise OllamaError(await response.text(), status_code=response.status)
+            async for line in response.content:
+                yield line
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class _HttpxBackend:
+    """httpx.AsyncClient 实现"""
+
+    name = "httpx"
+
+    def __init__(self, config, limit):
+        self.config = config
+        self.limit = limit
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            limits = httpx.Limits(max_connections=self.limit, max_keepalive_connections=self.limit)
+            self._session = httpx.AsyncClient(base_url=self.config.base_url, limits=limits)
+        return self._session
+
+    def _timeout(self, timeout):
+        return httpx.Timeout(timeout, connect=self.config.connect_timeout)
+
+    async def request_json(self, method, path, payload, timeout):
+        response = await self.session.request(method, path, json=payload, timeout=self._timeout(timeout))
+        if response.status_code != 200:
+            raise OllamaError(response.text, status_code=response.status_code)
+        return response.json()
+
+    async def stream_lines(self, path, payload, timeout):
+        async with self.session.stream("POST", path, json=payload, timeout=self._timeout(timeout)) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise OllamaError(response.text, status_code=response.status_code)
+            async for line in response.aiter_lines():
+                yield line
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.aclose()
+
+
+class _ThreadBackend:
+    """标准库兜底实现：在线程池里调用同步 OllamaClient"""
+
+    name = "thread"
+
+    def __init__(self, config, limit):
+        self.client = OllamaClient(config)
+
+    async def request_json(self, method, path, payload, timeout):
+        def call():
+            # 重试由外层 AsyncOllamaClient 负责
+            return self.client._request(method, path, payload, timeout, retries=0).json()
+
+        return await asyncio.to_thread(call)
+
+    async def stream_lines(self, path, payload, timeout):
+        response = await asyncio.to_thread(self.client._request, "POST", path, payload, timeout, True, 0)
+        lines = response.iter_lines()
+        done = object()
+        try:
+            while True:
+                line = await asyncio.to_thread(next, lines, done)
+                if line is done:
+                    break
+                yield line
+        finally:
+            response.close()
+
+    async def close(self):
+        self.client.close()
+
+
+def _select_backend(name):
+    if name == "aiohttp" or (name is None and aiohttp is not None):
+        return _AiohttpBackend
+    if name == "httpx" or (name is None and httpx is not None):
+        return _HttpxBackend
+    return _ThreadBackend
+
+
+class AsyncOllamaClient:
+    """asyncio 版 Ollama 客户端，用信号量限制同时发往服务端的请求数
+
+    用法:
+        async with AsyncOllamaClient() as client:
+            answers = await client.gather_text([prompt1, prompt2, prompt3])
+    """
+
+    def __init__(self, config=None, max_concurrency=None, backend=None, cache=None):
+        self.config = config or OllamaConfig.from_env()
+        # 默认与同步客户端共用同一个响应缓存
+        self.cache = cache if cache is not None else get_client().cache
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get("OLLAMA_MAX_CONCURRENCY", 4))
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.flights = AsyncSingleFlight() if self.config.coalesce else None
+        self.scheduler = get_scheduler()
+        self._backend = _select_backend(backend)(self.config, max(max_concurrency, self.config.pool_size))
+
+    @property
+    def backend(self):
+        return self._backend.name
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _acquire(self):
+        """等待并发名额，等待中的请求数记为 queue_depth 指标"""
+        self.waiting += 1
+        metrics.set_gauge("queue_depth", self.waiting, queue="async_llm")
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            metrics.set_gauge("queue_depth", self.waiting, queue="async_llm")
+
+    async def _acquire_slot(self, request_class):
+        """在共享调度器中按优先级排队（与同步客户端共用槽位）；被拒绝时抛出状态码为 503 的 OllamaError"""
+        if self.scheduler is None:
+            return
+        try:
+            await self.scheduler.acquire_async(request_class)
+        except QueueRejected as e:
+            raise OllamaError(str(e), status_code=503) from e
+
+    def _release_slot(self, request_class):
+        if self.scheduler is not None:
+            self.scheduler.release(request_class)
+
+    async def _request_json(self, method, path, payload=None, timeout=None):
+        """带并发上限和指数退避重试的请求"""
+        timeout = timeout or self.config.timeout
+        await self._acquire()
+        try:
+            for attempt in range(self.config.max_retries + 1):
+                if attempt:
+                    metrics.inc("llm_retries_total", path=path)
+                    await asyncio.sleep(self.config.backoff * (2 ** (attempt - 1)))
+                try:
+                    return await self._backend.request_json(method, path, payload, timeout)
+                except OllamaError as e:
+                    if e.status_code not in OllamaClient.RETRY_STATUS or attempt == self.config.max_retries:
+                        metrics.inc("llm_errors_total", path=path, status=e.status_code)
+                        raise
+                except _TRANSPORT_ERRORS as e:
+                    if attempt == self.config.max_retries:
+                        metrics.inc("llm_errors_total", path=path, status=type(e).__name__)
+                        raise
+        finally:
+            self._semaphore.release()
+
+    async def generate(self, prompt, model=None, options=None, timeout=None, use_cache=False, **extra):
+        """非流式生成，返回 Ollama 的完整 JSON 结果（use_cache 含义同 OllamaClient.generate）"""
+        payload = build_payload(self.config, prompt, model, options, False, extra)
+        key = None
+        if use_cache and self.cache is not None:
+            key = cache_key(payload)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        result = await self._post_json("/api/generate", payload, timeout)
+        if key is not None:
+            self.cache.set(key, result)
+        return result
+
+    async def generate_text(self, prompt, model=None, options=None, timeout=None, use_cache=False, **extra):
+        """非流式生成，只返回回答文本"""
+        result = await self.generate(prompt, model, options, timeout, use_cache, **extra)
+        return result["response"]
+
+    async def _post_json(self, path, payload, timeout):
+        """非流式 POST；同一事件循环里相同的请求正在进行时等待它的结果"""
+        request_class = current_class()
+
+        async def fetch():
+            await self._acquire_slot(request_class)
+            try:
+                start = time.perf_counter()
+                result = await self._request_json("POST", path, payload, timeout)
+            finally:
+                self._release_slot(request_class)
+            metrics.observe_llm(path.rsplit("/", 1)[-1], result, time.perf_counter() - start)
+            return result
+
+        if self.flights is None:
+            return await fetch()
+        return await self.flights.do(flight_key(path, payload), fetch)
+
+    async def generate_stream(self, prompt, model=None, options=None, timeout=None, **extra):
+        """流式生成，逐行产出 Ollama 返回的 JSON 片段（整个流占用一个并发名额）
+
+        相同的流正在进行时直接订阅它，不再占用新的并发名额。
+        """
+        payload = build_payload(self.config, prompt, model, options, True, extra)
+        request_class = current_class()
+        if self.flights is None:
+            chunks = self._stream_chunks(payload, timeout, request_class)
+        else:
+            chunks = self.flights.stream(flight_key("/api/generate", payload),
+                                         lambda: self._stream_chunks(payload, timeout, request_class))
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            # 调用方提前退出时退订（最后一个订阅者退出会断开上游）
+            await chunks.aclose()
+
+    async def _stream_chunks(self, payload, timeout, request_class):
+        await self._acquire_slot(request_class)
+        try:
+            await self._acquire()
+        except BaseException:
+            self._release_slot(request_class)
+            raise
+        try:
+            start = time.perf_counter()
+            ttft = None
+            async for line in self._backend.stream_lines("/api/generate", payload,
+                                                         timeout or self.config.timeout):
+                if not line or not line.strip():
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if ttft is None and chunk.get("response"):
+                    ttft = time.perf_counter() - start
+                yield chunk
+                if chunk.get("done"):
+                    metrics.observe_llm("generate", chunk, time.perf_counter() - start, ttft)
+                    break
+        finally:
+            self._semaphore.release()
+            self._release_slot(request_class)
+
+    async def gather_text(self, prompts, model=None, options=None, timeout=None, return_exceptions=True,
+                          use_cache=False):
+        """同时发出多个互不依赖的提示词，按输入顺序返回结果
+
+        总耗时取决于最慢的一个请求，而不是所有请求之和。
+        return_exceptions=True 时失败的请求在对应位置返回异常对象。
+        use_cache 可以是布尔值，也可以是与 prompts 等长的列表，逐个指定是否走缓存。
+        """
+        if isinstance(use_cache, bool):
+            use_cache = [use_cache] * len(prompts)
+        tasks = [self.generate_text(prompt, model=model, options=options, timeout=timeout, use_cache=cached)
+                 for prompt, cached in zip(prompts, use_cache)]
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+
+    async def list_models(self, timeout=5):
+        """返回已安装模型的名称列表"""
+        result = await self._backend.request_json("GET", "/api/tags", None, timeout)
+        return [model.get("name") for model in result.get("models", [])]
+
+    async def close(self):
+        await self._backend.close()
+
+
+def run_parallel(prompts, model=None, options=None, timeout=None, max_concurrency=None, use_cache=False):
+    """在同步代码中并行执行多个提示词，返回与 prompts 顺序一致的结果列表"""
+
+    async def runner():
+        async with AsyncOllamaClient(max_concurrency=max_concurrency) as client:
+            return await client.gather_text(prompts, model=model, options=options, timeout=timeout,
+                                            use_cache=use_cache)
+
+    return asyncio.run(runner())
@@ -0,0 +1,265 @@
+import argparse
+import glob
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from detection_summary import DetectionSummary
+from image_cache import ImageAnalysisCache, file_digest
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def iter_images(target, extensions=IMAGE_EXTENSIONS):
+    """按固定顺序列出图片：target 可以是目录（递归）、glob 模式（支持 **）或单个文件"""
+    if os.path.isdir(target):
+        for root, dirs, files in os.walk(target):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(extensions):
+                    yield os.path.join(root, name)
+    elif os.path.isfile(target):
+        yield target
+    else:
+        for path in sorted(glob.glob(target, recursive=True)):
+            if os.path.isfile(path) and path.lower().endswith(extensions):
+                yield path
+
+
+def load_image(path):
+    """解码成 BGR 数组（与 YOLO 读取文件时一致），失败返回 None"""
+    import cv2
+
+    return cv2.imread(path)
+
+
+def load_model(weights='yolov8n.pt', backend=None):
+    from model_registry import get_model
+
+    return get_model(weights, backend=backend)
+
+
+def _completed_paths(path):
+    """读取已有输出中处理过的图片路径，跳过中断时写了一半的末行"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["path"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return done
+
+
+def _open_for_append(path):
+    f = open(path, 'ab+')
+    end = f.seek(0, os.SEEK_END)
+    if end > 0:
+        f.seek(end - 1)
+        if f.read(1) != b"\n":
+            # 上次中断留下的半行单独成行，读取时会被跳过
+            f.write(b"\n")
+    return f
+
+
+def write_parquet(jsonl_path, parquet_path):
+    """把 JSONL 结果整体转换成 Parquet（需要 pip install pyarrow）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    records = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    for record in records:
+        record.setdefault("detections", [])
+        record.setdefault("error", None)
+    pq.write_table(pa.Table.from_pylist(records), parquet_path)
+    return len(records)
+
+
+class BatchImageAnalyzer:
+    """目录级批量目标检测
+
+    - 线程池并行解码图片，并提前准备 prefetch 个批次，推理时不用等磁盘和解码
+    - 每 batch_size 张图做一次 YOLO 前向计算
+    - 结果逐批追加到 JSONL，中断后重新运行会跳过已处理的图片
+    - 输出文件以 .parquet 结尾时，先写 <输出>.partial.jsonl，全部完成后再转换
+    - 传入 cache（ImageAnalysisCache）时按图片内容哈希复用以前的检测结果，命中的图片不解码也不推理
+    """
+
+    def __init__(self, model=None, batch_size=16, workers=4, prefetch=2, imgsz=640, conf=0.25, cache=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch
+        self.imgsz = imgsz
+        self.conf = conf
+        self.cache = cache
+        self.options = {"imgsz": imgsz, "conf": conf}
+
+    def _batches(self, paths):
+        batch = []
+        for path in paths:
+            batch.append(path)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _load(self, path):
+        """在线程池中执行：启用缓存时先按内容哈希查找，命中就不再解码，返回 (哈希, 图片, 缓存结果)"""
+        digest = None
+        if self.cache is not None and self.cache.enabled:
+            try:
+                digest = file_digest(path)
+            except OSError:
+                return None, None, None
+            cached = self.cache.get(digest, self.options)
+            if cached is not None and "detections" in cached:
+                return digest, None, cached
+        return digest, load_image(path), None
+
+    def _decode(self, pool, batch):
+        return batch, [pool.submit(self._load, path) for path in batch]
+
+    def _infer(self, paths, loaded):
+        records = []
+        valid = []
+        for path, (digest, image, cached) in zip(paths, loaded):
+            if cached is not None:
+                records.append({"path": path, "width": cached["width"], "height": cached["height"],
+                                "detections": cached["detections"]})
+            elif image is None:
+                records.append({"path": path, "error": "无法解码"})
+            else:
+                valid.append((path, digest, image))
+        if valid:
+            results = self.model([image for _, _, image in valid], imgsz=self.imgsz, conf=self.conf, verbose=False)
+            metrics.observe("batch_size", len(valid), source="batch")
+            metrics.observe_yolo(results, "batch")
+            new_entries = []
+            for (path, digest, image), result in zip(valid, results):
+                entry = {
+                    "width": int(image.shape[1]),
+                    "height": int(image.shape[0]),
+                    "detections": DetectionSummary.from_result(result).to_records(),
+                }
+                records.append({"path": path, **entry})
+                if digest is not None:
+                    new_entries.append((digest, entry))
+            if new_entries:
+                self.cache.set_many(new_entries, self.options)
+        return records
+
+    def run(self, target, output="detections.jsonl", resume=True, report_every=10.0):
+        """分析 target 下的全部图片，返回统计信息"""
+        if self.model is None:
+            self.model = load_model()
+
+        parquet_path = None
+        if output.endswith(".parquet"):
+            parquet_path, output = output, output + ".partial.jsonl"
+        if not resume and os.path.exists(output):
+            os.remove(output)
+        done = _completed_paths(output) if resume else set()
+        paths = [path for path in iter_images(target) if path not in done]
+        print(f"📂 共 {len(paths) + len(done)} 张图片，已完成 {len(done)}，待处理 {len(paths)}")
+
+        processed = failed = detections = cache_hits = 0
+        decode_wait = infer_time = 0.0
+        start = last_report = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool, _open_for_append(output) as out:
+            batches = self._batches(paths)
+            pending = deque()
+            for _ in range(max(1, self.prefetch)):
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.append(self._decode(pool, batch))
+
+            while pending:
+                batch, futures = pending.popleft()
+                # 当前批次推理期间，后面的批次在线程池里解码
+                next_batch = next(batches, None)
+                if next_batch is not None:
+                    pending.append(self._decode(pool, next_batch))
+                metrics.set_gauge("queue_depth", len(pending), queue="batch_prefetch")
+
+                wait_start = time.perf_counter()
+                loaded = [future.result() for future in futures]
+                cache_hits += sum(1 for _, _, cached in loaded if cached is not None)
+                infer_start = time.perf_counter()
+                records = self._infer(batch, loaded)
+                infer_end = time.perf_counter()
+                decode_wait += infer_start - wait_start
+                infer_time += infer_end - infer_start
+
+                out.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode('utf-8'))
+                out.flush()
+                processed += len(records)
+                failed += sum(1 for r in records if "error" in r)
+                detections += sum(len(r.get("detections", [])) for r in records)
+
+                if infer_end - last_report >= report_every:
+                    last_report = infer_end
+                    rate = processed / (infer_end - start)
+                    print(f"   {processed}/{len(paths)} 张，{rate:.1f} 张/秒")
+
+        elapsed = time.perf_counter() - start
+        stats = {
+            "processed": processed,
+            "skipped": len(done),
+            "failed": failed,
+            "detections": detections,
+            "elapsed": elapsed,
+            "images_per_sec": processed / elapsed if elapsed > 0 else 0.0,
+            "cache_hits": cache_hits,
+            "decode_wait": decode_wait,
+            "infer_time": infer_time,
+        }
+        print(f"✅ 完成 {processed} 张（失败 {failed}），耗时 {elapsed:.1f}秒，"
+              f"{stats['images_per_sec']:.1f} 张/秒（推理 {infer_time:.1f}秒，等待解码 {decode_wait:.1f}秒，"
+              f"缓存命中 {cache_hits} 张）")
+
+        if parquet_path:
+            count = write_parquet(output, parquet_path)
+            os.remove(output)
+            print(f"💾 已写入 {parquet_path}（{count} 条）")
+        else:
+            print(f"💾 结果保存: {output}")
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量 YOLO 目标检测：递归分析目录或 glob 匹配的全部图片")
+    parser.add_argument("target", help="图片目录、glob 模式（如 'photos/**/*.jpg'）或单个文件")
+    parser.add_argument("-o", "--output", default="detections.jsonl", help="输出文件（.jsonl 或 .parquet）")
+    parser.add_argument("--weights", default="yolov8n.pt", help="YOLO 权重文件")
+    parser.add_argument("--backend", choices=["torch", "onnx", "openvino", "auto"], default=None,
+                        help="推理后端，默认读取环境变量 YOLO_BACKEND")
+    parser.add_argument("--batch-size", type=int, default=16, help="每次前向计算的图片数")
+    parser.add_argument("--workers", type=int, default=4, help="解码线程数")
+    parser.add_argument("--imgsz", type=int, default=640, help="推理尺寸")
+    parser.add_argument("--conf", type=float, default=0.25, help="置信度阈值")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有输出，从头开始")
+    parser.add_argument("--no-cache", action="store_true", help="不使用图片分析缓存（IMAGE_CACHE_PATH）")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ImageAnalysisCache.from_env(args.weights, args.backend)
+    analyzer = BatchImageAnalyzer(load_model(args.weights, args.backend), batch_size=args.batch_size,
+                                  workers=args.workers, imgsz=args.imgsz, conf=args.conf, cache=cache)
+    analyzer.run(args.target, args.output, resume=not args.no_resume)
+
+
+if __name__ == "__main__":
+    main()
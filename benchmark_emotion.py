@@ -0,0 +1,125 @@
+import argparse
+import statistics
+import time
+
+from emotion_classifier import EmotionClassifier
+from mental_health_assistant import EmotionAnalyzer, LongTermMemory
+from ollama_client import OllamaClient
+
+SAMPLE_TEXTS = [
+    "今天考试考得很好，太开心了",
+    "我最近总是睡不着，很担心明天的面试",
+    "工作压力好大，每天加班到很晚",
+    "他又放我鸽子，气死我了",
+    "周末一个人在家，感觉好孤单",
+    "我不知道自己以后该做什么，好迷茫",
+    "终于被录取了！！迫不及待想告诉大家",
+    "今天天气不错，散散步心里很平静",
+    "我养的猫去世了，好难过",
+    "这道题我怎么也搞不懂",
+    "明天要交报告，可是还有好多任务没完成",
+    "朋友们都没空，没人陪我说话",
+    "凭什么每次都是我背锅，太不公平了",
+    "今天吃了午饭，下午开会",
+    "我有点紧张，不知道他会不会喜欢我的礼物",
+    "和家人一起看电影，很幸福",
+    "最近心情还好，没什么特别的",
+    "我真的撑不住了，感觉喘不过气",
+    "要去旅行了，好期待",
+    "我不开心，感觉没人理解我",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def load_texts(user_id, holdout=0.2):
+    """按时间顺序切分该用户的历史：前面的部分训练本地模型，最后 holdout 比例的对话作为测试样本"""
+    history = list(LongTermMemory(user_id).iter_history())
+    split = len(history) - int(len(history) * holdout)
+    test = history[split:]
+    return [chat["user_input"] for chat in test if chat.get("user_input")], history[:split]
+
+
+def run_benchmark(texts, history=None, threshold=0.6, use_llm=True):
+    if not texts:
+        print("⚠️ 没有样本，无法测试")
+        return
+
+    classifier = EmotionClassifier()
+    if history and classifier.train_from_history(history):
+        print(f"✅ 已用 {len(history)} 条历史对话训练本地模型")
+
+    # 基准测试要测模型真实耗时，这里使用不带缓存的客户端
+    analyzer = EmotionAnalyzer(client=OllamaClient(), classifier=classifier, threshold=threshold)
+
+    local_times, llm_times = [], []
+    agree, agree_confident, confident, confident_answered, errors = 0, 0, 0, 0, 0
+
+    print(f"\n{'文本':<24}{'本地':<6}{'置信度':<8}{'大模型':<6}")
+    print("-" * 50)
+    for text in texts:
+        start = time.perf_counter()
+        local_label, confidence, _ = classifier.predict(text)
+        local_times.append(time.perf_counter() - start)
+
+        llm_label = "-"
+        if use_llm:
+            start = time.perf_counter()
+            try:
+                llm_label = analyzer.classify_with_llm(text)
+                llm_times.append(time.perf_counter() - start)
+                agree += local_label == llm_label
+            except Exception:
+                # 请求失败不算作“中性”，单独计数，也不参与一致率
+                llm_label = "错误"
+                errors += 1
+
+        if confidence >= threshold:
+            confident += 1
+            if llm_label not in ("-", "错误"):
+                confident_answered += 1
+                agree_confident += local_label == llm_label
+
+        print(f"{text[:20]:<24}{local_label:<6}{confidence:<8.2f}{llm_label:<6}")
+
+    print("\n📊 基准结果:")
+    print(f"   样本数: {len(texts)}")
+    print(f"   本地分类延迟: 平均 {statistics.mean(local_times) * 1000:.3f}ms, "
+          f"p95 {percentile(local_times, 95) * 1000:.3f}ms")
+    print(f"   走本地快速路径的比例 (置信度≥{threshold}): {confident / len(texts):.1%}")
+
+    if use_llm:
+        print(f"   大模型请求失败: {errors} 条（不计入一致率）")
+        if not llm_times:
+            print("   大模型没有成功返回任何样本")
+            return
+        print(f"   大模型分类延迟: 平均 {statistics.mean(llm_times):.2f}秒, p95 {percentile(llm_times, 95):.2f}秒")
+        print(f"   与大模型标签一致率: {agree / len(llm_times):.1%}")
+        if confident_answered:
+            print(f"   高置信度样本一致率: {agree_confident / confident_answered:.1%}")
+        saved = confident * statistics.mean(llm_times)
+        print(f"   预计节省大模型耗时: {saved:.2f}秒 / {len(texts)} 条消息")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地情绪分类器与大模型的延迟、一致率对比")
+    parser.add_argument("--user", help="用该用户长期记忆中的历史对话训练本地模型，并以最后一部分对话作为测试样本")
+    parser.add_argument("--holdout", type=float, default=0.2, help="--user 时留作测试样本、不参与训练的最新对话比例")
+    parser.add_argument("--threshold", type=float, default=0.6, help="本地快速路径的置信度阈值")
+    parser.add_argument("--no-llm", action="store_true", help="只测本地分类器，不调用大模型")
+    args = parser.parse_args()
+
+    texts, history = SAMPLE_TEXTS, None
+    if args.user:
+        texts, history = load_texts(args.user, args.holdout)
+        print(f"📂 训练 {len(history)} 条历史对话，测试 {len(texts)} 条最新对话")
+
+    run_benchmark(texts, history, args.threshold, use_llm=not args.no_llm)
+
+
+if __name__ == "__main__":
+    main()
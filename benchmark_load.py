@@ -0,0 +1,162 @@
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark_memory import MESSAGES, percentile
+from fake_ollama import add_fake_arguments, fake_options, start_fake_server
+
+SCENARIOS = ("assistant", "music", "chat")
+THEMES = ["夏天的海边", "毕业", "深夜的城市", "家乡", "第一次旅行"]
+
+
+class LoadResult:
+    """一个场景的压测结果：每个请求的延迟、首 token 时间和失败数"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.ttfts = []
+        self.errors = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, latency, ok, ttft=None):
+        with self._lock:
+            self.latencies.append(latency)
+            if ttft is not None:
+                self.ttfts.append(ttft)
+            if not ok:
+                self.errors += 1
+
+    def report(self):
+        total = len(self.latencies)
+        print(f"\n📊 {self.name}")
+        if not total:
+            print("   没有完成任何请求")
+            return
+        print(f"   请求数: {total}，耗时 {self.elapsed:.2f}秒，吞吐 {total / self.elapsed:.2f} 请求/秒，"
+              f"错误率 {self.errors / total:.1%}")
+        print(f"   延迟: p50 {statistics.median(self.latencies) * 1000:.0f}ms, "
+              f"p95 {percentile(self.latencies, 95) * 1000:.0f}ms, p99 {percentile(self.latencies, 99) * 1000:.0f}ms")
+        if self.ttfts:
+            print(f"   首 token: p50 {statistics.median(self.ttfts) * 1000:.0f}ms, "
+                  f"p95 {percentile(self.ttfts, 95) * 1000:.0f}ms, p99 {percentile(self.ttfts, 99) * 1000:.0f}ms")
+
+
+def make_worker(scenario, worker_id):
+    """为每个并发线程创建 run(on_token) 函数：调用真实代码路径完成一个请求，返回是否成功"""
+    if scenario == "assistant":
+        from mental_health_assistant import MentalHealthAssistant
+
+        # 每个线程模拟一个已经登记过名字的用户
+        assistant = MentalHealthAssistant(user_id=f"load_user{worker_id}")
+        if not assistant.memory.memory["basic_info"].get("name"):
+            assistant.memory.update_basic_info(name=f"用户{worker_id}")
+
+        def run(on_token):
+            response, _ = assistant.process_user_input(random.choice(MESSAGES), on_token=on_token)
+            return not response.startswith("抱歉")
+        return run
+
+    if scenario == "music":
+        from ai_music_studio import AIMusicStudio
+
+        studio = AIMusicStudio()
+
+        def run(on_token):
+            lyrics = studio.generate_lyrics(random.choice(THEMES), on_token=on_token)
+            return lyrics not in ("歌词生成失败", "AI服务不可用")
+        return run
+
+    import chat_with_ai
+
+    def run(on_token):
+        try:
+            chat_with_ai.ask(random.choice(MESSAGES), on_token=on_token)
+            return True
+        except Exception:
+            return False
+    return run
+
+
+def run_scenario(scenario, concurrency, requests, stream=True):
+    """用 concurrency 个线程一共发出 requests 个请求"""
+    result = LoadResult(f"{scenario}（并发 {concurrency}{'，流式' if stream else ''}）")
+    workers = [make_worker(scenario, i) for i in range(concurrency)]
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def loop(run):
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            first = []
+            start = time.perf_counter()
+
+            def on_token(token):
+                if not first:
+                    first.append(time.perf_counter() - start)
+
+            ok = run(on_token if stream else None)
+            result.add(time.perf_counter() - start, ok, first[0] if first else None)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(loop, workers))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以指定并发驱动心理助手、音乐工作室和聊天的真实代码路径，统计延迟、吞吐和错误率")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all", "mixed"), default="all",
+                        help="all 依次测试每个场景；mixed 同时运行所有场景，观察后台任务对交互式对话延迟的影响")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发线程数")
+    parser.add_argument("--requests", type=int, default=40, help="每个场景的请求总数")
+    parser.add_argument("--no-stream", action="store_true", help="使用非流式请求（不统计首 token 时间）")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="开启相同请求合并（默认关闭：样本提示词很少，并发用户常发出相同的提示词，合并后吞吐和延迟不真实）")
+    parser.add_argument("--fake", action="store_true", help="在进程内启动模拟 Ollama 服务，无需真实模型")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    # 压测的是模型调用本身，默认关闭响应缓存和相同请求合并；已显式设置的环境变量不覆盖
+    os.environ.setdefault("LLM_CACHE", "0")
+    if args.coalesce:
+        os.environ["LLM_COALESCE"] = "1"
+    else:
+        os.environ.setdefault("LLM_COALESCE", "0")
+    if args.fake:
+        server, url = start_fake_server(**fake_options(args))
+        # 必须在第一次 get_client() 之前设置
+        os.environ["OLLAMA_HOST"] = url
+        print(f"🧪 模拟 Ollama: {url}（首 token {args.ttft}秒，{args.token_rate} token/秒，"
+              f"并行 {args.parallel}，错误率 {args.error_rate:.0%}）")
+
+    # 记忆文件写到临时目录，不污染当前目录
+    workdir = tempfile.mkdtemp(prefix="load_bench_")
+    os.chdir(workdir)
+    print(f"🚀 并发 {args.concurrency}，每个场景 {args.requests} 个请求，数据目录 {workdir}")
+
+    if args.scenario == "mixed":
+        with ThreadPoolExecutor(max_workers=len(SCENARIOS)) as pool:
+            futures = [pool.submit(run_scenario, scenario, args.concurrency, args.requests, not args.no_stream)
+                       for scenario in SCENARIOS]
+        for future in futures:
+            future.result().report()
+    else:
+        scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+        for scenario in scenarios:
+            run_scenario(scenario, args.concurrency, args.requests, stream=not args.no_stream).report()
+    if args.fake:
+        print(f"\n🧪 模拟服务统计: {server.fake.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from memory_service import MemoryService
+from memory_store import JsonlMemoryStore
+from mental_health_assistant import LongTermMemory
+
+MESSAGES = ["今天有点累", "工作压力好大", "和朋友吵架了", "睡不着", "心情还不错", "不知道该怎么办"]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def simulate_user(user_id, turns, make_store):
+    """模拟一个用户连续聊天：每轮读上下文、写一条对话，返回每轮耗时"""
+    latencies = []
+    memory = LongTermMemory(user_id, store=make_store(user_id))
+    if not memory.memory["basic_info"].get("name"):
+        memory.update_basic_info(name=user_id)
+    for _ in range(turns):
+        start = time.perf_counter()
+        # 与助手每轮组装提示词时读取的内容相同
+        memory.profile_text()
+        memory.recent_turn_texts(3)
+        memory.add_conversation(random.choice(MESSAGES), "我理解你的感受。", "中性", "lexicon")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def simulate_user_async(service, user_id, turns):
+    latencies = []
+    await service.aset(user_id, "basic_info", {"name": user_id, "age": "", "interests": []})
+    for _ in range(turns):
+        start = time.perf_counter()
+        await service.arecent_history(user_id, 3)
+        await service.aappend_conversation(user_id, {
+            "timestamp": datetime.now().isoformat(),
+            "user_input": random.choice(MESSAGES),
+            "ai_response": "我理解你的感受。",
+            "emotion": "中性",
+        })
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies, elapsed):
+    print(f"\n📊 {name}")
+    print(f"   总轮数: {len(latencies)}，耗时 {elapsed:.2f}秒，吞吐 {len(latencies) / elapsed:.0f} 轮/秒")
+    print(f"   每轮延迟: p50 {statistics.median(latencies) * 1000:.2f}ms, "
+          f"p95 {percentile(latencies, 95) * 1000:.2f}ms, p99 {percentile(latencies, 99) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟大量用户同时聊天，测试长期记忆存储的吞吐和延迟")
+    parser.add_argument("--users", type=int, default=1000, help="用户数")
+    parser.add_argument("--turns", type=int, default=10, help="每个用户的对话轮数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发线程数")
+    parser.add_argument("--backend", choices=["sqlite", "jsonl", "both"], default="both")
+    parser.add_argument("--asyncio", action="store_true", help="sqlite 后端额外用 asyncio 接口测试一次")
+    parser.add_argument("--hot-users", type=int, default=256, help="MemoryService 常驻内存的用户数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="memory_bench_")
+    print(f"🚀 {args.users} 个用户 x {args.turns} 轮，并发 {args.concurrency}，数据目录 {workdir}")
+    users = [f"user{i}" for i in range(args.users)]
+
+    def run_threads(make_store):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda user: simulate_user(user, args.turns, make_store), users))
+        return [x for latencies in results for x in latencies], time.perf_counter() - start
+
+    if args.backend in ("sqlite", "both"):
+        service = MemoryService(os.path.join(workdir, "memory.db"), max_hot_users=args.hot_users)
+        latencies, elapsed = run_threads(service.store_for)
+        service.flush()
+        report("SQLite MemoryService（线程）", latencies, elapsed)
+        print(f"   服务统计: {service.stats()}")
+
+        if args.asyncio:
+            async def run_async():
+                semaphore = asyncio.Semaphore(args.concurrency)
+
+                async def bounded(user):
+                    async with semaphore:
+                        return await simulate_user_async(service, user, args.turns)
+
+                start = time.perf_counter()
+                results = await asyncio.gather(*(bounded(user) for user in users))
+                return [x for latencies in results for x in latencies], time.perf_counter() - start
+
+            latencies, elapsed = asyncio.run(run_async())
+            report("SQLite MemoryService（asyncio）", latencies, elapsed)
+        service.close()
+
+    if args.backend in ("jsonl", "both"):
+        latencies, elapsed = run_threads(lambda user: JsonlMemoryStore(user, directory=workdir))
+        report("每用户 JSONL 文件", latencies, elapsed)
+        print(f"   文件数: {len(os.listdir(workdir))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from batch_analyzer import iter_images, load_image
+from benchmark_memory import percentile
+from detection_summary import box_arrays
+from frame_tracker import iou_matrix
+from model_registry import get_model, timing_summary
+
+
+def match_detections(reference, candidate, iou_threshold=0.5):
+    """把两组检测结果按类别和 IoU 贪心配对，返回 (配对数, 配对的置信度差, 配对的 IoU)"""
+    ref_boxes, ref_conf, ref_cls = reference
+    boxes, conf, cls = candidate
+    iou = iou_matrix(ref_boxes, boxes)
+    if iou.size:
+        iou[ref_cls[:, None] != cls[None, :]] = 0
+    used_ref, used = set(), set()
+    conf_diff, ious = [], []
+    for flat in np.argsort(-iou, axis=None):
+        r, c = divmod(int(flat), iou.shape[1])
+        if iou[r, c] < iou_threshold:
+            break
+        if r in used_ref or c in used:
+            continue
+        used_ref.add(r)
+        used.add(c)
+        conf_diff.append(abs(float(ref_conf[r]) - float(conf[c])))
+        ious.append(float(iou[r, c]))
+    return len(used_ref), conf_diff, ious
+
+
+def time_model(model, images, runs, imgsz):
+    latencies = []
+    for _ in range(runs):
+        for image in images:
+            start = time.perf_counter()
+            model(image, imgsz=imgsz, verbose=False)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 PyTorch 与 ONNX/OpenVINO 后端的检测一致性和 CPU 推理速度")
+    parser.add_argument("--weights", default="yolov8n.pt", help="YOLO 权重文件")
+    parser.add_argument("--backend", choices=["onnx", "openvino"], default="onnx", help="要对比的导出后端")
+    parser.add_argument("--images", default=None, help="图片目录或 glob 模式，默认使用 ultralytics 自带的示例图片")
+    parser.add_argument("--runs", type=int, default=10, help="每张图片计时的轮数")
+    parser.add_argument("--imgsz", type=int, default=640, help="推理尺寸")
+    parser.add_argument("--min-agreement", type=float, default=0.95, help="一致性检查通过所需的召回率和精确率")
+    args = parser.parse_args()
+
+    if args.images is None:
+        from ultralytics.utils import ASSETS
+
+        args.images = str(ASSETS)
+    paths = list(iter_images(args.images))
+    images = [image for image in (load_image(path) for path in paths) if image is not None]
+    if not images:
+        print(f"❌ 没有找到可用的图片: {args.images}")
+        return
+    print(f"🖼️ {len(images)} 张图片，每张计时 {args.runs} 轮")
+
+    reference = get_model(args.weights, backend="torch", imgsz=args.imgsz)
+    candidate = get_model(args.weights, backend=args.backend, imgsz=args.imgsz)
+    print(f"✅ 模型就绪（{timing_summary()}）")
+
+    # 一致性：以 PyTorch 结果为参照
+    matched = total_ref = total = 0
+    conf_diff, ious = [], []
+    for image in images:
+        ref = box_arrays(reference(image, imgsz=args.imgsz, verbose=False)[0])
+        out = box_arrays(candidate(image, imgsz=args.imgsz, verbose=False)[0])
+        count, diff, overlap = match_detections(ref, out)
+        matched += count
+        total_ref += len(ref[2])
+        total += len(out[2])
+        conf_diff += diff
+        ious += overlap
+    recall = matched / total_ref if total_ref else 1.0
+    precision = matched / total if total else 1.0
+    print(f"\n🎯 一致性（参照 PyTorch）: 召回率 {recall:.1%}，精确率 {precision:.1%}，"
+          f"检测数 {total_ref} → {total}")
+    if conf_diff:
+        print(f"   配对框平均 IoU {statistics.mean(ious):.3f}，置信度平均差 {statistics.mean(conf_diff):.4f}，"
+              f"最大差 {max(conf_diff):.4f}")
+    passed = recall >= args.min_agreement and precision >= args.min_agreement
+    print("   ✅ 一致性检查通过" if passed else "   ❌ 一致性检查未通过")
+
+    print("\n⏱️ 单张图片推理延迟:")
+    results = {}
+    for name, model in (("torch", reference), (args.backend, candidate)):
+        latencies = time_model(model, images, args.runs, args.imgsz)
+        results[name] = statistics.median(latencies)
+        print(f"   {name:>8}: p50 {results[name] * 1000:.1f}ms, p95 {percentile(latencies, 95) * 1000:.1f}ms, "
+              f"{1 / results[name]:.1f} 张/秒")
+    print(f"   🚀 {args.backend} 相对 PyTorch 加速 {results['torch'] / results[args.backend]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
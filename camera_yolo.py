@@ -1,107 +1,406 @@
-import cv2
-from ultralytics import YOLO
+import argparse
+import os
+import queue
+import threading
 import time
+from collections import deque
+
+import cv2
+
+import metrics
+from detection_log import open_event_log
+from detection_summary import box_arrays
+from frame_tracker import AdaptiveDetector
+from model_registry import get_model, timing_summary
+
+
+class StageStats:
+    """记录某个阶段最近若干次的耗时（秒）"""
+
+    def __init__(self, name, window=300):
+        self.name = name
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        metrics.observe("pipeline_stage_seconds", seconds, stage=self.name)
+
+    def summary(self):
+        if not self.samples:
+            return f"{self.name}: 无数据"
+        ordered = sorted(self.samples)
+        mean = sum(ordered) / len(ordered)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return f"{self.name}: 平均 {mean * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms"
+
+
+def put_latest(q, item):
+    """放入队列；队列已满时丢掉最旧的一项，返回丢弃的数量"""
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            if dropped:
+                metrics.inc("frames_dropped_total", dropped)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+def draw_info(frame, lines):
+    """在画面左上角写几行状态信息"""
+    for i, text in enumerate(lines):
+        y_position = 30 + i * 25
+        cv2.putText(frame, text, (10, y_position),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+
+def handle_key(annotated_frame):
+    """按键处理，返回 False 表示退出"""
+    key = cv2.waitKey(1) & 0xFF
+    if key == ord('q') or key == ord('Q'):
+        return False
+    elif key == ord('s') or key == ord('S'):
+        # 保存截图
+        timestamp = int(time.time())
+        filename = f"yolo_capture_{timestamp}.jpg"
+        cv2.imwrite(filename, annotated_frame)
+        print(f"📸 截图已保存: {filename}")
+    return True
+
+
+def yolo_detector(model):
+    """每帧都做完整检测"""
+    def detect(frame):
+        results = model(frame, verbose=False)
+        metrics.observe_yolo(results, "camera")
+        return results[0]
+    return detect
+
+
+class DisplayRenderer:
+    """在窗口中显示带标注的画面，返回 False 表示用户要求退出"""
+
+    def __init__(self, title='YOLO实时摄像头检测 - 摄像头0'):
+        self.title = title
+        self.frames = 0
+        self.detections = 0
+        self.start_time = time.time()
+
+    def __call__(self, frame_index, result, extra_lines=()):
+        # 获取检测结果
+        current_detections = len(result.boxes) if result.boxes is not None else 0
+        self.detections += current_detections
+
+        # 在帧上绘制检测结果
+        annotated_frame = result.plot()
+
+        # 计算并显示FPS
+        self.frames += 1
+        elapsed_time = time.time() - self.start_time
+        fps = self.frames / elapsed_time if elapsed_time > 0 else 0
+
+        draw_info(annotated_frame, [
+            f"FPS: {fps:.1f}",
+            f"检测数: {current_detections}",
+            f"总检测: {self.detections}",
+            *extra_lines,
+            "按 Q 退出 | 按 S 截图"
+        ])
+
+        # 显示结果
+        cv2.imshow(self.title, annotated_frame)
+        return handle_key(annotated_frame)
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+class HeadlessRenderer:
+    """无界面模式：不绘制、不显示，只把检测结果写入事件日志
+
+    只有抽样的帧（每 sample_every 帧一张）或出现 render_classes 中类别的帧
+    （每 render_interval 秒最多一张）才绘制标注并保存到 sample_dir。
+    """
+
+    def __init__(self, log, sample_every=0, sample_dir="samples", render_classes=(), render_interval=1.0,
+                 max_frames=None, duration=None):
+        self.log = log
+        self.sample_every = sample_every
+        self.sample_dir = sample_dir
+        self.render_classes = set(render_classes)
+        self.render_interval = render_interval
+        self.max_frames = max_frames
+        self.duration = duration
+        self.frames = 0
+        self.detections = 0
+        self.rendered = 0
+        self.start_time = time.time()
+        self._last_render = 0.0
+        if sample_every or self.render_classes:
+            os.makedirs(sample_dir, exist_ok=True)
+
+    def _should_render(self, frame_index, cls, names):
+        if self.sample_every and frame_index % self.sample_every == 0:
+            return True
+        if self.render_classes and time.time() - self._last_render >= self.render_interval:
+            return any(names.get(int(c)) in self.render_classes for c in cls)
+        return False
+
+    def __call__(self, frame_index, result, extra_lines=()):
+        boxes, conf, cls = box_arrays(result)
+        self.log.write(frame_index, boxes, conf, cls)
+        self.frames += 1
+        self.detections += len(cls)
+
+        if self._should_render(frame_index, cls, result.names):
+            self._last_render = time.time()
+            path = os.path.join(self.sample_dir, f"frame_{frame_index:08d}.jpg")
+            cv2.imwrite(path, result.plot())
+            self.rendered += 1
+
+        if self.max_frames and self.frames >= self.max_frames:
+            return False
+        if self.duration and time.time() - self.start_time >= self.duration:
+            return False
+        return True
+
+    def close(self):
+        self.log.close()
+        print(f"   事件日志: {self.log.path}（{self.log.records} 条检测），保存标注画面 {self.rendered} 张")
+
+
+def run_serial(detect, cap, render):
+    """原始的单线程循环：读帧、推理、绘制、显示依次进行"""
+    start_time = time.time()
+    frame_index = 0
+
+    try:
+        while True:
+            # 读取帧
+            ret, frame = cap.read()
+
+            if not ret:
+                print("❌ 无法读取视频帧")
+                break
+
+            # 使用YOLO进行目标检测
+            result = detect(frame)
+
+            keep_running = render(frame_index, result)
+            frame_index += 1
+            if not keep_running:
+                break
+    except KeyboardInterrupt:
+        print("\n⏹️ 已停止")
+
+    return {"frames": render.frames, "detections": render.detections, "elapsed": time.time() - start_time}
+
+
+class CameraPipeline:
+    """采集、推理、显示三个阶段分别运行，用容量为 1 的队列连接
+
+    采集线程一直读帧，推理跟不上时丢掉旧帧，保证推理和显示的总是最新画面，
+    摄像头驱动的缓冲区也不会越积越多。显示必须在主线程（OpenCV 窗口的要求）。
+
+    drop=False 时不丢帧：队列满了就等待，每一帧都会被检测和记录（无界面模式写完整的事件日志）。
+    """
+
+    def __init__(self, detect, cap, render, queue_size=1, drop=True):
+        self.detect = detect
+        self.cap = cap
+        self.render = render
+        self.drop = drop
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.stats = {name: StageStats(name) for name in ("采集", "推理", "显示", "端到端")}
+        self.captured = 0
+        self.inferred = 0
+        self.dropped = 0
+
+    def _put(self, q, item):
+        """按 drop 设置放入队列，返回丢弃的数量；不丢帧时阻塞等待，直到放入或流水线停止"""
+        if self.drop:
+            return put_latest(q, item)
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return 0
+            except queue.Full:
+                continue
+        return 0
+
+    def capture_loop(self):
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret:
+                print("❌ 无法读取视频帧")
+                break
+            captured_at = time.perf_counter()
+            self.stats["采集"].add(captured_at - start)
+            self.dropped += self._put(self.frames, (self.captured, frame, captured_at))
+            self.captured += 1
+        self._put(self.frames, None)
+
+    def infer_loop(self):
+        while not self.stop_event.is_set():
+            item = self.frames.get()
+            if item is None:
+                break
+            frame_index, frame, captured_at = item
+            start = time.perf_counter()
+            result = self.detect(frame)
+            self.stats["推理"].add(time.perf_counter() - start)
+            self.inferred += 1
+            self.dropped += self._put(self.results, (frame_index, result, captured_at))
+        self._put(self.results, None)
+
+    def run(self):
+        threads = [threading.Thread(target=self.capture_loop, name="capture", daemon=True),
+                   threading.Thread(target=self.infer_loop, name="infer", daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        start_time = time.time()
+        try:
+            while True:
+                item = self.results.get()
+                if item is None:
+                    break
+                frame_index, result, captured_at = item
+                render_start = time.perf_counter()
+
+                keep_running = self.render(frame_index, result, [
+                    f"推理 {self.stats['推理'].samples[-1] * 1000:.0f}ms | 丢帧 {self.dropped}"])
+
+                now = time.perf_counter()
+                self.stats["显示"].add(now - render_start)
+                self.stats["端到端"].add(now - captured_at)
+                if not keep_running:
+                    break
+        except KeyboardInterrupt:
+            print("\n⏹️ 已停止")
+        finally:
+            self.stop_event.set()
+            # 唤醒可能阻塞在空队列上的推理线程
+            put_latest(self.frames, None)
+            for thread in threads:
+                thread.join(timeout=2)
+
+        return {"frames": self.render.frames, "detections": self.render.detections,
+                "elapsed": time.time() - start_time}
+
+    def print_stats(self):
+        print(f"   采集帧数: {self.captured}，推理帧数: {self.inferred}，丢弃旧帧: {self.dropped}")
+        for stats in self.stats.values():
+            print(f"   {stats.summary()}")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="YOLO 摄像头实时检测")
+    parser.add_argument("--source", default="0", help="摄像头索引，或视频文件路径 / RTSP 地址")
+    parser.add_argument("--mode", choices=["pipeline", "serial"], default="pipeline",
+                        help="pipeline: 采集/推理/显示多线程流水线；serial: 单线程依次执行")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="每隔若干帧才做完整检测，中间帧用跟踪器外推；画面变化大时立即检测")
+    parser.add_argument("--target-fps", type=float, default=15, help="自适应模式的目标帧率")
+    parser.add_argument("--max-interval", type=int, default=15, help="自适应模式两次检测之间最多间隔的帧数")
+    parser.add_argument("--motion-threshold", type=float, default=0.03, help="触发立即检测的画面变化分数（0~1）")
+    parser.add_argument("--headless", action="store_true",
+                        help="无界面模式：不绘制不显示，只写检测事件日志；流水线不丢帧，每一帧都会记录")
+    parser.add_argument("--events", default="detections.bin",
+                        help="无界面模式的事件日志（.jsonl 为文本，其余为二进制，用 detection_log.read_events 读取）")
+    parser.add_argument("--sample-every", type=int, default=0, help="无界面模式下每隔多少帧保存一张标注画面（0 不保存）")
+    parser.add_argument("--render-classes", default="", help="出现这些类别时保存标注画面，逗号分隔，如 person,car")
+    parser.add_argument("--sample-dir", default="samples", help="标注画面保存目录")
+    parser.add_argument("--duration", type=float, default=None, help="无界面模式运行秒数，默认直到视频结束或 Ctrl+C")
+    args = parser.parse_args()
+    # 纯数字是摄像头索引，其余按视频文件或流地址交给 OpenCV
+    source = int(args.source) if args.source.isdigit() else args.source
+
     print("🚀 启动YOLO摄像头检测...")
-    print("摄像头索引: 0 (默认摄像头)")
-    print("按 'Q' 键退出程序")
-    print("按 'S' 键保存截图")
+    print(f"视频源: {source}")
+    print(f"运行模式: {args.mode}")
+    if args.headless:
+        print(f"无界面模式，检测事件写入: {args.events}（Ctrl+C 退出）")
+    else:
+        print("按 'Q' 键退出程序")
+        print("按 'S' 键保存截图")
     print("-" * 50)
 
     # 加载YOLO模型
     try:
-        model = YOLO('yolov8n.pt')
-        print("✅ YOLO模型加载成功")
+        model = get_model('yolov8n.pt')
+        print(f"✅ YOLO模型加载成功（{timing_summary()}）")
     except Exception as e:
         print(f"❌ 模型加载失败: {e}")
         return
 
-    # 打开摄像头（使用索引0）
-    cap = cv2.VideoCapture(0)
+    cap = cv2.VideoCapture(source)
 
     if not cap.isOpened():
-        print("❌ 无法打开摄像头0")
+        print(f"❌ 无法打开视频源 {source}")
         return
 
     # 设置摄像头参数以获得更好的性能
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
     cap.set(cv2.CAP_PROP_FPS, 30)
+    # 驱动只缓存 1 帧，避免读到积压的旧画面（部分后端不支持，忽略即可）
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
-    print("✅ 摄像头0已成功打开")
+    print(f"✅ 视频源 {source} 已成功打开")
     print("🔄 开始实时检测...")
 
-    frame_count = 0
-    start_time = time.time()
-    detection_count = 0
-
-    while True:
-        # 读取帧
-        ret, frame = cap.read()
-
-        if not ret:
-            print("❌ 无法读取视频帧")
-            break
-
-        # 使用YOLO进行目标检测
-        results = model(frame)
-
-        # 获取检测结果
-        current_detections = 0
-        if results[0].boxes is not None:
-            current_detections = len(results[0].boxes)
-            detection_count += current_detections
-
-        # 在帧上绘制检测结果
-        annotated_frame = results[0].plot()
-
-        # 计算并显示FPS
-        frame_count += 1
-        elapsed_time = time.time() - start_time
-        fps = frame_count / elapsed_time if elapsed_time > 0 else 0
+    adaptive = None
+    if args.adaptive:
+        adaptive = AdaptiveDetector(model, target_fps=args.target_fps, max_interval=args.max_interval,
+                                    motion_threshold=args.motion_threshold)
+        detect = adaptive
+    else:
+        detect = yolo_detector(model)
 
-        # 在画面上添加信息文字
-        info_text = [
-            f"FPS: {fps:.1f}",
-            f"检测数: {current_detections}",
-            f"总检测: {detection_count}",
-            "按 Q 退出 | 按 S 截图"
-        ]
+    if args.headless:
+        render_classes = [name.strip() for name in args.render_classes.split(",") if name.strip()]
+        render = HeadlessRenderer(open_event_log(args.events, model.names), sample_every=args.sample_every,
+                                  sample_dir=args.sample_dir, render_classes=render_classes,
+                                  duration=args.duration)
+    else:
+        render = DisplayRenderer(f'YOLO实时摄像头检测 - {source}')
 
-        for i, text in enumerate(info_text):
-            y_position = 30 + i * 25
-            cv2.putText(annotated_frame, text, (10, y_position),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-        # 显示结果
-        cv2.imshow('YOLO实时摄像头检测 - 摄像头0', annotated_frame)
-
-        # 按键处理
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q') or key == ord('Q'):
-            break
-        elif key == ord('s') or key == ord('S'):
-            # 保存截图
-            timestamp = int(time.time())
-            filename = f"yolo_capture_{timestamp}.jpg"
-            cv2.imwrite(filename, annotated_frame)
-            print(f"📸 截图已保存: {filename}")
+    pipeline = None
+    if args.mode == "pipeline":
+        # 无界面模式的事件日志要完整记录每一帧，不能像实时显示那样丢掉旧帧
+        pipeline = CameraPipeline(detect, cap, render, drop=not args.headless)
+        stats = pipeline.run()
+    else:
+        stats = run_serial(detect, cap, render)
 
     # 释放资源
     cap.release()
-    cv2.destroyAllWindows()
+    render.close()
 
     # 显示统计信息
-    total_time = time.time() - start_time
+    total_time = stats["elapsed"]
     print(f"\n📊 检测统计:")
     print(f"   运行时间: {total_time:.1f}秒")
-    print(f"   处理帧数: {frame_count}")
-    print(f"   平均FPS: {frame_count / total_time:.1f}")
-    print(f"   总检测数: {detection_count}")
+    print(f"   处理帧数: {stats['frames']}")
+    print(f"   平均FPS: {stats['frames'] / total_time:.1f}")
+    print(f"   总检测数: {stats['detections']}")
+    if pipeline is not None:
+        pipeline.print_stats()
+    if adaptive is not None:
+        print(f"   {adaptive.summary()}")
     print("🎉 检测完成!")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
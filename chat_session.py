@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from ollama_client import get_client
+from prompt_builder import context_budget, get_tokenizer
+
+
+class ChatSession:
+    """一个用户的 /api/chat 多轮会话
+
+    system 消息在会话开始时生成一次，之后每轮只在消息列表末尾追加，
+    发给 Ollama 的前缀与上一轮完全相同，服务端可以复用已算好的 KV 缓存，只需处理新增的消息。
+    消息总量超过预算时一次性丢掉较早的一半对话（会让前缀失效一次），而不是每轮都滑动窗口。
+    """
+
+    def __init__(self, system_prompt, history=(), client=None, model=None, budget=None, tokenizer=None):
+        self.client = client or get_client()
+        self.model = model or self.client.config.model
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.budget = budget or context_budget(self.model)
+        self.messages = [{"role": "system", "content": system_prompt}]
+        for chat in history:
+            self.messages.append({"role": "user", "content": chat["user_input"]})
+            self.messages.append({"role": "assistant", "content": chat["ai_response"]})
+        self._tokens = sum(self.tokenizer.count(m["content"]) for m in self.messages)
+        self._lock = threading.Lock()
+        self.created = self.last_used = time.time()
+        self.turns = 0
+        self.rebases = 0
+        self.last_stats = None
+        self._trim()
+
+    def _append(self, role, content):
+        self.messages.append({"role": role, "content": content})
+        self._tokens += self.tokenizer.count(content)
+
+    def _trim(self):
+        """超出预算时丢掉较早的一半对话（保留 system 消息），返回是否改变了前缀"""
+        if self._tokens <= self.budget:
+            return False
+        while self._tokens > self.budget // 2 and len(self.messages) > 3:
+            for message in self.messages[1:3]:
+                self._tokens -= self.tokenizer.count(message["content"])
+            del self.messages[1:3]
+        self.rebases += 1
+        return True
+
+    def send(self, content, on_token=None, timeout=60):
+        """发送一条用户消息并返回回答；传入 on_token 时流式输出
+
+        请求失败时撤回这条用户消息，会话保持原样。
+        """
+        with self._lock:
+            self.last_used = time.time()
+            self._trim()
+            self._append("user", content)
+            try:
+                if on_token is None:
+                    result = self.client.chat(self.messages, model=self.model, timeout=timeout)
+                    reply = result.get("message", {}).get("content", "")
+                    self.last_stats = None
+                else:
+                    stream = self.client.stream_chat(self.messages, model=self.model, timeout=timeout)
+                    reply = stream.consume(on_token)
+                    self.last_stats = stream.stats()
+            except Exception:
+                self._tokens -= self.tokenizer.count(content)
+                self.messages.pop()
+                raise
+            self._append("assistant", reply)
+            self.turns += 1
+            return reply
+
+    def token_count(self):
+        return self._tokens
+
+
+class ChatSessionManager:
+    """按用户管理 ChatSession：空闲超过 ttl 秒的会话过期，最多同时保留 max_sessions 个（LRU）
+
+    会话过期后，下次对话会用最新的用户资料和摘要重新生成 system 消息。
+    """
+
+    def __init__(self, ttl=1800, max_sessions=1000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+
+    def get(self, user_id, factory):
+        """返回该用户仍有效的会话，没有或已过期时调用 factory() 新建"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(user_id)
+            if session is not None:
+                self._sessions.move_to_end(user_id)
+                return session
+
+        # 新建会话可能要读取记忆、调用分词器，放在锁外面
+        session = factory()
+        with self._lock:
+            existing = self._sessions.get(user_id)
+            if existing is not None:
+                return existing
+            self._sessions[user_id] = session
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.expired += 1
+        return session
+
+    def end(self, user_id):
+        """结束该用户的会话（例如用户资料变化后需要重建 system 消息）"""
+        with self._lock:
+            return self._sessions.pop(user_id, None) is not None
+
+    def _expire(self, now):
+        # OrderedDict 按最近使用排序，从最旧的开始检查
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.ttl:
+                break
+            del self._sessions[user_id]
+            self.expired += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "created": self.created,
+                "expired": self.expired,
+            }
+
+
+_default_manager = None
+_default_lock = threading.Lock()
+
+
+def get_session_manager():
+    """返回进程内共享的 ChatSessionManager（过期时间读取环境变量 CHAT_SESSION_TTL，单位秒）"""
+    global _default_manager
+    if _default_manager is None:
+        with _default_lock:
+            if _default_manager is None:
+                _default_manager = ChatSessionManager(ttl=float(os.environ.get("CHAT_SESSION_TTL", 1800)))
+                metrics.register_collector("chat_sessions", _default_manager.stats)
+    return _default_manager
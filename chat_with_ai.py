@@ -1,36 +1,33 @@
 import requests
-import json
 
+from ollama_client import OllamaError, get_client, print_token
 
-def simple_chat():
-    """使用正确的模型名称与AI对话"""
 
-    # 正确的API地址
-    url = "http://localhost:11434/api/generate"
+def ask(user_message, on_token=None):
+    """流式请求一次回答，返回 TokenStream（已读完，可查看统计信息）"""
+    # 地址和模型名称统一在 ollama_client 中配置（OLLAMA_HOST / OLLAMA_MODEL）
+    stream = get_client().stream(user_message)
+    stream.consume(on_token)
+    return stream
 
-    user_message = input("你想问什么：")
 
-    # 使用你已安装的模型名称
-    data = {
-        "model": "qwen2:0.5b",  # 改成你实际安装的模型
-        "prompt": user_message,
-        "stream": False
-    }
+def simple_chat():
+    """使用共享的 Ollama 客户端与AI对话"""
+
+    user_message = input("你想问什么：")
 
     try:
         print("正在发送请求...")
-        response = requests.post(url, json=data, timeout=60)
-
-        print(f"响应状态码: {response.status_code}")
 
-        if response.status_code == 200:
-            result = response.json()
-            print("\n🤖 AI回答：")
-            print(result['response'])
-        else:
-            print(f"请求失败：{response.status_code}")
-            print(f"错误信息：{response.text}")
+        # 边生成边显示，不必等整段回答完成
+        print("\n🤖 AI回答：")
+        stream = ask(user_message, on_token=print_token)
+        print()
+        print(stream.summary())
 
+    except OllamaError as e:
+        print(f"请求失败：{e.status_code}")
+        print(f"错误信息：{e}")
     except requests.exceptions.ConnectionError:
         print("❌ 连接被拒绝，请确保Ollama正在运行")
         print("提示：在CMD中运行 'ollama serve'")
@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# 二进制事件日志中每个检测框一条记录，共 34 字节
+EVENT_DTYPE = np.dtype([
+    ("frame", "<u4"),
+    ("time", "<f8"),
+    ("cls", "<u2"),
+    ("conf", "<f4"),
+    ("box", "<f4", (4,)),
+], align=False)
+
+
+class JsonlEventLog:
+    """每个有检测结果的帧写一行 JSON：{"frame", "time", "detections": [[cls, conf, x1, y1, x2, y2], ...]}"""
+
+    def __init__(self, path, names=None):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        if names is not None and self._file.tell() == 0:
+            self._file.write(json.dumps({"names": names}, ensure_ascii=False) + "\n")
+        self.records = 0
+
+    def write(self, frame_index, boxes, conf, cls, timestamp=None):
+        if len(cls) == 0:
+            return
+        rows = [[int(c), round(float(p), 3)] + [round(float(v), 1) for v in box]
+                for c, p, box in zip(cls, conf, boxes)]
+        record = {"frame": int(frame_index), "time": timestamp or time.time(), "detections": rows}
+        self._file.write(json.dumps(record) + "\n")
+        self.records += len(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class BinaryEventLog:
+    """定长记录的二进制事件日志（EVENT_DTYPE），用 read_events 直接读回 NumPy 结构化数组
+
+    类别名称表单独写在 <path>.names.json。
+    """
+
+    def __init__(self, path, names=None, flush_every=256):
+        self.path = path
+        self.flush_every = flush_every
+        if names is not None:
+            with open(f"{path}.names.json", 'w', encoding='utf-8') as f:
+                json.dump({str(k): v for k, v in dict(names).items()}, f, ensure_ascii=False)
+        self._file = open(path, 'ab')
+        self._buffer = []
+        self._buffered = 0
+        self.records = 0
+
+    def write(self, frame_index, boxes, conf, cls, timestamp=None):
+        count = len(cls)
+        if count == 0:
+            return
+        events = np.empty(count, EVENT_DTYPE)
+        events["frame"] = frame_index
+        events["time"] = timestamp or time.time()
+        events["cls"] = cls
+        events["conf"] = conf
+        events["box"] = boxes
+        self._buffer.append(events)
+        self._buffered += count
+        self.records += count
+        if self._buffered >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            np.concatenate(self._buffer).tofile(self._file)
+            self._file.flush()
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def read_events(path):
+    """读取二进制事件日志；进程中途退出留下的不完整末条记录会被忽略"""
+    count = os.path.getsize(path) // EVENT_DTYPE.itemsize
+    return np.fromfile(path, dtype=EVENT_DTYPE, count=count)
+
+
+def open_event_log(path, names=None):
+    """按扩展名选择格式：.jsonl 为文本，其余为二进制"""
+    if path.endswith(".jsonl"):
+        return JsonlEventLog(path, names)
+    return BinaryEventLog(path, names)
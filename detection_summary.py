@@ -0,0 +1,79 @@
+import numpy as np
+
+# 单个检测框：类别 id、置信度、xyxy 坐标
+DETECTION_DTYPE = np.dtype([
+    ("cls", "<u2"),
+    ("conf", "<f4"),
+    ("box", "<f4", (4,)),
+])
+
+
+def box_arrays(result):
+    """从检测结果中一次性取出 (N,4) 坐标、(N,) 置信度和 (N,) 类别
+
+    支持 YOLO 的结果，以及 boxes 已经是数组的结果（如跟踪器外推的 TrackedResult）。
+    """
+    boxes = result.boxes
+    if isinstance(boxes, np.ndarray):
+        return boxes, result.conf, result.cls
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32)
+    # 三次整块拷贝，代替逐个框 .item() 的多次同步
+    return (boxes.xyxy.cpu().numpy().astype(np.float32),
+            boxes.conf.cpu().numpy().astype(np.float32),
+            boxes.cls.cpu().numpy().astype(np.int32))
+
+
+class DetectionSummary:
+    """一张图的检测结果，保存为按置信度从高到低排列的结构化数组（DETECTION_DTYPE）"""
+
+    def __init__(self, detections, names):
+        self.detections = detections
+        self.names = names
+
+    @classmethod
+    def from_result(cls, result, conf=0.0, top_k=None):
+        """从 YOLO 结果构造，可按置信度过滤并只保留前 top_k 个"""
+        boxes, scores, classes = box_arrays(result)
+        keep = np.flatnonzero(scores >= conf) if conf > 0 else np.arange(len(scores))
+        order = keep[np.argsort(-scores[keep], kind="stable")]
+        if top_k is not None:
+            order = order[:top_k]
+        detections = np.empty(len(order), DETECTION_DTYPE)
+        detections["cls"] = classes[order]
+        detections["conf"] = scores[order]
+        detections["box"] = boxes[order]
+        return cls(detections, result.names)
+
+    def __len__(self):
+        return len(self.detections)
+
+    def _name(self, class_id):
+        return self.names.get(class_id, str(class_id)) if isinstance(self.names, dict) else self.names[class_id]
+
+    def labels(self):
+        """每个检测框的类别名称，按置信度从高到低"""
+        return [self._name(c) for c in self.detections["cls"].tolist()]
+
+    def counts(self):
+        """各类别的检测数，按数量从多到少"""
+        if not len(self.detections):
+            return {}
+        bincount = np.bincount(self.detections["cls"])
+        present = np.flatnonzero(bincount)
+        present = present[np.argsort(-bincount[present], kind="stable")]
+        return {self._name(c): int(bincount[c]) for c in present.tolist()}
+
+    def top(self, k):
+        return DetectionSummary(self.detections[:k], self.names)
+
+    def format_lines(self):
+        """用于显示的 "类别(置信度)" 列表"""
+        return [f"{name}({conf:.1%})" for name, conf in zip(self.labels(), self.detections["conf"].tolist())]
+
+    def to_records(self):
+        """转换为可 JSON 序列化的列表"""
+        confidences = np.round(self.detections["conf"].astype(np.float64), 4).tolist()
+        boxes = np.round(self.detections["box"].astype(np.float64), 1).tolist()
+        return [{"class": name, "confidence": conf, "box": box}
+                for name, conf, box in zip(self.labels(), confidences, boxes)]
@@ -0,0 +1,179 @@
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+EMOTIONS = ["快乐", "悲伤", "愤怒", "焦虑", "压力", "平静", "兴奋", "孤独", "困惑", "中性"]
+
+# 情绪词典：关键词 -> 权重。匹配时长词优先，"不开心"不会再被算作"开心"
+LEXICON = {
+    "快乐": {"开心": 1.0, "高兴": 1.0, "快乐": 1.0, "幸福": 1.0, "愉快": 1.0, "满足": 0.8, "喜欢": 0.6,
+             "不错": 0.6, "太好了": 1.0, "哈哈": 0.8, "舒服": 0.6, "感谢": 0.6, "谢谢": 0.5, "顺利": 0.6},
+    "悲伤": {"难过": 1.0, "伤心": 1.0, "悲伤": 1.0, "痛苦": 1.0, "想哭": 1.2, "哭了": 1.0, "失落": 1.0,
+             "沮丧": 1.0, "不开心": 1.2, "心碎": 1.2, "绝望": 1.2, "失恋": 1.0, "去世": 1.0, "遗憾": 0.6},
+    "愤怒": {"生气": 1.0, "愤怒": 1.0, "气死": 1.2, "火大": 1.0, "讨厌": 0.8, "恼火": 1.0, "烦死": 0.8,
+             "受不了": 0.8, "凭什么": 0.8, "不公平": 0.8, "可恶": 1.0, "骂": 0.6},
+    "焦虑": {"焦虑": 1.2, "担心": 1.0, "紧张": 1.0, "害怕": 1.0, "不安": 1.0, "慌": 0.8, "失眠": 0.8,
+             "睡不着": 0.8, "怎么办": 0.6, "恐惧": 1.0, "忐忑": 1.0, "考试": 0.4},
+    "压力": {"压力": 1.2, "好累": 1.0, "太累": 1.0, "疲惫": 1.0, "加班": 0.8, "忙不过来": 1.0, "喘不过气": 1.2,
+             "撑不住": 1.0, "任务": 0.4, "截止": 0.6, "deadline": 0.8, "崩溃": 0.8, "负担": 0.8, "累": 0.6},
+    "平静": {"平静": 1.2, "放松": 1.0, "安心": 1.0, "还好": 0.6, "淡定": 1.0, "平和": 1.0, "安静": 0.6,
+             "踏实": 0.8, "冷静": 0.8},
+    "兴奋": {"兴奋": 1.2, "激动": 1.0, "太棒了": 1.0, "期待": 0.8, "迫不及待": 1.2, "好耶": 1.0, "终于": 0.5,
+             "录取": 0.8, "中奖": 1.0, "！！": 0.6},
+    "孤独": {"孤独": 1.2, "寂寞": 1.2, "一个人": 0.8, "没人": 0.8, "没有朋友": 1.2, "孤单": 1.2, "被忽视": 1.0,
+             "想家": 0.8, "冷落": 0.8},
+    "困惑": {"困惑": 1.2, "迷茫": 1.2, "不知道": 0.6, "不明白": 0.8, "为什么": 0.5, "纠结": 1.0, "搞不懂": 1.0,
+             "不确定": 0.8, "该不该": 0.8, "疑惑": 1.0},
+    "中性": {},
+}
+
+
+class LexiconClassifier:
+    """基于情绪词典打分的分类器，不需要任何模型"""
+
+    def __init__(self, lexicon=None, smoothing=0.5):
+        self.lexicon = lexicon or LEXICON
+        self.smoothing = smoothing
+        # 所有关键词按长度倒序，保证长词先匹配
+        self._keywords = sorted(
+            ((word, label, weight) for label, words in self.lexicon.items() for word, weight in words.items()),
+            key=lambda item: len(item[0]), reverse=True)
+
+    def scores(self, text):
+        text = text.lower()
+        used = [False] * len(text)
+        scores = {}
+        for word, label, weight in self._keywords:
+            start = text.find(word)
+            while start != -1:
+                end = start + len(word)
+                if not any(used[start:end]):
+                    used[start:end] = [True] * len(word)
+                    scores[label] = scores.get(label, 0.0) + weight
+                start = text.find(word, end)
+        return scores
+
+    def predict(self, text):
+        """返回 (情绪, 置信度)。没有命中任何关键词时返回低置信度的中性"""
+        scores = self.scores(text)
+        if not scores:
+            return "中性", 0.0
+        label = max(scores, key=scores.get)
+        return label, scores[label] / (sum(scores.values()) + self.smoothing)
+
+
+class NaiveBayesClassifier:
+    """字符 n-gram 哈希特征上的多项式朴素贝叶斯，用 NumPy 向量化训练和预测
+
+    训练数据来自 conversation_history 里记录的 (user_input, emotion)。
+    """
+
+    def __init__(self, n_features=2 ** 14, ngram_range=(1, 2), alpha=0.5):
+        if np is None:
+            raise ImportError("NaiveBayesClassifier 需要 numpy，请运行: pip install numpy")
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.alpha = alpha
+        self.labels = list(EMOTIONS)
+        self.log_prior = None
+        self.log_likelihood = None
+
+    def _features(self, text):
+        # crc32 是稳定哈希，保存的模型在不同进程间可以复用
+        indices = []
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            for i in range(len(text) - n + 1):
+                indices.append(zlib.crc32(text[i:i + n].encode("utf-8")) % self.n_features)
+        return indices
+
+    @property
+    def trained(self):
+        return self.log_likelihood is not None
+
+    def fit(self, texts, labels):
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        rows, cols = [], []
+        class_counts = np.zeros(len(self.labels), dtype=np.float64)
+        for text, label in zip(texts, labels):
+            indices = self._features(text)
+            rows.extend([label_index[label]] * len(indices))
+            cols.extend(indices)
+            class_counts[label_index[label]] += 1
+
+        # 稀疏累加 n-gram 计数，不构造 (样本数 x 特征数) 的稠密矩阵
+        feature_counts = np.full((len(self.labels), self.n_features), self.alpha, dtype=np.float64)
+        np.add.at(feature_counts, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+
+        self.log_prior = np.log((class_counts + 1.0) / (class_counts.sum() + len(self.labels)))
+        self.log_likelihood = np.log(feature_counts / feature_counts.sum(axis=1, keepdims=True))
+        return self
+
+    def fit_history(self, conversation_history, min_samples=20):
+        """用记忆中带情绪标签的历史对话训练，样本不足时返回 False
+
+        只使用大模型给出的标签（没有 emotion_source 字段的旧记录也来自大模型），
+        避免本地分类器用自己的输出训练自己。
+        """
+        pairs = [(chat["user_input"], chat["emotion"]) for chat in conversation_history
+                 if chat.get("emotion") in EMOTIONS and chat.get("user_input")
+                 and chat.get("emotion_source", "llm") == "llm"]
+        if len(pairs) < min_samples:
+            return False
+        texts, labels = zip(*pairs)
+        self.fit(texts, labels)
+        return True
+
+    def predict_proba(self, texts):
+        joint = np.empty((len(texts), len(self.labels)))
+        for row, text in enumerate(texts):
+            joint[row] = self.log_likelihood[:, self._features(text)].sum(axis=1) + self.log_prior
+        joint -= joint.max(axis=1, keepdims=True)
+        proba = np.exp(joint)
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def predict(self, text):
+        proba = self.predict_proba([text])[0]
+        best = int(proba.argmax())
+        return self.labels[best], float(proba[best])
+
+    def save(self, path):
+        np.savez(path, log_prior=self.log_prior, log_likelihood=self.log_likelihood)
+
+    def load(self, path):
+        data = np.load(path)
+        self.log_prior = data["log_prior"]
+        self.log_likelihood = data["log_likelihood"]
+        return self
+
+
+class EmotionClassifier:
+    """本地情绪分类：词典打分，训练过朴素贝叶斯模型时取两者中置信度更高的结果
+
+    predict 返回 (情绪, 置信度, 来源)，来源为 "lexicon" 或 "model"。
+    """
+
+    def __init__(self, lexicon=None, model=None):
+        self.lexicon = LexiconClassifier(lexicon)
+        self.model = model
+
+    def train_from_history(self, conversation_history, min_samples=20):
+        if np is None:
+            return False
+        model = NaiveBayesClassifier()
+        if model.fit_history(conversation_history, min_samples):
+            self.model = model
+            return True
+        return False
+
+    def predict(self, text):
+        label, confidence = self.lexicon.predict(text)
+        source = "lexicon"
+        if self.model is not None and self.model.trained:
+            model_label, model_confidence = self.model.predict(text)
+            if model_confidence > confidence:
+                label, confidence, source = model_label, model_confidence, "model"
+        return label, confidence, source
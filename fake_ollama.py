@@ -0,0 +1,246 @@
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from emotion_classifier import EMOTIONS
+
+REPLY_TEXT = "我理解你现在的感受，这种情况确实让人不容易。可以先深呼吸，慢慢说说发生了什么，我会一直在这里陪着你。"
+
+
+class FakeOllama:
+    """模拟 Ollama 的延迟特性，用于离线测试客户端性能
+
+    - latency: 每个请求固定的额外延迟（网络、排队之外的开销）
+    - ttft: 开始处理到第一个 token 的时间（提示词处理）
+    - token_rate: 每秒生成的 token 数
+    - reply_tokens: 每个回答的 token 数（中文每个字算一个 token）
+    - parallel: 同时生成的请求数，相当于 OLLAMA_NUM_PARALLEL，超出的请求排队
+    - error_rate: 随机返回 500 错误的比例
+    """
+
+    def __init__(self, latency=0.0, ttft=0.2, token_rate=50.0, reply_tokens=40, parallel=1, error_rate=0.0,
+                 jitter=0.0, models=("qwen2:0.5b", "nomic-embed-text")):
+        self.latency = latency
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.models = list(models)
+        self.slots = threading.Semaphore(parallel)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _vary(self, seconds):
+        if self.jitter and seconds:
+            return max(0.0, random.gauss(seconds, seconds * self.jitter))
+        return seconds
+
+    def reply(self, text):
+        """按提示词内容给出合理的回答，让情绪识别等依赖回答格式的代码路径也能正常运行"""
+        if "情绪" in text and "只回复情绪单词" in text:
+            return [random.choice(EMOTIONS)]
+        if "JSON" in text:
+            return list(json.dumps({"primary_emotion": "平静", "intensity": "5", "recommended_tempo": "中速",
+                                    "suggested_instruments": ["钢琴", "吉他"], "musical_style": "流行"},
+                                   ensure_ascii=False))
+        return list((REPLY_TEXT * (self.reply_tokens // len(REPLY_TEXT) + 1))[:self.reply_tokens])
+
+    def embedding(self, text, dim=64):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [(digest[i % len(digest)] - 128) / 128 for i in range(dim)]
+
+    def enter(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def should_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return True
+        return False
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors, "max_in_flight": self.max_in_flight}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, obj):
+        line = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": name, "model": name} for name in self.fake.models]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        else:
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path in ("/api/embeddings", "/api/embed"):
+            text = payload.get("prompt") or payload.get("input") or ""
+            self._send_json({"embedding": self.fake.embedding(text)})
+            return
+        if self.path not in ("/api/generate", "/api/chat"):
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        fake = self.fake
+        fake.enter()
+        try:
+            time.sleep(fake._vary(fake.latency))
+            if fake.should_fail():
+                self._send_json({"error": "fake server error"}, status=500)
+                return
+            self._generate(payload)
+        finally:
+            fake.leave()
+
+    def _generate(self, payload):
+        fake = self.fake
+        chat = self.path == "/api/chat"
+        if chat:
+            prompt = "\n".join(message.get("content", "") for message in payload.get("messages", []))
+        else:
+            prompt = payload.get("prompt", "")
+        tokens = fake.reply(prompt)
+        interval = 1.0 / fake.token_rate if fake.token_rate > 0 else 0.0
+
+        def chunk(token, done=False):
+            if chat:
+                record = {"model": payload.get("model"), "message": {"role": "assistant", "content": token}}
+            else:
+                record = {"model": payload.get("model"), "response": token}
+            record["done"] = done
+            return record
+
+        # 占用一个生成槽位；排队时间也算在总耗时里，和真实的 Ollama 一样
+        with fake.slots:
+            start = time.perf_counter()
+            time.sleep(fake._vary(fake.ttft))
+            prompt_done = time.perf_counter()
+            if payload.get("stream", True):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for token in tokens:
+                    self._write_chunk(chunk(token))
+                    time.sleep(interval)
+            else:
+                time.sleep(interval * len(tokens))
+            end = time.perf_counter()
+
+        final = chunk("" if payload.get("stream", True) else "".join(tokens), done=True)
+        final.update({
+            "done_reason": "stop",
+            "total_duration": int((end - start) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": len(prompt),
+            "prompt_eval_duration": int((prompt_done - start) * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": max(1, int((end - prompt_done) * 1e9)),
+        })
+        if payload.get("stream", True):
+            self._write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        else:
+            self._send_json(final)
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fake):
+        super().__init__(address, _Handler)
+        self.fake = fake
+
+    def handle_error(self, request, client_address):
+        # 客户端中途断开（超时、取消流式读取）是正常情况，不打印堆栈
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+def start_fake_server(host="127.0.0.1", port=0, **options):
+    """在后台线程启动模拟服务，返回 (server, base_url)；port=0 时自动选择空闲端口"""
+    server = FakeOllamaServer((host, port), FakeOllama(**options))
+    thread = threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_fake_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定额外延迟（秒）")
+    parser.add_argument("--ttft", type=float, default=0.2, help="首个 token 的延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="每秒生成的 token 数")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="每个回答的 token 数")
+    parser.add_argument("--parallel", type=int, default=1, help="同时生成的请求数（相当于 OLLAMA_NUM_PARALLEL）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 500 错误的比例")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的相对标准差，如 0.2")
+
+
+def fake_options(args):
+    return {"latency": args.latency, "ttft": args.ttft, "token_rate": args.token_rate,
+            "reply_tokens": args.reply_tokens, "parallel": args.parallel, "error_rate": args.error_rate,
+            "jitter": args.jitter}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 Ollama 服务（/api/generate、/api/chat、/api/tags、流式输出）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeOllamaServer((args.host, args.port), FakeOllama(**fake_options(args)))
+    print(f"🧪 模拟 Ollama 服务: http://{args.host}:{args.port}（Ctrl+C 退出）")
+    print(f"   设置 OLLAMA_HOST=http://{args.host}:{args.port} 后运行其他程序即可")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 {server.fake.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+from detection_summary import box_arrays
+
+
+def iou_matrix(a, b):
+    """两组 xyxy 框两两之间的 IoU，返回 (len(a), len(b))"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class MotionDetector:
+    """廉价的画面变化分数：缩小的灰度图与上次检测时的画面逐像素求平均差（0~1）"""
+
+    def __init__(self, size=(64, 48)):
+        self.size = size
+        self.reference = None
+
+    def _small(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def score(self, frame):
+        if self.reference is None:
+            return 1.0
+        return float(np.abs(self._small(frame) - self.reference).mean()) / 255.0
+
+    def reset(self, frame):
+        self.reference = self._small(frame)
+
+
+class IoUTracker:
+    """基于 IoU 匹配的轻量跟踪器
+
+    检测帧上把新检测框与已有轨迹按 IoU 贪心匹配，并根据位移估计每帧速度；
+    两次检测之间按匀速把框外推到当前帧。连续 max_missed 次检测都没匹配上的轨迹被删除。
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=2):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.boxes = np.zeros((0, 4), np.float32)
+        self.velocity = np.zeros((0, 4), np.float32)
+        self.conf = np.zeros(0, np.float32)
+        self.cls = np.zeros(0, np.int32)
+        self.ids = np.zeros(0, np.int64)
+        self.missed = np.zeros(0, np.int32)
+        self._next_id = 0
+        self._frames_since_update = 0
+
+    def predict(self):
+        """推进一帧，返回外推后的 (坐标, 置信度, 类别, 轨迹 id)"""
+        self._frames_since_update += 1
+        self.boxes = self.boxes + self.velocity
+        return self.boxes, self.conf, self.cls, self.ids
+
+    def update(self, boxes, conf, cls):
+        """用新一帧的检测结果更新轨迹"""
+        steps = self._frames_since_update
+        self._frames_since_update = 0
+        frames = steps + 1
+        # 外推框已经推进了 steps 帧，退回上次检测时的位置用来计算速度
+        previous = self.boxes - self.velocity * steps
+
+        matched_tracks = np.full(len(boxes), -1)
+        if len(self.boxes) and len(boxes):
+            iou = iou_matrix(self.boxes + self.velocity, boxes)
+            # 不同类别不匹配
+            iou[self.cls[:, None] != cls[None, :]] = 0
+            for flat in np.argsort(-iou, axis=None):
+                t, d = divmod(int(flat), len(boxes))
+                if iou[t, d] < self.iou_threshold:
+                    break
+                if matched_tracks[d] == -1 and t not in matched_tracks:
+                    matched_tracks[d] = t
+
+        velocity = np.zeros_like(boxes)
+        ids = np.empty(len(boxes), np.int64)
+        for d, t in enumerate(matched_tracks):
+            if t >= 0:
+                velocity[d] = (boxes[d] - previous[t]) / frames
+                ids[d] = self.ids[t]
+            else:
+                ids[d] = self._next_id
+                self._next_id += 1
+
+        # 没匹配上的旧轨迹保留几次，停在原地，避免检测偶尔漏掉时框闪烁
+        unmatched = np.setdiff1d(np.arange(len(self.boxes)), matched_tracks[matched_tracks >= 0])
+        keep = unmatched[self.missed[unmatched] + 1 < self.max_missed] if len(unmatched) else unmatched
+        self.boxes = np.concatenate([boxes, previous[keep]]).astype(np.float32)
+        self.velocity = np.concatenate([velocity, np.zeros((len(keep), 4), np.float32)])
+        self.conf = np.concatenate([conf, self.conf[keep]])
+        self.cls = np.concatenate([cls, self.cls[keep]])
+        self.ids = np.concatenate([ids, self.ids[keep]])
+        self.missed = np.concatenate([np.zeros(len(boxes), np.int32), self.missed[keep] + 1])
+
+
+class TrackedResult:
+    """跳过检测的帧上由跟踪器外推出的结果，提供与 YOLO 结果相同的 boxes 和 plot()"""
+
+    def __init__(self, frame, boxes, conf, cls, names):
+        self.orig_img = frame
+        self.boxes = boxes
+        self.conf = conf
+        self.cls = cls
+        self.names = names
+
+    def plot(self):
+        frame = self.orig_img.copy()
+        for (x1, y1, x2, y2), conf, cls in zip(self.boxes.astype(int), self.conf, self.cls):
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 160, 0), 2)
+            cv2.putText(frame, f"{self.names.get(int(cls), cls)} {conf:.2f}", (x1, max(y1 - 5, 12)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 160, 0), 1)
+        return frame
+
+
+class AdaptiveDetector:
+    """每 interval 帧做一次完整检测，中间的帧用跟踪器外推
+
+    画面变化分数超过 motion_threshold 时立即检测；interval 根据实测的检测耗时和外推耗时
+    自动调整为能达到 target_fps 的最小值（在 min_interval 和 max_interval 之间）。
+    """
+
+    def __init__(self, model, target_fps=15, min_interval=1, max_interval=15, motion_threshold=0.03,
+                 tracker=None):
+        self.model = model
+        self.target_fps = target_fps
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.motion_threshold = motion_threshold
+        self.tracker = tracker or IoUTracker()
+        self.motion = MotionDetector()
+        self.interval = min_interval
+        self.detect_time = None
+        self.track_time = 0.0
+        self.frames = 0
+        self.detections = 0
+        self._since_detect = 0
+
+    def _ema(self, old, new, alpha=0.2):
+        return new if old is None else old + alpha * (new - old)
+
+    def _adapt(self):
+        """选出预计能达到 target_fps 的最小检测间隔"""
+        for interval in range(self.min_interval, self.max_interval + 1):
+            cost = self.detect_time + (interval - 1) * self.track_time
+            if cost <= 0 or interval / cost >= self.target_fps:
+                self.interval = interval
+                return
+        self.interval = self.max_interval
+
+    def __call__(self, frame):
+        """处理一帧：需要时运行 YOLO，否则返回跟踪器外推的 TrackedResult"""
+        start = time.perf_counter()
+        self.frames += 1
+        self._since_detect += 1
+        due = self._since_detect >= self.interval
+        if not due and self.motion.score(frame) < self.motion_threshold:
+            boxes, conf, cls, _ = self.tracker.predict()
+            result = TrackedResult(frame, boxes, conf, cls, self.model.names)
+            self.track_time = self._ema(self.track_time, time.perf_counter() - start)
+            return result
+
+        results = self.model(frame, verbose=False)
+        metrics.observe_yolo(results, "adaptive")
+        result = results[0]
+        self.tracker.update(*box_arrays(result))
+        self.motion.reset(frame)
+        self._since_detect = 0
+        self.detections += 1
+        self.detect_time = self._ema(self.detect_time, time.perf_counter() - start)
+        self._adapt()
+        return result
+
+    def summary(self):
+        ratio = self.detections / self.frames if self.frames else 0.0
+        return f"完整检测 {self.detections}/{self.frames} 帧（{ratio:.0%}），当前间隔 {self.interval}"
@@ -1,29 +1,32 @@
-import requests
-import json
 import os
-import sys
-from PIL import Image
+import queue
+import threading
+import time
+from collections import Counter
 
-try:
-    from ultralytics import YOLO
-
-    print("✅ Ultralytics 导入成功")
-except ImportError as e:
-    print(f"❌ Ultralytics 导入失败: {e}")
-    print("请运行: pip install ultralytics")
-    input("按回车键退出...")
-    sys.exit(1)
+import metrics
+from batch_analyzer import BatchImageAnalyzer, iter_images
+from detection_summary import DetectionSummary
+from image_cache import ImageAnalysisCache, file_digest
+from llm_scheduler import request_class
+from model_registry import get_model, timing_summary
+from ollama_client import OllamaError, get_client
 
 
 class DebugImageAnalyzer:
     def __init__(self):
         print("初始化 DebugImageAnalyzer...")
-        self.ollama_url = "http://localhost:11434/api/generate"
+        self.client = get_client()
+        self.cache = ImageAnalysisCache.from_env('yolov8n.pt')
 
         try:
             print("正在加载YOLO模型...")
-            self.yolo_model = YOLO('yolov8n.pt')
-            print("✅ YOLO模型加载成功")
+            self.yolo_model = get_model('yolov8n.pt')
+            print(f"✅ YOLO模型加载成功（{timing_summary()}）")
+        except ImportError as e:
+            print(f"❌ Ultralytics 导入失败: {e}")
+            print("请运行: pip install ultralytics")
+            self.yolo_model = None
         except Exception as e:
             print(f"❌ YOLO模型加载失败: {e}")
             self.yolo_model = None
@@ -34,16 +37,14 @@ class DebugImageAnalyzer:
 
         # 检查Ollama
         try:
-            response = requests.get("http://localhost:11434/", timeout=5)
+            models = self.client.list_models()
             print("✅ Ollama服务正在运行")
 
             # 检查模型
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
-            models = response.json().get('models', [])
             if models:
                 print("✅ 可用模型:")
                 for model in models:
-                    print(f"   - {model.get('name')}")
+                    print(f"   - {model}")
             else:
                 print("❌ 没有找到模型")
                 return False
@@ -95,22 +96,13 @@ class DebugImageAnalyzer:
         print(f"\n尝试分析图片: {os.path.basename(test_image)}")
 
         try:
-            # 测试图片打开
-            img = Image.open(test_image)
-            print("✅ 图片可以正常打开")
-
-            # 测试YOLO识别
+            # 测试YOLO识别（图片无法读取时 YOLO 会直接报错）
             if self.yolo_model:
-                results = self.yolo_model(test_image)
+                results = self.yolo_model(test_image, verbose=False)
                 print("✅ YOLO识别成功")
 
                 # 显示识别结果
-                detected_objects = []
-                for result in results:
-                    for box in result.boxes:
-                        class_name = result.names[box.cls.item()]
-                        confidence = box.conf.item()
-                        detected_objects.append(f"{class_name}({confidence:.1%})")
+                detected_objects = DetectionSummary.from_result(results[0]).format_lines()
 
                 if detected_objects:
                     print("识别到的物体:")
@@ -121,18 +113,11 @@ class DebugImageAnalyzer:
 
             # 测试API调用
             print("\n测试API调用...")
-            data = {
-                "model": "qwen2:0.5b",
-                "prompt": "请回复'API测试成功'",
-                "stream": False
-            }
-
-            response = requests.post(self.ollama_url, json=data, timeout=30)
-            if response.status_code == 200:
-                result = response.json()
-                print(f"✅ API调用成功: {result['response']}")
-            else:
-                print(f"❌ API调用失败: {response.status_code}")
+            try:
+                answer = self.client.generate_text("请回复'API测试成功'", timeout=30)
+                print(f"✅ API调用成功: {answer}")
+            except OllamaError as e:
+                print(f"❌ API调用失败: {e.status_code}")
 
             return True
 
@@ -140,6 +125,184 @@ class DebugImageAnalyzer:
             print(f"❌ 测试失败: {e}")
             return False
 
+    def detect_image(self, image_path):
+        """YOLO 检测一张图片，结果按图片内容哈希缓存
+
+        返回 (内容哈希, 结果条目, YOLO 结果)；命中缓存时不解码、不推理，YOLO 结果为 None。
+        """
+        digest = file_digest(image_path) if self.cache.enabled else None
+        entry = self.cache.get(digest) if digest else None
+        if entry is not None and "detections" in entry:
+            return digest, entry, None
+
+        results = self.yolo_model(image_path, verbose=False)
+        metrics.observe_yolo(results, "image")
+        result = results[0]
+        height, width = result.orig_shape[:2]
+        entry = {"width": int(width), "height": int(height),
+                 "detections": DetectionSummary.from_result(result).to_records()}
+        if digest:
+            self.cache.set(digest, entry)
+        return digest, entry, result
+
+    @request_class("batch")
+    def describe_scene(self, entry):
+        """根据检测到的物体生成场景描述；没有物体时返回 None
+
+        描述按 (大模型名称, 提示词) 单独缓存，不写进检测结果条目（条目可能是缓存返回的共享对象）。
+        """
+        labels = [detection["class"] for detection in entry["detections"]]
+        if not labels:
+            return None
+        prompt = f"请描述包含这些物体的场景: {', '.join(labels)}"
+        model = self.client.config.model
+        description = self.cache.get_description(model, prompt)
+        if description is None:
+            description = self.client.generate_text(prompt, timeout=30, use_cache=True)
+            self.cache.set_description(model, prompt, description)
+        return description
+
+    def analyze_image(self, image_path):
+        """分析单张图片并打印结果；同一张图片（内容不变）再次分析只需计算一次哈希"""
+        digest, entry, result = self.detect_image(image_path)
+        if result is None:
+            print("⚡ 命中缓存（图片内容未变），跳过检测")
+
+        # 显示结果
+        detections = entry["detections"]
+        print("\n🎯 识别结果:")
+        if detections:
+            for detection in detections:
+                print(f"  - {detection['class']}({detection['confidence']:.1%})")
+            counts = Counter(detection["class"] for detection in detections)
+            print("  按类别: " + ", ".join(f"{name} x{count}" for name, count in counts.most_common()))
+        else:
+            print("  - 未识别到物体")
+
+        # 生成AI描述
+        try:
+            description = self.describe_scene(entry)
+            if description:
+                print(f"\n🤖 AI描述:\n{description}")
+        except OllamaError as e:
+            print(f"❌ AI描述生成失败: {e.status_code}")
+
+        # 保存结果图片（命中缓存时没有新的检测结果，沿用之前保存的图片）
+        output_path = f"result_{os.path.basename(image_path)}"
+        if result is not None:
+            result.save(output_path)
+            print(f"\n💾 结果保存: {output_path}")
+        elif os.path.exists(output_path):
+            print(f"\n💾 结果图片: {output_path}")
+
+    def describe_images(self, paths, llm_workers=None, queue_size=4):
+        """多张图片的检测与场景描述流水线，按输入顺序逐个产出 (路径, 结果条目, 异常)
+
+        一个线程依次做 YOLO 检测，llm_workers 个线程同时生成场景描述，中间用容量为
+        queue_size 的队列连接：描述第 N 张时已经在检测第 N+1 张，描述跟不上时检测会暂停等待。
+        总耗时接近较慢的那个阶段，而不是两者之和。
+        """
+        paths = list(paths)
+        if llm_workers is None:
+            llm_workers = int(os.environ.get("LLM_WORKERS", 2))
+        if llm_workers < 1:
+            # 没有描述线程时检测线程会卡在已满的队列上，调用方永远等不到结果
+            raise ValueError(f"llm_workers 至少为 1，当前为 {llm_workers}")
+        detected = queue.Queue(maxsize=queue_size)
+        finished = {}
+        ready = threading.Condition()
+        self.pipeline_stats = {"images": len(paths), "detect": 0.0, "describe": 0.0}
+
+        def detect_loop():
+            for index, path in enumerate(paths):
+                start = time.perf_counter()
+                try:
+                    digest, entry, result = self.detect_image(path)
+                    if result is not None:
+                        result.save(f"result_{os.path.basename(path)}")
+                    item = (index, path, digest, entry, None)
+                except Exception as e:
+                    item = (index, path, None, None, e)
+                self.pipeline_stats["detect"] += time.perf_counter() - start
+                detected.put(item)
+                metrics.set_gauge("queue_depth", detected.qsize(), queue="describe")
+            for _ in range(llm_workers):
+                detected.put(None)
+
+        def describe_loop():
+            while True:
+                item = detected.get()
+                if item is None:
+                    return
+                index, path, digest, entry, error = item
+                start = time.perf_counter()
+                if error is None:
+                    try:
+                        description = self.describe_scene(entry)
+                        if description:
+                            entry = {**entry, "description": description}
+                    except Exception as e:
+                        error = e
+                with ready:
+                    self.pipeline_stats["describe"] += time.perf_counter() - start
+                    finished[index] = (path, entry, error)
+                    ready.notify_all()
+
+        threads = [threading.Thread(target=detect_loop, name="detect", daemon=True)]
+        threads += [threading.Thread(target=describe_loop, name=f"describe-{i}", daemon=True)
+                    for i in range(llm_workers)]
+        for thread in threads:
+            thread.start()
+
+        # 结果可能乱序完成，这里按输入顺序交给调用方
+        for index in range(len(paths)):
+            with ready:
+                while index not in finished:
+                    ready.wait()
+                item = finished.pop(index)
+            yield item
+
+        for thread in threads:
+            thread.join()
+
+    def analyze_many(self):
+        """检测与描述并行地分析一个目录（或 glob 模式）下的多张图片"""
+        target = input("请输入图片目录或 glob 模式: ").strip()
+        paths = list(iter_images(target))
+        if not paths:
+            print("❌ 没有找到图片")
+            return
+        print(f"📂 共 {len(paths)} 张图片")
+
+        start = time.perf_counter()
+        for path, entry, error in self.describe_images(paths):
+            print(f"\n🖼️ {os.path.basename(path)}")
+            if error is not None:
+                print(f"   ❌ 分析失败: {error}")
+                continue
+            counts = Counter(detection["class"] for detection in entry["detections"])
+            print("   物体: " + (", ".join(f"{name} x{count}" for name, count in counts.most_common()) or "无"))
+            if entry.get("description"):
+                print(f"   🤖 {entry['description']}")
+
+        elapsed = time.perf_counter() - start
+        stats = self.pipeline_stats
+        print(f"\n📊 {stats['images']} 张图片，总耗时 {elapsed:.1f}秒（{stats['images'] / elapsed:.2f} 张/秒）")
+        print(f"   检测合计 {stats['detect']:.1f}秒，描述合计 {stats['describe']:.1f}秒，"
+              f"依次执行约需 {stats['detect'] + stats['describe']:.1f}秒")
+
+    def analyze_directory(self):
+        """批量分析一个目录（或 glob 模式）下的全部图片，结果写入 JSONL/Parquet"""
+        target = input("请输入图片目录或 glob 模式: ").strip()
+        output = input("输出文件 (默认 detections.jsonl): ").strip() or "detections.jsonl"
+        batch_size = input("批大小 (默认 16): ").strip()
+
+        try:
+            analyzer = BatchImageAnalyzer(self.yolo_model, batch_size=int(batch_size or 16), cache=self.cache)
+            analyzer.run(target, output)
+        except Exception as e:
+            print(f"❌ 批量分析失败: {e}")
+
     def run_interactive_simple(self):
         """简化的交互界面"""
         print("\n" + "=" * 50)
@@ -162,9 +325,11 @@ class DebugImageAnalyzer:
         while True:
             print("\n选择操作:")
             print("1. 分析单张图片")
-            print("2. 退出")
+            print("2. 批量分析目录")
+            print("3. 分析多张图片并生成描述")
+            print("4. 退出")
 
-            choice = input("请选择 (1-2): ").strip()
+            choice = input("请选择 (1-4): ").strip()
 
             if choice == "1":
                 image_path = input("请输入图片完整路径: ").strip()
@@ -174,50 +339,17 @@ class DebugImageAnalyzer:
                     continue
 
                 try:
-                    # 分析图片
-                    img = Image.open(image_path)
-                    results = self.yolo_model(image_path)
-
-                    # 显示结果
-                    detected_objects = []
-                    for result in results:
-                        for box in result.boxes:
-                            class_name = result.names[box.cls.item()]
-                            confidence = box.conf.item()
-                            detected_objects.append(f"{class_name}({confidence:.1%})")
-
-                    print("\n🎯 识别结果:")
-                    if detected_objects:
-                        for obj in detected_objects:
-                            print(f"  - {obj}")
-                    else:
-                        print("  - 未识别到物体")
-
-                    # 生成AI描述
-                    if detected_objects:
-                        object_list = ", ".join([obj.split('(')[0] for obj in detected_objects])
-                        prompt = f"请描述包含这些物体的场景: {object_list}"
-
-                        data = {
-                            "model": "qwen2:0.5b",
-                            "prompt": prompt,
-                            "stream": False
-                        }
-
-                        response = requests.post(self.ollama_url, json=data, timeout=30)
-                        if response.status_code == 200:
-                            description = response.json()['response']
-                            print(f"\n🤖 AI描述:\n{description}")
-
-                    # 保存结果图片
-                    output_path = f"result_{os.path.basename(image_path)}"
-                    results[0].save(output_path)
-                    print(f"\n💾 结果保存: {output_path}")
-
+                    self.analyze_image(image_path)
                 except Exception as e:
                     print(f"❌ 分析失败: {e}")
 
             elif choice == "2":
+                self.analyze_directory()
+
+            elif choice == "3":
+                self.analyze_many()
+
+            elif choice == "4":
                 print("👋 再见！")
                 break
 
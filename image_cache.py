@@ -0,0 +1,91 @@
+import hashlib
+import os
+
+import metrics
+from model_registry import resolve_backend
+from response_cache import ResponseCache
+
+# 与 YOLO 默认推理参数一致；参数不同的结果分开缓存
+DEFAULT_OPTIONS = {"imgsz": 640, "conf": 0.25}
+
+_weights_versions = {}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """文件内容的 sha256，同一张图片换了路径或文件名也能命中"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weights_version(weights):
+    """模型版本 = 权重文件名 + 内容哈希前缀；换了权重（哪怕同名）缓存自动失效"""
+    version = _weights_versions.get(weights)
+    if version is None:
+        name = os.path.basename(weights)
+        version = f"{name}:{file_digest(weights)[:16]}" if os.path.isfile(weights) else name
+        _weights_versions[weights] = version
+    return version
+
+
+class ImageAnalysisCache:
+    """图片分析结果缓存
+
+    - 检测结果：键为 (YOLO 模型版本 + 推理后端, 图片内容哈希, 推理参数)
+    - 场景描述：单独存放，键为 (大模型名称, 提示词)，换了 OLLAMA_MODEL 不会沿用旧描述
+
+    底层复用 ResponseCache（内存 LRU + SQLite），按条数和总大小淘汰最久未访问的条目。
+    结果只取决于图片内容和模型，不设过期时间，所以 cache 应来自 from_env（ttl=None），
+    不要传入 LLM 响应缓存。
+    """
+
+    def __init__(self, cache, weights='yolov8n.pt', backend=None):
+        self.cache = cache
+        self.version = f"{weights_version(weights)}:{resolve_backend(backend)}"
+        metrics.register_collector("image_cache", self.stats)
+
+    @classmethod
+    def from_env(cls, weights='yolov8n.pt', backend=None):
+        """IMAGE_CACHE=0 关闭缓存，IMAGE_CACHE_PATH 指定数据库文件，IMAGE_CACHE_MAX_MB 限制磁盘大小"""
+        cache = ResponseCache(
+            path=os.environ.get("IMAGE_CACHE_PATH", "image_cache.sqlite"),
+            max_disk_entries=int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", 200000)),
+            max_disk_bytes=int(float(os.environ.get("IMAGE_CACHE_MAX_MB", 200)) * 1024 * 1024),
+            ttl=None,
+            enabled=os.environ.get("IMAGE_CACHE", "1") != "0",
+        )
+        return cls(cache, weights, backend)
+
+    @property
+    def enabled(self):
+        return self.cache.enabled
+
+    def key(self, digest, options=None):
+        return ResponseCache.make_key(self.version, digest, options or DEFAULT_OPTIONS)
+
+    def get(self, digest, options=None):
+        """返回缓存的检测结果字典（{"width", "height", "detections"}），未命中返回 None"""
+        return self.cache.get(self.key(digest, options))
+
+    def set(self, digest, entry, options=None):
+        self.cache.set(self.key(digest, options), entry)
+
+    def set_many(self, entries, options=None):
+        """批量写入 [(内容哈希, 结果字典), ...]"""
+        self.cache.set_many([(self.key(digest, options), entry) for digest, entry in entries])
+
+    def get_description(self, model, prompt):
+        """返回该大模型对该提示词生成过的场景描述，未命中返回 None"""
+        entry = self.cache.get(ResponseCache.make_key("scene", model, prompt))
+        return entry["description"] if entry else None
+
+    def set_description(self, model, prompt, description):
+        self.cache.set(ResponseCache.make_key("scene", model, prompt), {"description": description})
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,261 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import ContextDecorator, contextmanager
+
+import metrics
+
+# 按优先级从高到低：交互式对话、后台生成（歌词、创作指导、对话摘要）、批量任务（图片场景描述）
+CLASSES = ("interactive", "background", "batch")
+
+# 各优先级默认最长排队时间（秒）和最多排队请求数，超出即拒绝（负载削减）
+DEFAULT_QUEUE_TIMEOUTS = {"interactive": 30, "background": 120, "batch": 300}
+DEFAULT_QUEUE_LIMITS = {"interactive": 100, "background": 20, "batch": 50}
+
+_current_class = contextvars.ContextVar("llm_request_class", default="interactive")
+
+
+class QueueRejected(Exception):
+    """请求被调度器拒绝：排队已满，或排队时间超过该优先级的期限"""
+
+    def __init__(self, message, request_class, reason):
+        super().__init__(message)
+        self.request_class = request_class
+        self.reason = reason
+
+
+class request_class(ContextDecorator):
+    """指定代码块（或被装饰函数）中发出的 LLM 请求的优先级
+
+    用法:
+        with request_class("batch"):
+            client.generate_text(prompt)
+
+        @request_class("background")
+        def generate_lyrics(...): ...
+    """
+
+    def __init__(self, name):
+        if name not in CLASSES:
+            raise ValueError(f"未知的请求优先级: {name}，可选: {', '.join(CLASSES)}")
+        self.name = name
+        self._token = None
+
+    def _recreate_cm(self):
+        # 作为装饰器时每次调用用新实例，多线程同时调用互不干扰
+        return request_class(self.name)
+
+    def __enter__(self):
+        self._token = _current_class.set(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        _current_class.reset(self._token)
+        return False
+
+
+def current_class():
+    """当前上下文的请求优先级，未指定时为 interactive"""
+    return _current_class.get()
+
+
+def parse_class_values(text, default, cast=float):
+    """解析 "interactive=30,batch=300" 形式的配置，未写的优先级用默认值"""
+    values = dict(default)
+    for part in (text or "").split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            if name.strip() in CLASSES:
+                values[name.strip()] = cast(value)
+    return values
+
+
+def default_limits(capacity):
+    """默认每个优先级的并发上限：容量大于 1 时后台和批量任务总会给交互式请求留出槽位
+
+    容量为 1 时无法预留，由 LLMScheduler 保证没有交互式请求在运行时，新的交互式请求总能立即放行。
+    """
+    reserved = max(1, capacity - 1)
+    return {"interactive": capacity, "background": reserved, "batch": max(1, min(reserved, capacity // 2))}
+
+
+class _Waiter:
+    def __init__(self, request_class, notify):
+        self.request_class = request_class
+        self.notify = notify
+        self.granted = False
+        self.enqueued_at = time.perf_counter()
+
+
+class LLMScheduler:
+    """Ollama 前面的优先级调度器
+
+    - capacity: 同时发往 Ollama 的请求数，应与服务端 OLLAMA_NUM_PARALLEL 一致，
+      多出的请求在这里按优先级排队，而不是在 Ollama 内部按到达顺序排队
+    - limits: 每个优先级的并发上限，低优先级任务占不满全部槽位，交互式请求来了总有空位
+    - queue_timeouts / queue_limits: 每个优先级的最长排队时间和最多排队数，超出时抛出 QueueRejected
+
+    有空槽位时按优先级从高到低放行，同一优先级先到先得。没有交互式请求在运行时，
+    交互式请求即使槽位已被后台任务占满也立即放行（最多超出容量一个），不会排在后台任务后面。
+    """
+
+    def __init__(self, capacity=1, limits=None, queue_timeouts=None, queue_limits=None):
+        self.capacity = capacity
+        self.limits = limits or default_limits(capacity)
+        self.queue_timeouts = queue_timeouts or dict(DEFAULT_QUEUE_TIMEOUTS)
+        self.queue_limits = queue_limits or dict(DEFAULT_QUEUE_LIMITS)
+        self._lock = threading.Lock()
+        self._queues = {name: deque() for name in CLASSES}
+        self.active = {name: 0 for name in CLASSES}
+        self.admitted = {name: 0 for name in CLASSES}
+        self.rejected = {name: 0 for name in CLASSES}
+
+    @classmethod
+    def from_env(cls):
+        """OLLAMA_NUM_PARALLEL 为总容量（未设置时与 OLLAMA_MAX_CONCURRENCY 相同，默认 4）；
+        LLM_CLASS_LIMITS、LLM_QUEUE_TIMEOUTS、LLM_QUEUE_LIMITS 按 "interactive=2,batch=1" 的格式覆盖各优先级的默认值"""
+        capacity = int(os.environ.get("OLLAMA_NUM_PARALLEL") or os.environ.get("OLLAMA_MAX_CONCURRENCY", 4))
+        return cls(
+            capacity=capacity,
+            limits=parse_class_values(os.environ.get("LLM_CLASS_LIMITS"), default_limits(capacity), int),
+            queue_timeouts=parse_class_values(os.environ.get("LLM_QUEUE_TIMEOUTS"), DEFAULT_QUEUE_TIMEOUTS),
+            queue_limits=parse_class_values(os.environ.get("LLM_QUEUE_LIMITS"), DEFAULT_QUEUE_LIMITS, int),
+        )
+
+    def _runnable(self, name):
+        if name == "interactive" and not self.active[name]:
+            return True
+        return sum(self.active.values()) < self.capacity and self.active[name] < self.limits[name]
+
+    def _admit(self, name, waited):
+        self.active[name] += 1
+        self.admitted[name] += 1
+        metrics.observe("llm_queue_seconds", waited, request_class=name)
+
+    def _dispatch(self):
+        """把空出来的槽位按优先级分给排队的请求（调用方持有锁）"""
+        for name in CLASSES:
+            queue = self._queues[name]
+            while queue and self._runnable(name):
+                waiter = queue.popleft()
+                waiter.granted = True
+                self._admit(name, time.perf_counter() - waiter.enqueued_at)
+                waiter.notify()
+            metrics.set_gauge("queue_depth", len(queue), queue=f"llm_{name}")
+
+    def _reject(self, name, reason):
+        self.rejected[name] += 1
+        metrics.inc("llm_shed_total", request_class=name, reason=reason)
+        if reason == "queue_full":
+            message = f"{name} 请求排队已满（{self.queue_limits[name]}），已拒绝"
+        else:
+            message = f"{name} 请求排队超过 {self.queue_timeouts[name]} 秒，已放弃"
+        return QueueRejected(message, name, reason)
+
+    def _enqueue(self, name, notify):
+        """排队并尝试放行；立即获得槽位时返回 None，否则返回 _Waiter（调用方持有锁）"""
+        if len(self._queues[name]) >= self.queue_limits[name]:
+            raise self._reject(name, "queue_full")
+        waiter = _Waiter(name, notify)
+        self._queues[name].append(waiter)
+        self._dispatch()
+        return None if waiter.granted else waiter
+
+    def _abandon(self, waiter):
+        """排队超过期限仍未放行：移出队列并返回要抛出的异常（调用方持有锁）"""
+        self._queues[waiter.request_class].remove(waiter)
+        return self._reject(waiter.request_class, "deadline")
+
+    def acquire(self, name=None):
+        """阻塞直到获得槽位；返回实际使用的优先级，用完必须 release"""
+        name = name or current_class()
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enqueue(name, event.set)
+        if waiter is None:
+            return name
+        event.wait(self.queue_timeouts[name])
+        with self._lock:
+            if waiter.granted:
+                return name
+            raise self._abandon(waiter)
+
+    async def acquire_async(self, name=None):
+        """acquire 的 asyncio 版本，等待期间不占用线程；被取消时自动归还槽位"""
+        name = name or current_class()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self._lock:
+            waiter = self._enqueue(name, notify)
+        if waiter is None:
+            return name
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeouts[name])
+            return name
+        except asyncio.TimeoutError:
+            with self._lock:
+                if waiter.granted:
+                    return name
+                raise self._abandon(waiter)
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._release_locked(name)
+                else:
+                    self._queues[name].remove(waiter)
+            raise
+
+    def _release_locked(self, name):
+        self.active[name] -= 1
+        self._dispatch()
+
+    def release(self, name):
+        with self._lock:
+            self._release_locked(name)
+
+    @contextmanager
+    def slot(self, name=None):
+        """with scheduler.slot(): 获取槽位，结束时归还"""
+        name = self.acquire(name)
+        try:
+            yield name
+        finally:
+            self.release(name)
+
+    def stats(self):
+        with self._lock:
+            stats = {"capacity": self.capacity}
+            for name in CLASSES:
+                stats[f"{name}_active"] = self.active[name]
+                stats[f"{name}_waiting"] = len(self._queues[name])
+                stats[f"{name}_admitted"] = self.admitted[name]
+                stats[f"{name}_rejected"] = self.rejected[name]
+            return stats
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler():
+    """返回进程内共享的调度器；返回 None 时请求不排队，直接发往 Ollama
+
+    LLM_SCHEDULER=1 开启，=0 关闭；未设置时只有设置了 OLLAMA_NUM_PARALLEL（知道服务端容量）才开启。
+    """
+    global _default_scheduler
+    enabled = os.environ.get("LLM_SCHEDULER")
+    if enabled == "0" or (enabled is None and not os.environ.get("OLLAMA_NUM_PARALLEL")):
+        return None
+    if _default_scheduler is None:
+        with _default_lock:
+            if _default_scheduler is None:
+                _default_scheduler = LLMScheduler.from_env()
+                metrics.register_collector("llm_scheduler", _default_scheduler.stats)
+    return _default_scheduler
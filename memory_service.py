@@ -0,0 +1,295 @@
+import asyncio
+import atexit
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+
+
+class _UserRecord:
+    """内存中的热点用户：状态字典 + 最近若干轮对话"""
+
+    def __init__(self, state, recent, recent_size):
+        self.state = state
+        self.recent = deque(recent, maxlen=recent_size)
+
+
+class MemoryService:
+    """单进程服务大量用户的记忆存储
+
+    - 所有用户共用一个 SQLite 数据库（WAL 模式，读写互不阻塞），不再每个用户一个文件
+    - 最近活跃的 max_hot_users 个用户常驻内存（LRU）
+    - 写入先进入队列，由后台线程每 flush_interval 秒批量提交（write-behind）；
+      进程崩溃最多丢失最后一个周期内的写入
+    - 用户按哈希分到固定数量（lock_stripes）的锁上，锁的数量不随用户数增长；
+      线程和 asyncio（a 开头的方法）都可以安全调用
+    """
+
+    def __init__(self, path="memory.db", max_hot_users=1024, recent_size=50, flush_interval=0.5, lock_stripes=64):
+        self.path = path
+        self.max_hot_users = max_hot_users
+        self.recent_size = recent_size
+        self.flush_interval = flush_interval
+
+        self._writer = self._connect()
+        self._writer.executescript("""
+            CREATE TABLE IF NOT EXISTS user_state (
+                user_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (user_id, key)
+            );
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user_id, id);
+            CREATE TABLE IF NOT EXISTS semantic_vectors (
+                user_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                embedder TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                item TEXT NOT NULL,
+                PRIMARY KEY (user_id, position)
+            );
+        """)
+        self._writer.commit()
+        self._readers = threading.local()
+
+        self._hot = OrderedDict()
+        self._hot_lock = threading.Lock()
+        self._user_locks = [threading.RLock() for _ in range(lock_stripes)]
+
+        self._pending_state = {}
+        self._pending_conversations = []
+        self._pending_users = set()
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="memory-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        # 每个线程一个只读连接，WAL 模式下可以和写入并发
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = self._connect()
+        return conn
+
+    def user_lock(self, user_id):
+        """返回该用户所在分片的锁（可重入）；不同用户可能共用一把锁，但同一用户总是同一把"""
+        return self._user_locks[hash(user_id) % len(self._user_locks)]
+
+    def _record(self, user_id):
+        with self._hot_lock:
+            record = self._hot.get(user_id)
+            if record is not None:
+                self._hot.move_to_end(user_id)
+                self.hits += 1
+                return record
+            self.misses += 1
+
+        # 该用户还有没落盘的写入时先提交，保证从数据库读到的是最新数据；
+        # 持有 _flush_lock 直到读完，避免读到另一个线程已取走但尚未提交的批次之前的旧数据
+        with self._flush_lock:
+            if user_id in self._pending_users:
+                self._flush_locked()
+            reader = self._reader()
+            state = {key: json.loads(value) for key, value in
+                     reader.execute("SELECT key, value FROM user_state WHERE user_id = ?", (user_id,))}
+            rows = reader.execute("SELECT data FROM conversations WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                                  (user_id, self.recent_size)).fetchall()
+        record = _UserRecord(state, [json.loads(row[0]) for row in reversed(rows)], self.recent_size)
+
+        with self._hot_lock:
+            self._hot[user_id] = record
+            self._hot.move_to_end(user_id)
+            while len(self._hot) > self.max_hot_users:
+                # 待写入的数据在队列里，淘汰内存记录不会丢数据
+                self._hot.popitem(last=False)
+        return record
+
+    def load_state(self, user_id):
+        with self.user_lock(user_id):
+            return dict(self._record(user_id).state)
+
+    def set(self, user_id, key, value):
+        with self.user_lock(user_id):
+            self._record(user_id).state[key] = value
+            with self._pending_lock:
+                self._pending_state[(user_id, key)] = json.dumps(value, ensure_ascii=False)
+                self._pending_users.add(user_id)
+
+    def append_conversation(self, user_id, conversation):
+        with self.user_lock(user_id):
+            self._record(user_id).recent.append(conversation)
+            with self._pending_lock:
+                self._pending_conversations.append((user_id, json.dumps(conversation, ensure_ascii=False)))
+                self._pending_users.add(user_id)
+
+    def recent_history(self, user_id, n):
+        with self.user_lock(user_id):
+            if n <= self.recent_size:
+                return list(self._record(user_id).recent)[-n:] if n > 0 else []
+        rows = self._query_history(user_id, "ORDER BY id DESC LIMIT ?", (n,))
+        return list(reversed(rows))
+
+    def iter_history(self, user_id):
+        """按时间顺序遍历该用户的全部对话历史"""
+        return iter(self._query_history(user_id, "ORDER BY id"))
+
+    def _query_history(self, user_id, order, params=()):
+        with self._flush_lock:
+            if user_id in self._pending_users:
+                self._flush_locked()
+            rows = self._reader().execute(f"SELECT data FROM conversations WHERE user_id = ? {order}",
+                                          (user_id,) + params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def load_vectors(self, user_id):
+        """该用户语义索引的全部行 [(嵌入器名称, 向量字节, 条目 JSON)]，按位置排序"""
+        return self._reader().execute(
+            "SELECT embedder, vector, item FROM semantic_vectors WHERE user_id = ? ORDER BY position",
+            (user_id,)).fetchall()
+
+    def append_vectors(self, user_id, start, embedder, rows):
+        """从 start 位置起写入一批向量（rows 为 [(向量字节, 条目 JSON)]），一个事务提交"""
+        with self._flush_lock, self._writer:
+            self._writer.executemany(
+                "INSERT OR REPLACE INTO semantic_vectors (user_id, position, embedder, vector, item) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(user_id, start + i, embedder, vector, item) for i, (vector, item) in enumerate(rows)])
+
+    def clear_vectors(self, user_id):
+        with self._flush_lock, self._writer:
+            self._writer.execute("DELETE FROM semantic_vectors WHERE user_id = ?", (user_id,))
+
+    def flush(self):
+        """立即把队列中的写入批量提交到数据库"""
+        with self._flush_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        # 调用方持有 _flush_lock：从取走队列到提交完成之间，读数据库的线程会等待
+        with self._pending_lock:
+            state, self._pending_state = self._pending_state, {}
+            conversations, self._pending_conversations = self._pending_conversations, []
+            users, self._pending_users = self._pending_users, set()
+        if not state and not conversations:
+            return
+        try:
+            with self._writer:
+                self._writer.executemany(
+                    "INSERT OR REPLACE INTO user_state (user_id, key, value) VALUES (?, ?, ?)",
+                    [(user_id, key, value) for (user_id, key), value in state.items()])
+                self._writer.executemany("INSERT INTO conversations (user_id, data) VALUES (?, ?)",
+                                         conversations)
+        except sqlite3.Error:
+            # 提交失败时把数据放回队列，下个周期重试
+            with self._pending_lock:
+                for item, value in state.items():
+                    self._pending_state.setdefault(item, value)
+                self._pending_conversations[:0] = conversations
+                self._pending_users |= users
+            raise
+        self.flushes += 1
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"⚠️ 记忆写入失败，稍后重试: {e}")
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+        self._writer.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hot_users": len(self._hot),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "flushes": self.flushes,
+            "pending_writes": len(self._pending_state) + len(self._pending_conversations),
+        }
+
+    async def aload_state(self, user_id):
+        return await asyncio.to_thread(self.load_state, user_id)
+
+    async def aset(self, user_id, key, value):
+        await asyncio.to_thread(self.set, user_id, key, value)
+
+    async def aappend_conversation(self, user_id, conversation):
+        await asyncio.to_thread(self.append_conversation, user_id, conversation)
+
+    async def arecent_history(self, user_id, n):
+        return await asyncio.to_thread(self.recent_history, user_id, n)
+
+    def store_for(self, user_id):
+        """返回单个用户视角的存储，接口与 JsonlMemoryStore 相同，可直接交给 LongTermMemory"""
+        return UserMemoryStore(self, user_id)
+
+
+class UserMemoryStore:
+    """MemoryService 中单个用户的存储视图"""
+
+    def __init__(self, service, user_id):
+        self.service = service
+        self.user_id = user_id
+
+    def load_state(self):
+        return self.service.load_state(self.user_id)
+
+    def set(self, key, value):
+        self.service.set(self.user_id, key, value)
+
+    def append_conversation(self, conversation):
+        self.service.append_conversation(self.user_id, conversation)
+
+    def recent_history(self, n):
+        return self.service.recent_history(self.user_id, n)
+
+    def iter_history(self):
+        return self.service.iter_history(self.user_id)
+
+    def compact(self, state=None):
+        # 数据库没有需要合并的日志，这里只负责整体覆盖状态并立即落盘
+        if state is not None:
+            for key, value in state.items():
+                self.service.set(self.user_id, key, value)
+        self.service.flush()
+
+
+_default_service = None
+_default_lock = threading.Lock()
+
+
+def get_memory_service():
+    """返回进程内共享的 MemoryService（数据库路径读取环境变量 MEMORY_DB）"""
+    global _default_service
+    if _default_service is None:
+        with _default_lock:
+            if _default_service is None:
+                _default_service = MemoryService(os.environ.get("MEMORY_DB", "memory.db"))
+    return _default_service
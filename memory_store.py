@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+
+
+def atomic_write_json(path, data):
+    """先写临时文件再 os.replace，进程中途退出也不会留下写了一半的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_jsonl(path):
+    """逐行读取 JSONL，跳过进程崩溃时可能留下的不完整末行"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _tail_jsonl(path, n, block_size=8192):
+    """从文件末尾向前读取最后 n 条记录，不必加载整个文件"""
+    if n <= 0 or not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= n:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+
+    lines = data.splitlines()
+    if position > 0:
+        # 没读到文件开头时，第一行被截断在块边界上
+        lines = lines[1:]
+
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line.decode('utf-8')))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            # 最后一行可能是崩溃时写了一半的
+            continue
+    return records[-n:]
+
+
+class JsonlMemoryStore:
+    """单个用户的追加式记忆存储
+
+    - memory_<user>.snapshot.json: 压缩后的状态（基本信息、偏好等，不含对话历史）
+    - memory_<user>.log.jsonl: 快照之后的状态修改，每行一条 {"key": ..., "value": ...}
+    - memory_<user>.history.jsonl: 全部对话历史，只追加、不截断
+
+    每轮对话只追加一行，写入是 O(1) 的；状态日志超过 compact_every 条时合并进快照。
+    """
+
+    def __init__(self, user_id="default_user", directory=".", compact_every=100):
+        self.user_id = user_id
+        self.directory = directory
+        self.compact_every = compact_every
+        self.snapshot_file = os.path.join(directory, f"memory_{user_id}.snapshot.json")
+        self.log_file = os.path.join(directory, f"memory_{user_id}.log.jsonl")
+        self.history_file = os.path.join(directory, f"memory_{user_id}.history.jsonl")
+        self.legacy_file = os.path.join(directory, f"memory_{user_id}.json")
+        self._lock = threading.Lock()
+        self._state = None
+        self._log_entries = 0
+
+    def load_state(self):
+        """读取快照并重放状态日志，返回不含对话历史的状态字典"""
+        with self._lock:
+            if self._state is None:
+                self._migrate_legacy()
+                state = {}
+                if os.path.exists(self.snapshot_file):
+                    with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                        state = json.load(f)
+                self._log_entries = 0
+                for entry in _read_jsonl(self.log_file):
+                    state[entry["key"]] = entry["value"]
+                    self._log_entries += 1
+                self._state = state
+            return dict(self._state)
+
+    def set(self, key, value):
+        """记录一项状态修改（整体覆盖该键，重放时是幂等的）"""
+        if self._state is None:
+            self.load_state()
+        with self._lock:
+            self._state[key] = value
+            self._append(self.log_file, {"key": key, "value": value})
+            self._log_entries += 1
+            if self._log_entries >= self.compact_every:
+                self._compact()
+
+    def append_conversation(self, conversation):
+        with self._lock:
+            self._append(self.history_file, conversation)
+
+    def recent_history(self, n):
+        return _tail_jsonl(self.history_file, n)
+
+    def iter_history(self):
+        """按时间顺序遍历全部对话历史"""
+        return _read_jsonl(self.history_file)
+
+    def compact(self, state=None):
+        """把状态日志合并进快照；传入 state 时用它整体替换当前状态"""
+        if self._state is None:
+            self.load_state()
+        with self._lock:
+            if state is not None:
+                self._state = dict(state)
+            self._compact()
+
+    def _compact(self):
+        atomic_write_json(self.snapshot_file, self._state)
+        # 快照已落盘后再清空日志；若在两步之间退出，重放日志也只是重复覆盖相同的值
+        open(self.log_file, 'w', encoding='utf-8').close()
+        self._log_entries = 0
+
+    def _append(self, path, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        with open(path, 'ab+') as f:
+            # 上次崩溃可能留下没有换行的半行，先补一个换行，避免把新记录接在后面
+            end = f.seek(0, os.SEEK_END)
+            if end > 0:
+                f.seek(end - 1)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+
+    def _migrate_legacy(self):
+        """把旧版 memory_<user>.json 一次性迁移到新格式（旧文件保留不动）
+
+        快照最后落盘，作为迁移完成的标记：中途退出时快照不存在，下次启动会从旧文件完整地重新迁移，
+        不会留下只有对话历史、没有基本信息的状态。
+        """
+        if not os.path.exists(self.legacy_file) or os.path.exists(self.snapshot_file):
+            return
+        with open(self.legacy_file, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+        history = legacy.pop("conversation_history", [])
+        tmp_path = f"{self.history_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for conversation in history:
+                f.write(json.dumps(conversation, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        # 整体替换：重新迁移时覆盖上次写了一半的结果，而不是在后面重复追加
+        os.replace(tmp_path, self.history_file)
+        atomic_write_json(self.snapshot_file, legacy)
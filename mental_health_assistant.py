@@ -1,31 +1,51 @@
-import requests
-import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from chat_session import ChatSession, get_session_manager
+from emotion_classifier import EMOTIONS, EmotionClassifier
+from memory_service import get_memory_service
+from memory_store import JsonlMemoryStore
+from ollama_client import get_client
+from prompt_builder import PromptBuilder, PromptSection, RollingSummary
+
+try:
+    from semantic_memory import SemanticMemory, open_index
+except ImportError:
+    SemanticMemory = None
+
 
 # 1. 长期记忆系统
 class LongTermMemory:
-    def __init__(self, user_id="default_user"):
+    # 内存中只保留最近的对话，完整历史在磁盘上按需读取
+    HISTORY_WINDOW = 50
+
+    def __init__(self, user_id="default_user", store=None, semantic=None):
         self.user_id = user_id
-        self.memory_file = f"memory_{user_id}.json"
+        self.store = store or JsonlMemoryStore(user_id)
+        self.semantic = semantic
         self.load_memory()
+        if self.semantic is not None:
+            # 历史对话在后台分批补进语义索引，不阻塞创建助手
+            self.semantic.start_backfill(self.iter_history)
 
     def load_memory(self):
-        if os.path.exists(self.memory_file):
-            with open(self.memory_file, 'r', encoding='utf-8') as f:
-                self.memory = json.load(f)
-        else:
-            self.memory = {
-                "basic_info": {"name": "", "age": "", "interests": []},
-                "conversation_history": [],
-                "emotional_patterns": {},
-                "preferences": {}
-            }
+        self.memory = {
+            "basic_info": {"name": "", "age": "", "interests": []},
+            "conversation_history": [],
+            "emotional_patterns": {},
+            "preferences": {}
+        }
+        self.memory.update(self.store.load_state())
+        self.memory["conversation_history"] = self.store.recent_history(self.HISTORY_WINDOW)
 
     def save_memory(self):
-        with open(self.memory_file, 'w', encoding='utf-8') as f:
-            json.dump(self.memory, f, ensure_ascii=False, indent=2)
+        """把当前状态整体写成快照（日常修改只追加日志，不需要调用）"""
+        self.store.compact({key: value for key, value in self.memory.items() if key != "conversation_history"})
+
+    def iter_history(self):
+        """按时间顺序遍历全部对话历史（包括已移出内存窗口的部分）"""
+        return self.store.iter_history()
 
     def update_basic_info(self, name, age=None, interests=None):
         self.memory["basic_info"] = {
@@ -34,73 +54,146 @@ class LongTermMemory:
             "interests": interests or [],
             "last_updated": datetime.now().isoformat()
         }
-        self.save_memory()
+        self.store.set("basic_info", self.memory["basic_info"])
 
-    def add_conversation(self, user_input, ai_response, emotion=None):
+    def add_conversation(self, user_input, ai_response, emotion=None, emotion_source=None):
         conversation = {
             "timestamp": datetime.now().isoformat(),
             "user_input": user_input,
             "ai_response": ai_response,
             "emotion": emotion
         }
+        if emotion_source:
+            conversation["emotion_source"] = emotion_source
+        self.store.append_conversation(conversation)
+        if self.semantic is not None:
+            self.semantic.add_turn(conversation)
         self.memory["conversation_history"].append(conversation)
-        if len(self.memory["conversation_history"]) > 50:
-            self.memory["conversation_history"] = self.memory["conversation_history"][-50:]
-        self.save_memory()
+        if len(self.memory["conversation_history"]) > self.HISTORY_WINDOW:
+            self.memory["conversation_history"] = self.memory["conversation_history"][-self.HISTORY_WINDOW:]
 
-    def get_user_context(self):
+    def profile_text(self):
         basic = self.memory["basic_info"]
-        recent_chats = self.memory["conversation_history"][-3:]
-
         context = f"用户姓名: {basic.get('name', '未知')}\n"
         if basic.get('age'):
             context += f"年龄: {basic['age']}\n"
         if basic.get('interests'):
             context += f"兴趣: {', '.join(basic['interests'])}\n"
+        return context
 
-        context += "\n最近对话:\n"
-        for chat in recent_chats:
-            context += f"用户: {chat['user_input']}\n"
-            context += f"助理: {chat['ai_response']}\n"
+    def recent_turn_texts(self, n):
+        """最近 n 轮对话的文本，由新到旧"""
+        recent_chats = self.memory["conversation_history"][-n:] if n > 0 else []
+        return [f"用户: {chat['user_input']}\n助理: {chat['ai_response']}" for chat in reversed(recent_chats)]
 
-        return context
+    def related_turn_texts(self, query, exclude_last):
+        """语义检索到的相关过往对话，按相关度由高到低；未启用语义索引时为空"""
+        if not query or self.semantic is None:
+            return []
+        recent = self.memory["conversation_history"][-exclude_last:] if exclude_last > 0 else []
+        return self.semantic.related_turns(query, exclude={self.semantic.turn_key(chat) for chat in recent})
 
 
 # 2. 情绪识别
 class EmotionAnalyzer:
-    def __init__(self, ollama_url):
-        self.ollama_url = ollama_url
+    """情绪识别：先用本地分类器，置信度低于阈值时才调用大模型"""
+
+    def __init__(self, client=None, classifier=None, threshold=None):
+        self.client = client or get_client()
+        self.classifier = classifier or EmotionClassifier()
+        if threshold is None:
+            threshold = float(os.environ.get("EMOTION_LOCAL_THRESHOLD", 0.6))
+        self.threshold = threshold
+        self.last_source = None
+        self.local_count = 0
+        self.llm_count = 0
+
+    def train_from_history(self, conversation_history):
+        """用历史对话里大模型给出的情绪标签训练本地模型"""
+        return self.classifier.train_from_history(conversation_history)
+
+    def quick_emotion(self, text):
+        """只用本地分类器，置信度达到阈值时返回情绪，否则返回 None"""
+        label, confidence, source = self.classifier.predict(text)
+        if confidence >= self.threshold:
+            self.local_count += 1
+            self.last_source = source
+            return label
+        return None
+
+    def fallback_emotion(self, text):
+        """本地分类器没把握时调用大模型"""
+        self.llm_count += 1
+        self.last_source = "llm"
+        return self.analyze_with_llm(text)
 
     def analyze_emotion(self, text):
+        emotion = self.quick_emotion(text)
+        if emotion is not None:
+            return emotion
+        return self.fallback_emotion(text)
+
+    def classify_with_llm(self, text):
+        """调用大模型识别情绪，回答不在情绪列表中时为中性；请求失败时抛出异常"""
         prompt = f"""
         分析这句话的情绪："{text}"
         从[快乐, 悲伤, 愤怒, 焦虑, 压力, 平静, 兴奋, 孤独, 困惑, 中性]中选择。
         只回复情绪单词。
         """
 
-        data = {
-            "model": "qwen2:0.5b",
-            "prompt": prompt,
-            "stream": False
-        }
+        emotion = self.client.generate_text(prompt, timeout=30, use_cache=True).strip()
+        return emotion if emotion in EMOTIONS else "中性"
 
+    def analyze_with_llm(self, text):
         try:
-            response = requests.post(self.ollama_url, json=data, timeout=30)
-            if response.status_code == 200:
-                emotion = response.json()['response'].strip()
-                return emotion if emotion in ["快乐", "悲伤", "愤怒", "焦虑", "压力", "平静", "兴奋", "孤独", "困惑",
-                                              "中性"] else "中性"
-            return "中性"
+            return self.classify_with_llm(text)
         except:
             return "中性"
 
 
 # 3. 心理辅导智能体
 class MentalHealthAssistant:
-    def __init__(self):
-        self.ollama_url = "http://localhost:11434/api/generate"
-        self.memory = LongTermMemory()
-        self.emotion_analyzer = EmotionAnalyzer(self.ollama_url)
+    """心理辅导助手
+
+    emotion_mode 决定情绪识别与回应生成的关系（默认读取环境变量 EMOTION_MODE）：
+    - "serial": 先识别情绪，再把情绪写进提示词生成回应，每轮可能有两次模型调用的延迟
+    - "parallel": 立即开始生成回应；本地分类器有把握时情绪仍写进提示词，
+      否则大模型情绪识别与回应生成同时进行，结果只用于记录和记忆
+
+    chat_mode 决定回应怎样发给模型（默认读取环境变量 CHAT_MODE）：
+    - "generate": 每轮用 /api/generate 重新组装完整提示词（摘要、相关对话、最近对话）
+    - "chat": 每个用户一个 /api/chat 会话，system 消息固定、对话只追加，
+      Ollama 可以复用上一轮的 KV 缓存，每轮只需处理新消息
+    """
+
+    EMOTION_MODES = ("serial", "parallel")
+    CHAT_MODES = ("generate", "chat")
+
+    # 所有用户的助手实例共用一个线程池做并行情绪识别和摘要更新
+    _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="emotion")
+
+    def __init__(self, emotion_mode=None, user_id="default_user", memory_service=None, chat_mode=None):
+        self.emotion_mode = emotion_mode or os.environ.get("EMOTION_MODE", "serial")
+        if self.emotion_mode not in self.EMOTION_MODES:
+            raise ValueError(f"未知的情绪识别模式: {self.emotion_mode}，可选: {', '.join(self.EMOTION_MODES)}")
+        self.chat_mode = chat_mode or os.environ.get("CHAT_MODE", "generate")
+        if self.chat_mode not in self.CHAT_MODES:
+            raise ValueError(f"未知的对话模式: {self.chat_mode}，可选: {', '.join(self.CHAT_MODES)}")
+        # 多用户部署时所有用户共用一个 MemoryService（MEMORY_BACKEND=sqlite）
+        if memory_service is None and os.environ.get("MEMORY_BACKEND") == "sqlite":
+            memory_service = get_memory_service()
+        self.client = get_client()
+        store = memory_service.store_for(user_id) if memory_service is not None else None
+        semantic = None
+        if SemanticMemory is not None and os.environ.get("SEMANTIC_MEMORY", "1") != "0":
+            semantic = SemanticMemory(open_index(user_id, memory_service))
+        self.memory = LongTermMemory(user_id, store=store, semantic=semantic)
+        self.prompt_builder = PromptBuilder(self.client.config.model)
+        self.summary = RollingSummary(self.memory, self.client)
+        self.emotion_analyzer = EmotionAnalyzer(self.client)
+        self.emotion_analyzer.train_from_history(self.memory.iter_history())
+        self.sessions = get_session_manager()
+        self.last_stream_stats = None
 
     def start_session(self):
         """开始会话"""
@@ -112,43 +205,114 @@ class MentalHealthAssistant:
         user_name = self.memory.memory["basic_info"].get("name", "朋友")
         return f"你好{user_name}！很高兴再次见到你。今天感觉怎么样？"
 
-    def process_user_input(self, user_input):
-        """处理用户输入"""
+    def process_user_input(self, user_input, on_token=None):
+        """处理用户输入
+
+        传入 on_token 时以流式方式生成回应，每产生一个 token 就回调一次。
+        """
         # 如果是第一次对话，收集名字
         if not self.memory.memory["basic_info"].get("name"):
             if "我叫" in user_input or "名字是" in user_input:
                 name = self.extract_name(user_input)
                 self.memory.update_basic_info(name=name)
+                # 称呼写在 system 消息里，资料变化后重建会话
+                self.sessions.end(self.memory.user_id)
                 return f"很高兴认识你，{name}！我会记住你的名字。今天有什么想聊的吗？", "快乐"
             else:
                 return "请问你希望我怎么称呼你呢？", "中性"
 
-        # 分析情绪
-        emotion = self.emotion_analyzer.analyze_emotion(user_input)
+        if self.emotion_mode == "parallel":
+            # 本地分类器有把握时直接用；否则情绪识别与回应生成同时进行
+            emotion = self.emotion_analyzer.quick_emotion(user_input)
+            emotion_source = self.emotion_analyzer.last_source
+            emotion_future = None
+            if emotion is None:
+                emotion_future = self._executor.submit(self.emotion_analyzer.fallback_emotion, user_input)
 
-        # 生成回应
-        context = self.memory.get_user_context()
-        prompt = f"""
-        {context}
+            response = self.reply(user_input, emotion, on_token=on_token)
+
+            if emotion_future is not None:
+                emotion, emotion_source = emotion_future.result(), "llm"
+        else:
+            # 分析情绪
+            emotion = self.emotion_analyzer.analyze_emotion(user_input)
+            emotion_source = self.emotion_analyzer.last_source
+
+            # 生成回应
+            response = self.reply(user_input, emotion, on_token=on_token)
+
+        # 保存对话；有足够多的旧对话移出窗口时在后台更新摘要
+        self.memory.add_conversation(user_input, response, emotion, emotion_source)
+        self.summary.schedule(self._executor)
+
+        return response, emotion
+
+    def reply(self, user_input, emotion=None, on_token=None):
+        """按 chat_mode 生成回应"""
+        if self.chat_mode == "chat":
+            return self.chat_response(user_input, emotion, on_token=on_token)
+        return self.generate_response(self.build_prompt(user_input, emotion), on_token=on_token)
+
+    def instructions(self):
+        return f"""你是一个温暖的心理辅导老师小暖。请：
+1. 表达理解和共情
+2. 根据情绪提供适当支持
+3. 保持专业和温暖
+4. 用{self.memory.memory["basic_info"].get("name", "朋友")}称呼用户
+
+请用自然的中文回复。"""
 
-        用户当前情绪: {emotion}
-        用户说: "{user_input}"
+    def build_system_prompt(self):
+        """会话开始时生成一次的 system 消息：角色说明 + 用户资料 + 旧对话摘要"""
+        parts = [self.instructions(), self.memory.profile_text().strip()]
+        if self.summary.digest:
+            parts.append("之前对话摘要:\n" + self.summary.digest)
+        return "\n\n".join(parts)
 
-        你是一个温暖的心理辅导老师小暖。请：
-        1. 表达理解和共情
-        2. 根据情绪提供适当支持
-        3. 保持专业和温暖
-        4. 用{self.memory.memory["basic_info"].get("name", "朋友")}称呼用户
+    def new_chat_session(self):
+        """用最近几轮对话作为开头新建会话，跨会话时对话仍然连贯"""
+        history = self.memory.memory["conversation_history"][-self.summary.keep_recent:]
+        return ChatSession(self.build_system_prompt(), history, client=self.client,
+                           budget=self.prompt_builder.budget, tokenizer=self.prompt_builder.tokenizer)
 
-        请用自然的中文回复。
+    def chat_response(self, user_input, emotion=None, on_token=None):
+        """通过用户的 /api/chat 会话生成回应
+
+        情绪和相关过往对话只写进本轮的用户消息，不改动已有前缀。
         """
+        session = self.sessions.get(self.memory.user_id, self.new_chat_session)
+        content = user_input
+        related = self.memory.related_turn_texts(user_input, self.summary.keep_recent)[:2]
+        if related:
+            content = "（相关的过往对话:\n" + "\n".join(related) + "）\n" + content
+        if emotion:
+            content = f"（用户当前情绪: {emotion}）\n" + content
+        try:
+            response = session.send(content, on_token=on_token)
+            if session.last_stats is not None:
+                self.last_stream_stats = session.last_stats
+            return response
+        except:
+            return "抱歉，我现在无法回应，请确保Ollama正在运行。"
 
-        response = self.generate_response(prompt)
+    def build_prompt(self, user_input, emotion=None):
+        """在模型上下文预算内组装回应提示词，emotion 为 None 时不写入情绪
 
-        # 保存对话
-        self.memory.add_conversation(user_input, response, emotion)
+        最近对话优先保留，其次是旧对话摘要，最后是语义检索到的相关过往对话。
+        """
+        keep_recent = self.summary.keep_recent
+        sections = [
+            PromptSection("之前对话摘要:", [self.summary.digest], priority=1),
+            PromptSection("相关的过往对话:", self.memory.related_turn_texts(user_input, keep_recent), priority=2),
+            PromptSection("最近对话:", self.memory.recent_turn_texts(keep_recent), priority=0, chronological=True),
+        ]
 
-        return response, emotion
+        emotion_line = f"用户当前情绪: {emotion}\n" if emotion else ""
+        footer = f"""{emotion_line}用户说: "{user_input}"
+
+{self.instructions()}"""
+
+        return self.prompt_builder.build(self.memory.profile_text(), footer, sections)
 
     def extract_name(self, text):
         """从文本中提取名字"""
@@ -157,4 +321,16 @@ class MentalHealthAssistant:
         elif "名字是" in text:
             return text.split("名字是")[1].split(" ")[0].strip()
         else:
-            return tex
\ No newline at end of file
+            return text
+
+    def generate_response(self, prompt, on_token=None):
+        """调用大模型生成回应，传入 on_token 时流式输出"""
+        try:
+            if on_token is None:
+                return self.client.generate_text(prompt, timeout=60)
+            stream = self.client.stream(prompt, timeout=60)
+            response = stream.consume(on_token)
+            self.last_stream_stats = stream.stats()
+            return response
+        except:
+            return "抱歉，我现在无法回应，请确保Ollama正在运行。"
\ No newline at end of file
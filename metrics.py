@@ -0,0 +1,325 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 秒为单位的延迟桶（覆盖本地小模型的毫秒级到大模型的几十秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# YOLO result.speed 以毫秒为单位
+MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# 指标名称 -> (类型, 说明, 直方图的桶)
+METRICS = {
+    "llm_request_seconds": ("histogram", "LLM 请求总耗时（流式为读完整个流）", LATENCY_BUCKETS),
+    "llm_ttft_seconds": ("histogram", "流式请求的首 token 延迟", LATENCY_BUCKETS),
+    "llm_tokens_per_second": ("histogram", "按 Ollama eval_count / eval_duration 计算的生成速度", RATE_BUCKETS),
+    "llm_eval_tokens_total": ("counter", "生成的 token 总数（eval_count）", None),
+    "llm_prompt_tokens_total": ("counter", "处理的提示词 token 总数（prompt_eval_count）", None),
+    "llm_errors_total": ("counter", "最终失败的 LLM 请求数", None),
+    "llm_retries_total": ("counter", "LLM 请求重试次数", None),
+    "llm_queue_seconds": ("histogram", "LLM 请求在调度器中的排队时间", LATENCY_BUCKETS),
+    "llm_shed_total": ("counter", "被调度器拒绝的 LLM 请求数（排队已满或超过排队期限）", None),
+    "llm_coalesced_total": ("counter", "与进行中的相同请求合并、没有单独访问模型的请求数", None),
+    "yolo_stage_ms": ("histogram", "YOLO 预处理 / 推理 / 后处理耗时（result.speed，毫秒）", MS_BUCKETS),
+    "yolo_images_total": ("counter", "YOLO 处理的图片（帧）数", None),
+    "pipeline_stage_seconds": ("histogram", "视觉流水线各阶段耗时", LATENCY_BUCKETS),
+    "frames_dropped_total": ("counter", "实时流水线中被新帧替换掉的帧数", None),
+    "batch_size": ("histogram", "推理批大小", SIZE_BUCKETS),
+    "queue_depth": ("gauge", "队列中等待处理的项数", None),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """固定桶直方图，observe 只做一次二分查找和几次加法"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """按桶估计分位数：返回分位点所在桶的上界（最后一个桶用最大值）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 6),
+        }
+
+
+class MetricsRegistry:
+    """进程内的指标表：计数器、仪表和直方图，按 (指标名, 标签) 区分
+
+    collectors 是在导出时才调用的函数（如缓存的 stats()），热路径上没有任何开销。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self.collectors = {}
+
+    def _kind(self, name):
+        return METRICS.get(name, ("gauge", "", None))
+
+    def inc(self, name, value=1, labels=None):
+        key = (name, _label_key(labels or {}))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        with self._lock:
+            self._values[(name, _label_key(labels or {}))] = value
+
+    def observe(self, name, value, labels=None):
+        key = (name, _label_key(labels or {}))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = Histogram(self._kind(name)[2] or LATENCY_BUCKETS)
+            histogram.observe(value)
+
+    def _collected(self):
+        """调用所有 collector，把返回字典里的数值转换为仪表"""
+        values = []
+        for prefix, collect in list(self.collectors.items()):
+            try:
+                stats = collect()
+            except Exception:
+                continue
+            for field, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values.append(((f"{prefix}_{field}", ()), value))
+        return values
+
+    def _items(self):
+        with self._lock:
+            items = [(key, value.to_dict() if isinstance(value, Histogram) else value)
+                     for key, value in self._values.items()]
+            histograms = {key: (list(value.counts), value.sum, value.count)
+                          for key, value in self._values.items() if isinstance(value, Histogram)}
+        return sorted(items + self._collected(), key=lambda item: item[0]), histograms
+
+    def snapshot(self):
+        """可 JSON 序列化的快照：{"time", "metrics": {名称: [{"labels", "value" 或直方图统计}]}}"""
+        items, _ = self._items()
+        metrics = {}
+        for (name, labels), value in items:
+            record = {"labels": dict(labels)}
+            if isinstance(value, dict):
+                record.update(value)
+            else:
+                record["value"] = value
+            metrics.setdefault(name, []).append(record)
+        return {"time": time.time(), "metrics": metrics}
+
+    def prometheus_text(self):
+        """Prometheus 文本格式（0.0.4）"""
+        items, histograms = self._items()
+        lines = []
+        described = set()
+        for (name, labels), value in items:
+            kind, help_text, buckets = self._kind(name)
+            if name not in described:
+                described.add(name)
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            if not isinstance(value, dict):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            counts, total, count = histograms[(name, labels)]
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets or LATENCY_BUCKETS) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# 未启用时为 None：下面的记录函数第一行就返回，几乎没有开销
+_registry = None
+_collectors = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return _registry is not None
+
+
+def get_registry():
+    return _registry
+
+
+def register_collector(prefix, collect):
+    """注册导出时调用的统计函数，返回字典中的数值以 <prefix>_<字段> 为名导出；未启用时也会记住"""
+    _collectors[prefix] = collect
+    if _registry is not None:
+        _registry.collectors[prefix] = collect
+
+
+def inc(name, value=1, **labels):
+    if _registry is None:
+        return
+    _registry.inc(name, value, labels)
+
+
+def set_gauge(name, value, **labels):
+    if _registry is None:
+        return
+    _registry.set(name, value, labels)
+
+
+def observe(name, value, **labels):
+    if _registry is None:
+        return
+    _registry.observe(name, value, labels)
+
+
+def observe_llm(endpoint, final, elapsed, ttft=None):
+    """记录一次 LLM 调用：总耗时、首 token 延迟，以及最后一个响应片段里 Ollama 自带的计数和耗时"""
+    if _registry is None:
+        return
+    final = final or {}
+    labels = {"endpoint": endpoint, "model": final.get("model") or "unknown"}
+    _registry.observe("llm_request_seconds", elapsed, labels)
+    if ttft is not None:
+        _registry.observe("llm_ttft_seconds", ttft, labels)
+    if final.get("eval_count") and final.get("eval_duration"):
+        _registry.observe("llm_tokens_per_second", final["eval_count"] / (final["eval_duration"] / 1e9), labels)
+        _registry.inc("llm_eval_tokens_total", final["eval_count"], labels)
+    if final.get("prompt_eval_count"):
+        _registry.inc("llm_prompt_tokens_total", final["prompt_eval_count"], labels)
+
+
+def observe_yolo(results, source):
+    """记录 YOLO 结果的 speed（preprocess / inference / postprocess，毫秒）"""
+    if _registry is None:
+        return
+    for result in results:
+        for stage, ms in (getattr(result, "speed", None) or {}).items():
+            if ms is not None:
+                _registry.observe("yolo_stage_ms", ms, {"stage": stage, "source": source})
+        _registry.inc("yolo_images_total", 1, {"source": source})
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(_registry.snapshot(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = _registry.prometheus_text().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """在后台线程提供 /metrics（Prometheus 文本）和 /metrics.json，返回 server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def dump_json(path):
+    """把当前快照写入 path（先写临时文件再替换，读取方不会读到半个文件）"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_registry.snapshot(), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def start_json_dump(path, interval=10.0):
+    """每隔 interval 秒把快照写入 path，进程退出时再写一次"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            dump_json(path)
+
+    threading.Thread(target=loop, name="metrics-dump", daemon=True).start()
+    atexit.register(dump_json, path)
+
+
+def enable(port=None, dump_path=None, dump_interval=10.0):
+    """启用指标收集；可同时开启 HTTP 端点和定期 JSON 输出，重复调用只生效一次"""
+    global _registry
+    with _lock:
+        if _registry is not None:
+            return _registry
+        registry = MetricsRegistry()
+        registry.collectors.update(_collectors)
+        _registry = registry
+    if port:
+        try:
+            start_http_server(port)
+            print(f"📈 指标: http://127.0.0.1:{port}/metrics")
+        except OSError as e:
+            print(f"⚠️ 指标端口 {port} 无法监听: {e}")
+    if dump_path:
+        start_json_dump(dump_path, dump_interval)
+    return _registry
+
+
+def enable_from_env():
+    """METRICS=1 启用；METRICS_PORT 开启 HTTP 端点，METRICS_DUMP 定期写 JSON 文件（间隔 METRICS_DUMP_INTERVAL 秒）"""
+    port = int(os.environ.get("METRICS_PORT", 0))
+    dump_path = os.environ.get("METRICS_DUMP")
+    if os.environ.get("METRICS", "0") != "0" or port or dump_path:
+        enable(port, dump_path, float(os.environ.get("METRICS_DUMP_INTERVAL", 10)))
+
+
+enable_from_env()
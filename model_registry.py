@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+
+BACKENDS = ("torch", "onnx", "openvino", "auto")
+
+_yolo_class = None
+_models = {}
+_timings = {}
+_lock = threading.Lock()
+
+
+def _import_yolo():
+    """第一次用到时才导入 ultralytics（会连带导入 torch，耗时较长）"""
+    global _yolo_class
+    if _yolo_class is None:
+        start = time.perf_counter()
+        from ultralytics import YOLO
+
+        _yolo_class = YOLO
+        _timings["import"] = time.perf_counter() - start
+    return _yolo_class
+
+
+def warmup(model, imgsz=640):
+    """用一张空白图跑一次推理，提前完成首次推理的初始化和内存分配，返回耗时（秒）"""
+    import numpy as np
+
+    start = time.perf_counter()
+    model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+    return time.perf_counter() - start
+
+
+def resolve_backend(backend=None):
+    """backend 为 None 时读取环境变量 YOLO_BACKEND（默认 torch）；auto 依次尝试 openvino、onnx"""
+    backend = backend or os.environ.get("YOLO_BACKEND", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {backend}，可选: {', '.join(BACKENDS)}")
+    if backend != "auto":
+        return backend
+    for candidate, module in (("openvino", "openvino"), ("onnx", "onnxruntime")):
+        try:
+            __import__(module)
+            return candidate
+        except ImportError:
+            continue
+    return "torch"
+
+
+def exported_path(weights, backend):
+    """导出文件与权重放在一起：yolov8n.onnx 或 yolov8n_openvino_model/"""
+    stem = os.path.splitext(weights)[0]
+    return f"{stem}.onnx" if backend == "onnx" else f"{stem}_openvino_model"
+
+
+def export_model(weights, backend, imgsz=640):
+    """把 PyTorch 权重导出为 ONNX / OpenVINO 格式，已有比权重新的导出文件时直接复用"""
+    path = exported_path(weights, backend)
+    if os.path.exists(path) and (not os.path.exists(weights) or os.path.getmtime(path) >= os.path.getmtime(weights)):
+        return path
+    YOLO = _import_yolo()
+    start = time.perf_counter()
+    # dynamic=True 让导出的模型支持任意批大小，批量分析和多路视频也能用
+    path = YOLO(weights).export(format=backend, imgsz=imgsz, dynamic=True)
+    _timings[f"export:{backend}"] = time.perf_counter() - start
+    return str(path)
+
+
+def get_model(weights='yolov8n.pt', warm=None, imgsz=640, backend=None):
+    """返回进程内共享的 YOLO 模型，同一个权重文件（和后端）只加载一次
+
+    warm 为 None 时读取环境变量 YOLO_WARMUP（默认 1）；预热只在第一次加载时进行。
+    backend 为 onnx / openvino 时第一次使用会导出模型并缓存在权重旁边，
+    推理仍通过 ultralytics，返回的检测结果与 PyTorch 后端接口相同；导出失败时退回 PyTorch。
+    """
+    if warm is None:
+        warm = os.environ.get("YOLO_WARMUP", "1") != "0"
+    backend = resolve_backend(backend)
+    key = (weights, backend)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            YOLO = _import_yolo()
+            source = weights
+            if backend != "torch":
+                try:
+                    source = export_model(weights, backend, imgsz)
+                except Exception as e:
+                    print(f"⚠️ 导出 {backend} 模型失败，改用 PyTorch: {e}")
+                    backend = "torch"
+            start = time.perf_counter()
+            model = YOLO(source, task="detect") if backend != "torch" else YOLO(source)
+            timing = {"load": time.perf_counter() - start}
+            if warm:
+                timing["first_inference"] = warmup(model, imgsz)
+            _timings[source] = timing
+            _models[key] = model
+    return model
+
+
+def timings():
+    """导入、加载和首次推理的耗时（秒），例如 {"import": 1.8, "yolov8n.pt": {"load": 0.1, "first_inference": 0.4}}"""
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in _timings.items()}
+
+
+def timing_summary():
+    parts = []
+    if "import" in _timings:
+        parts.append(f"导入 {_timings['import']:.2f}秒")
+    for key, value in _timings.items():
+        if key.startswith("export:"):
+            parts.append(f"导出 {key[7:]} {value:.2f}秒")
+    for weights, timing in _timings.items():
+        if not isinstance(timing, dict):
+            continue
+        text = f"{weights} 加载 {timing['load']:.2f}秒"
+        if "first_inference" in timing:
+            text += f"，预热推理 {timing['first_inference']:.2f}秒"
+        parts.append(text)
+    return "；".join(parts)
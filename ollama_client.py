@@ -0,0 +1,373 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from llm_scheduler import QueueRejected, current_class, get_scheduler
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+
+
+class OllamaError(Exception):
+    """Ollama 返回非 200 状态码时抛出"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class OllamaConfig:
+    """Ollama 连接配置（地址、模型、keep_alive、超时、重试、相同请求合并）"""
+
+    def __init__(self, base_url="http://localhost:11434", model="qwen2:0.5b",
+                 keep_alive="30m", timeout=60, connect_timeout=5,
+                 max_retries=3, backoff=0.5, pool_size=10, embed_model="nomic-embed-text", coalesce=True):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.embed_model = embed_model
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.coalesce = coalesce
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取配置，未设置时使用默认值"""
+        return cls(
+            base_url=os.environ.get("OLLAMA_HOST", "http://localhost:11434"),
+            model=os.environ.get("OLLAMA_MODEL", "qwen2:0.5b"),
+            keep_alive=os.environ.get("OLLAMA_KEEP_ALIVE", "30m"),
+            timeout=float(os.environ.get("OLLAMA_TIMEOUT", 60)),
+            max_retries=int(os.environ.get("OLLAMA_MAX_RETRIES", 3)),
+            pool_size=int(os.environ.get("OLLAMA_POOL_SIZE", 10)),
+            embed_model=os.environ.get("OLLAMA_EMBED_MODEL", "nomic-embed-text"),
+            coalesce=os.environ.get("LLM_COALESCE", "1") != "0",
+        )
+
+
+def print_token(token):
+    """命令行逐字输出回答，作为 on_token 回调使用"""
+    print(token, end="", flush=True)
+
+
+class TokenStream:
+    """逐个产出 token 的生成器包装，迭代结束后可读取首字延迟和生成速度
+
+    用法:
+        stream = client.stream(prompt)
+        for token in stream:
+            print(token, end="", flush=True)
+        print(stream.summary())
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.text = ""
+        self.ttft = None
+        self.total_time = None
+        self.token_count = 0
+        self.tokens_per_sec = None
+        self.final = None
+
+    @staticmethod
+    def _token(chunk):
+        # /api/generate 返回 response，/api/chat 返回 message.content
+        if "response" in chunk:
+            return chunk["response"]
+        return chunk.get("message", {}).get("content", "")
+
+    def __iter__(self):
+        start = time.perf_counter()
+        parts = []
+        for chunk in self._chunks:
+            token = self._token(chunk)
+            if token:
+                if self.ttft is None:
+                    self.ttft = time.perf_counter() - start
+                self.token_count += 1
+                parts.append(token)
+                yield token
+            if chunk.get("done"):
+                self.final = chunk
+        self.total_time = time.perf_counter() - start
+        self.text = "".join(parts)
+        self.tokens_per_sec = self._rate()
+
+    def _rate(self):
+        # 优先使用 Ollama 自己统计的 eval_count / eval_duration（纳秒）
+        if self.final and self.final.get("eval_count") and self.final.get("eval_duration"):
+            return self.final["eval_count"] / (self.final["eval_duration"] / 1e9)
+        if self.ttft is not None and self.token_count > 1 and self.total_time > self.ttft:
+            return (self.token_count - 1) / (self.total_time - self.ttft)
+        return None
+
+    def consume(self, on_token=None):
+        """读完整个流，返回完整文本；on_token 会收到每个 token"""
+        for token in self:
+            if on_token:
+                on_token(token)
+        return self.text
+
+    def stats(self):
+        return {
+            "ttft": self.ttft,
+            "total_time": self.total_time,
+            "tokens": self.token_count,
+            "tokens_per_sec": self.tokens_per_sec,
+        }
+
+    def summary(self):
+        if self.ttft is None:
+            return "⏱️ 未收到任何输出"
+        text = f"⏱️ 首字延迟: {self.ttft:.2f}秒 | 总耗时: {self.total_time:.2f}秒"
+        if self.tokens_per_sec:
+            text += f" | 生成速度: {self.tokens_per_sec:.1f} tokens/秒"
+        return text
+
+
+def build_payload(config, prompt, model=None, options=None, stream=False, extra=None):
+    """组装 /api/generate 请求体，未指定模型时使用配置中的默认模型"""
+    payload = {
+        "model": model or config.model,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": config.keep_alive,
+    }
+    if options:
+        payload["options"] = options
+    if extra:
+        payload.update(extra)
+    return payload
+
+
+def build_chat_payload(config, messages, model=None, options=None, stream=False, extra=None):
+    """组装 /api/chat 请求体"""
+    payload = {
+        "model": model or config.model,
+        "messages": messages,
+        "stream": stream,
+        "keep_alive": config.keep_alive,
+    }
+    if options:
+        payload["options"] = options
+    if extra:
+        payload.update(extra)
+    return payload
+
+
+def cache_key(payload):
+    """由请求体中的模型、提示词和其余生成参数计算缓存键"""
+    options = {k: v for k, v in payload.items() if k not in ("model", "prompt", "stream", "keep_alive")}
+    return ResponseCache.make_key(payload["model"], payload["prompt"], options)
+
+
+def flight_key(path, payload):
+    """合并进行中请求用的键：接口 + 模型 + 提示词（或消息列表）+ 其余生成参数"""
+    options = {k: v for k, v in payload.items() if k not in ("model", "prompt", "messages", "keep_alive")}
+    return ResponseCache.make_key(payload["model"], [path, payload.get("prompt", payload.get("messages"))], options)
+
+
+class OllamaClient:
+    """带连接池的 Ollama 客户端，所有模块共用一个实例"""
+
+    # 模型加载中或服务过载时 Ollama 会返回这些状态码，值得重试
+    RETRY_STATUS = (500, 502, 503, 504)
+
+    def __init__(self, config=None, cache=None, scheduler=None):
+        self.config = config or OllamaConfig.from_env()
+        self.cache = cache
+        self.flights = SingleFlight() if self.config.coalesce else None
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.config.pool_size,
+                              pool_maxsize=self.config.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _url(self, path):
+        return f"{self.config.base_url}{path}"
+
+    def _timeout(self, timeout):
+        return (self.config.connect_timeout, timeout or self.config.timeout)
+
+    def _request(self, method, path, payload=None, timeout=None, stream=False, retries=None):
+        """发送请求，连接失败、超时和 5xx 时按指数退避重试"""
+        retries = self.config.max_retries if retries is None else retries
+        last_error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                metrics.inc("llm_retries_total", path=path)
+                time.sleep(self.config.backoff * (2 ** (attempt - 1)))
+            try:
+                response = self.session.request(method, self._url(path), json=payload,
+                                                timeout=self._timeout(timeout), stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                last_error = e
+                continue
+
+            if response.status_code == 200:
+                return response
+            if response.status_code in self.RETRY_STATUS and attempt < retries:
+                response.close()
+                continue
+            metrics.inc("llm_errors_total", path=path, status=response.status_code)
+            raise OllamaError(response.text, status_code=response.status_code)
+
+        metrics.inc("llm_errors_total", path=path, status=type(last_error).__name__)
+        raise last_error
+
+    @contextmanager
+    def _slot(self, request_class):
+        """在调度器中按优先级排队获得一个槽位；被拒绝时抛出状态码为 503 的 OllamaError"""
+        if self.scheduler is None:
+            yield
+            return
+        try:
+            self.scheduler.acquire(request_class)
+        except QueueRejected as e:
+            raise OllamaError(str(e), status_code=503) from e
+        try:
+            yield
+        finally:
+            self.scheduler.release(request_class)
+
+    def _post_json(self, path, payload, timeout):
+        """非流式 POST；相同请求正在进行时等待它的结果，而不是再让模型生成一遍"""
+        request_class = current_class()
+
+        def fetch():
+            with self._slot(request_class):
+                start = time.perf_counter()
+                result = self._request("POST", path, payload, timeout).json()
+            metrics.observe_llm(path.rsplit("/", 1)[-1], {"model": payload["model"], **result},
+                                time.perf_counter() - start)
+            return result
+
+        if self.flights is None:
+            return fetch()
+        return self.flights.do(flight_key(path, payload), fetch)
+
+    def _stream_lines(self, path, payload, timeout, request_class):
+        """发送流式请求，逐行产出 JSON 片段，结束时记录首 token 延迟和生成速度（整个流占用一个槽位）"""
+        with self._slot(request_class):
+            start = time.perf_counter()
+            ttft = None
+            response = self._request("POST", path, payload, timeout, stream=True)
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    try:
+                        chunk = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if ttft is None and TokenStream._token(chunk):
+                        ttft = time.perf_counter() - start
+                    yield chunk
+                    if chunk.get("done"):
+                        metrics.observe_llm(path.rsplit("/", 1)[-1], chunk, time.perf_counter() - start, ttft)
+                        break
+
+    def _post_stream(self, path, payload, timeout):
+        """流式 POST；相同的流正在进行时订阅它，从第一个片段开始重放"""
+        # 共享流在后台线程里读取，优先级要在调用方线程里取出
+        request_class = current_class()
+        if self.flights is None:
+            return self._stream_lines(path, payload, timeout, request_class)
+        return self.flights.stream(flight_key(path, payload),
+                                   lambda: self._stream_lines(path, payload, timeout, request_class))
+
+    def generate(self, prompt, model=None, options=None, timeout=None, use_cache=False, **extra):
+        """非流式生成，返回 Ollama 的完整 JSON 结果
+
+        use_cache=True 只用于结果确定的提示词（如固定标签分类），命中时不访问模型。
+        """
+        payload = build_payload(self.config, prompt, model, options, False, extra)
+        key = None
+        if use_cache and self.cache is not None:
+            key = cache_key(payload)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        result = self._post_json("/api/generate", payload, timeout)
+        if key is not None:
+            self.cache.set(key, result)
+        return result
+
+    def generate_text(self, prompt, model=None, options=None, timeout=None, use_cache=False, **extra):
+        """非流式生成，只返回回答文本"""
+        return self.generate(prompt, model, options, timeout, use_cache, **extra)["response"]
+
+    def generate_stream(self, prompt, model=None, options=None, timeout=None, **extra):
+        """流式生成，逐行产出 Ollama 返回的 JSON 片段"""
+        payload = build_payload(self.config, prompt, model, options, True, extra)
+        yield from self._post_stream("/api/generate", payload, timeout)
+
+    def stream(self, prompt, model=None, options=None, timeout=None, **extra):
+        """流式生成，返回逐个产出 token 的 TokenStream"""
+        return TokenStream(self.generate_stream(prompt, model, options, timeout, **extra))
+
+    def chat(self, messages, model=None, options=None, timeout=None, **extra):
+        """非流式多轮对话（/api/chat），返回 Ollama 的完整 JSON 结果"""
+        payload = build_chat_payload(self.config, messages, model, options, False, extra)
+        return self._post_json("/api/chat", payload, timeout)
+
+    def chat_stream(self, messages, model=None, options=None, timeout=None, **extra):
+        """流式多轮对话，逐行产出 JSON 片段"""
+        payload = build_chat_payload(self.config, messages, model, options, True, extra)
+        yield from self._post_stream("/api/chat", payload, timeout)
+
+    def stream_chat(self, messages, model=None, options=None, timeout=None, **extra):
+        """流式多轮对话，返回逐个产出 token 的 TokenStream"""
+        return TokenStream(self.chat_stream(messages, model, options, timeout, **extra))
+
+    def embed(self, text, model=None, timeout=None):
+        """调用 /api/embeddings，返回文本的向量"""
+        payload = {
+            "model": model or self.config.embed_model,
+            "prompt": text,
+            "keep_alive": self.config.keep_alive,
+        }
+        return self._post_json("/api/embeddings", payload, timeout)["embedding"]
+
+    def list_models(self, timeout=5):
+        """返回已安装模型的名称列表"""
+        response = self._request("GET", "/api/tags", timeout=timeout, retries=0)
+        return [model.get("name") for model in response.json().get("models", [])]
+
+    def ping(self, timeout=5):
+        """检查 Ollama 服务是否在运行"""
+        try:
+            self._request("GET", "/", timeout=timeout, retries=0)
+            return True
+        except (requests.exceptions.RequestException, OllamaError):
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_client():
+    """返回进程内共享的 OllamaClient"""
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = OllamaClient(cache=ResponseCache.from_env())
+                metrics.register_collector("llm_cache", _default_client.cache.stats)
+                if _default_client.flights is not None:
+                    metrics.register_collector("llm_flights", _default_client.flights.stats)
+    return _default_client
@@ -0,0 +1,176 @@
+import os
+import re
+import threading
+
+from llm_scheduler import request_class
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符约 1 个 token，其余字符约 4 个一个 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ApproxTokenizer:
+    """默认分词计数器，不依赖任何模型文件"""
+
+    name = "approx"
+
+    def count(self, text):
+        return estimate_tokens(text)
+
+
+class HuggingFaceTokenizer:
+    """用 transformers 的分词器精确计数（需要 pip install transformers）"""
+
+    def __init__(self, model_name):
+        from transformers import AutoTokenizer
+
+        self.name = model_name
+        self._tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def count(self, text):
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+
+def get_tokenizer():
+    """PROMPT_TOKENIZER=approx（默认）或 hf:<模型名>，例如 hf:Qwen/Qwen2-0.5B"""
+    spec = os.environ.get("PROMPT_TOKENIZER", "approx")
+    if spec.startswith("hf:"):
+        return HuggingFaceTokenizer(spec[3:])
+    return ApproxTokenizer()
+
+
+# Ollama 默认的 num_ctx；模型实际支持更长上下文时用 OLLAMA_NUM_CTX 调大
+MODEL_CONTEXT = {
+    "qwen2:0.5b": 2048,
+}
+
+
+def context_budget(model, reserve_for_reply=512):
+    """提示词可用的 token 数 = 上下文长度 - 留给回答的部分"""
+    num_ctx = int(os.environ.get("OLLAMA_NUM_CTX", MODEL_CONTEXT.get(model, 2048)))
+    return max(256, num_ctx - reserve_for_reply)
+
+
+class PromptSection:
+    """提示词中的一段可裁剪内容
+
+    items 按重要程度排列（最重要的在前），预算不够时从后往前丢弃；
+    chronological=True 时输出顺序与 items 相反（items 由新到旧给出，按由旧到新显示）。
+    priority 越小越先分配预算，与显示顺序无关。
+    """
+
+    def __init__(self, title, items, priority=0, chronological=False):
+        self.title = title
+        self.items = [item for item in items if item]
+        self.priority = priority
+        self.chronological = chronological
+
+
+class PromptBuilder:
+    """在 token 预算内组装提示词：头部和尾部必须保留，中间各段按优先级填充"""
+
+    def __init__(self, model=None, budget=None, tokenizer=None):
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.budget = budget or context_budget(model)
+        self.last_token_count = 0
+
+    def count(self, text):
+        return self.tokenizer.count(text)
+
+    def build(self, header, footer, sections):
+        used = self.count(header) + self.count(footer)
+        chosen = {}
+        for section in sorted(sections, key=lambda s: s.priority):
+            kept = []
+            title_cost = self.count(section.title)
+            for item in section.items:
+                cost = self.count(item) + (0 if kept else title_cost)
+                if used + cost > self.budget:
+                    break
+                kept.append(item)
+                used += cost
+            chosen[id(section)] = kept
+
+        parts = [header.strip()]
+        for section in sections:
+            kept = chosen[id(section)]
+            if kept:
+                if section.chronological:
+                    kept = kept[::-1]
+                parts.append(section.title + "\n" + "\n".join(kept))
+        parts.append(footer.strip())
+
+        self.last_token_count = used
+        return "\n\n".join(parts)
+
+
+class RollingSummary:
+    """把移出"最近对话"窗口的旧对话增量压缩成摘要，存进长期记忆的 summary 键
+
+    只有当至少 min_batch 轮新对话移出窗口时才调用一次模型，其余时候直接复用缓存的摘要；
+    摘要落后很多时（如 Ollama 出错期间）每次最多合并 max_batch 轮，分几次追上。
+    """
+
+    def __init__(self, memory, client, keep_recent=6, min_batch=4, max_chars=300, max_batch=50):
+        self.memory = memory
+        self.client = client
+        self.keep_recent = keep_recent
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+
+    @property
+    def digest(self):
+        return self.memory.memory.get("summary", {}).get("text", "")
+
+    def pending_turns(self):
+        """已移出窗口、但还没并入摘要的对话"""
+        covered_until = self.memory.memory.get("summary", {}).get("covered_until", "")
+        history = self.memory.memory["conversation_history"]
+        if (len(history) >= self.memory.HISTORY_WINDOW and history
+                and history[0].get("timestamp", "") > covered_until):
+            # 内存窗口里最早的一轮也还没并入摘要，更早的对话只在存储里，从完整历史中读取
+            history = list(self.memory.iter_history())
+        outside = history[:-self.keep_recent] if self.keep_recent else history
+        return [chat for chat in outside if chat.get("timestamp", "") > covered_until]
+
+    @request_class("background")
+    def update(self):
+        """需要时更新摘要，返回是否调用了模型；同一用户同时只会有一次更新"""
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            turns = self.pending_turns()
+            if len(turns) < self.min_batch:
+                return False
+            turns = turns[:self.max_batch]
+
+            dialogue = "\n".join(f"用户: {chat['user_input']}\n助理: {chat['ai_response']}" for chat in turns)
+            prompt = f"""已有摘要：
+{self.digest or "（无）"}
+
+新的对话：
+{dialogue}
+
+请把已有摘要和新的对话合并成一段不超过{self.max_chars}字的摘要，保留用户的重要经历、情绪变化和关心的问题。只输出摘要。"""
+            try:
+                text = self.client.generate_text(prompt, timeout=60).strip()
+            except Exception:
+                return False
+
+            summary = {"text": text[:self.max_chars * 2], "covered_until": turns[-1].get("timestamp", "")}
+            self.memory.memory["summary"] = summary
+            self.memory.store.set("summary", summary)
+            return True
+        finally:
+            self._lock.release()
+
+    def schedule(self, executor):
+        """有足够多的新对话移出窗口时，在后台线程里更新摘要，不阻塞当前回合"""
+        if len(self.pending_turns()) >= self.min_batch:
+            executor.submit(self.update)
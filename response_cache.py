@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """两级响应缓存：内存 LRU + SQLite 磁盘，支持 TTL 和按条数/大小淘汰
+
+    键由 make_key(model, prompt, options) 生成，值为可 JSON 序列化的对象。
+    """
+
+    def __init__(self, path="llm_cache.sqlite", max_memory_entries=256, max_disk_entries=10000,
+                 max_disk_bytes=50 * 1024 * 1024, ttl=7 * 24 * 3600, enabled=True):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取配置：LLM_CACHE=0 关闭缓存，LLM_CACHE_PATH 指定磁盘文件"""
+        return cls(
+            path=os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite"),
+            ttl=float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600)),
+            enabled=os.environ.get("LLM_CACHE", "1") != "0",
+        )
+
+    @staticmethod
+    def make_key(model, prompt, options=None):
+        """按 (模型, 提示词, 参数) 生成内容寻址的缓存键"""
+        raw = json.dumps([model, prompt, options or {}], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _connect(self):
+        # 第一次用到磁盘层时才创建数据库文件
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed)")
+            self._db.commit()
+        return self._db
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """命中返回缓存值，未命中或已过期返回 None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            db = self._connect()
+            row = db.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                if row is not None:
+                    db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    db.commit()
+                self.misses += 1
+                return None
+
+            db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            db.commit()
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            self.hits += 1
+            self.disk_hits += 1
+            return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, value, now)
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                       (key, data, len(data.encode("utf-8")), now, now))
+            self._evict(db, now)
+            db.commit()
+
+    def set_many(self, items):
+        """批量写入 (键, 值)，只提交一次、只检查一次淘汰"""
+        if not self.enabled or not items:
+            return
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, value in items:
+                data = json.dumps(value, ensure_ascii=False)
+                self._remember(key, value, now)
+                rows.append((key, data, len(data.encode("utf-8")), now, now))
+            db = self._connect()
+            db.executemany("INSERT OR REPLACE INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                           rows)
+            self._evict(db, now)
+            db.commit()
+
+    def _evict(self, db, now):
+        """删除过期条目，再按最近访问时间淘汰超出条数或大小上限的条目"""
+        if self.ttl is not None:
+            self.evictions += db.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,)).rowcount
+
+        count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        while count > self.max_disk_entries or total > self.max_disk_bytes:
+            oldest = db.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 64").fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if count <= self.max_disk_entries and total <= self.max_disk_bytes:
+                    break
+                db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                count -= 1
+                total -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            db.execute("DELETE FROM cache")
+            db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
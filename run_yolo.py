@@ -1,24 +1,25 @@
-from ultralytics import YOLO
+import metrics
+from detection_summary import DetectionSummary
+from model_registry import get_model, timing_summary
 
 
 def simple_yolo_test():
     print("🚀 启动YOLO图像识别...")
 
     # 加载模型（首次运行会自动下载）
-    model = YOLO('yolov8n.pt')
-    print("✅ 模型加载完成")
+    model = get_model('yolov8n.pt')
+    print(f"✅ 模型加载完成（{timing_summary()}）")
 
     # 方法1：使用网络测试图片
     print("方法1: 测试网络图片...")
     results = model('https://ultralytics.com/images/bus.jpg')
+    metrics.observe_yolo(results, "run_yolo")
 
     # 显示结果
     print("🎯 识别结果:")
-    for result in results:
-        for box in result.boxes:
-            class_name = result.names[box.cls.item()]
-            confidence = box.conf.item()
-            print(f"  - {class_name}: {confidence:.1%}")
+    summary = DetectionSummary.from_result(results[0])
+    for class_name, confidence in zip(summary.labels(), summary.detections["conf"].tolist()):
+        print(f"  - {class_name}: {confidence:.1%}")
 
     # 保存带标注的结果图片
     results[0].save('result_bus.jpg')
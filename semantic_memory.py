@@ -0,0 +1,390 @@
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+from llm_scheduler import request_class
+from ollama_client import get_client
+
+
+class HashingEmbedder:
+    """本地兜底向量：字符 1-3 gram 哈希到固定维度，不需要任何模型"""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = text.lower()
+        for n in (1, 2, 3):
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                # 用哈希的一位决定符号，减少不同 n-gram 撞到同一维时的相互叠加
+                vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return vector
+
+
+class OllamaEmbedder:
+    """通过 Ollama /api/embeddings 生成向量"""
+
+    def __init__(self, client=None, model=None):
+        self.client = client or get_client()
+        self.model = model or self.client.config.embed_model
+        self.name = f"ollama-{self.model}"
+
+    def embed(self, text):
+        return np.asarray(self.client.embed(text, model=self.model), dtype=np.float32)
+
+
+def embedder_from_name(name):
+    """按索引里记录的名称重建嵌入器（hashing-<维度> 或 ollama-<模型>），不访问 Ollama"""
+    kind, _, arg = name.partition("-")
+    if kind == "hashing":
+        return HashingEmbedder(int(arg))
+    if kind == "ollama":
+        return OllamaEmbedder(model=arg)
+    raise ValueError(f"未知的嵌入器: {name}")
+
+
+def default_embedder(saved_name=None):
+    """EMBEDDING_BACKEND=ollama/local 显式指定；默认 auto
+
+    auto 模式下已有索引时沿用索引记录的嵌入器（saved_name），不因为 Ollama 暂时不可用而换模型；
+    新建索引时已安装嵌入模型就用 Ollama，否则用本地哈希。
+    """
+    backend = os.environ.get("EMBEDDING_BACKEND", "auto")
+    if backend == "local":
+        return HashingEmbedder()
+    client = get_client()
+    if backend == "ollama":
+        return OllamaEmbedder(client)
+    if saved_name:
+        return embedder_from_name(saved_name)
+    try:
+        models = client.list_models()
+    except Exception:
+        return HashingEmbedder()
+    model = client.config.embed_model
+    if any(name == model or name.split(":")[0] == model for name in models):
+        return OllamaEmbedder(client)
+    return HashingEmbedder()
+
+
+class _MatrixIndex:
+    """追加式向量索引的公共部分：向量矩阵 + 条目列表，子类负责持久化
+
+    向量写入前已归一化，检索就是一次矩阵乘法加 argpartition。
+    embedder_name 和 dim 在第一次写入时确定，之前为 None。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vectors = None
+        self.capacity = 0
+        self.count = 0
+        self.items = []
+        self.dim = None
+        self.embedder_name = None
+
+    def add_many(self, vectors, items, embedder_name):
+        """追加一批向量和对应条目，整批只持久化一次"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1.0)
+        with self._lock:
+            if self.embedder_name is None:
+                self.embedder_name, self.dim = embedder_name, vectors.shape[1]
+            elif embedder_name != self.embedder_name or vectors.shape[1] != self.dim:
+                raise ValueError(f"索引由 {self.embedder_name}（{self.dim} 维）建立，不能混入 {embedder_name} 的向量")
+            end = self.count + len(vectors)
+            if end > self.capacity:
+                self._grow(max(1024, end * 2))
+            self._vectors[self.count:end] = vectors
+            self._persist(self.count, vectors, items)
+            self.items.extend(items)
+            self.count = end
+
+    def search(self, vector, k=5):
+        """返回余弦相似度最高的 k 条 (分数, 条目)"""
+        with self._lock:
+            vectors, items, limit = self._vectors, self.items, self.count
+        if limit <= 0 or k <= 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or query.shape[0] != self.dim:
+            return []
+        scores = vectors[:limit] @ (query / norm)
+        k = min(k, limit)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), items[i]) for i in top]
+
+    def reset(self):
+        """清空索引（只在显式更换嵌入模型时调用）"""
+        with self._lock:
+            self._clear()
+            self._vectors = None
+            self.capacity = 0
+            self.count = 0
+            self.items = []
+            self.dim = None
+            self.embedder_name = None
+
+    def close(self):
+        pass
+
+
+class VectorIndex(_MatrixIndex):
+    """与 JsonlMemoryStore 放在一起的文件索引：向量存在 NumPy memmap 里，条目文本存在 JSONL 里
+
+    - <prefix>.vectors.f32: 向量
+    - <prefix>.items.jsonl: 条目
+    - <prefix>.meta.json: {"count", "dim", "embedder"}，最后写入，崩溃时多出的向量和条目会被忽略
+    """
+
+    def __init__(self, prefix):
+        super().__init__()
+        self.vectors_file = f"{prefix}.vectors.f32"
+        self.items_file = f"{prefix}.items.jsonl"
+        self.meta_file = f"{prefix}.meta.json"
+
+        meta = {}
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        self._load_items(meta.get("count", 0))
+        if self.count:
+            self.dim = meta["dim"]
+            self.embedder_name = meta["embedder"]
+            self._grow(max(1024, self.count * 2))
+
+    def _load_items(self, count):
+        if os.path.exists(self.items_file):
+            with open(self.items_file, 'rb+') as f:
+                offset = 0
+                for line in f:
+                    if len(self.items) >= count:
+                        break
+                    try:
+                        self.items.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+                    offset += len(line)
+                # 去掉 meta 之后才写入的多余条目，保证条目与向量一一对应
+                f.truncate(offset)
+        self.count = len(self.items)
+
+    def _grow(self, capacity):
+        if self._vectors is not None:
+            self._vectors.flush()
+        with open(self.vectors_file, 'ab') as f:
+            if f.tell() < capacity * self.dim * 4:
+                f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self._vectors = np.memmap(self.vectors_file, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+
+    def _persist(self, start, vectors, items):
+        with open(self.items_file, 'a', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        # 向量和条目都落盘后再更新 meta，否则崩溃后 meta 的条数会覆盖到没写进文件的向量（读回来全是 0）
+        self._vectors.flush()
+        self._save_meta(start + len(items))
+
+    def _save_meta(self, count):
+        tmp_path = f"{self.meta_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"count": count, "dim": self.dim, "embedder": self.embedder_name}, f)
+        os.replace(tmp_path, self.meta_file)
+
+    def _clear(self):
+        self._vectors = None
+        for path in (self.meta_file, self.vectors_file, self.items_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+
+
+class SqliteVectorIndex(_MatrixIndex):
+    """存在 MemoryService 数据库 semantic_vectors 表里的索引，打开时整体读入内存"""
+
+    def __init__(self, service, user_id):
+        super().__init__()
+        self.service = service
+        self.user_id = user_id
+        rows = service.load_vectors(user_id)
+        if rows:
+            self.embedder_name = rows[0][0]
+            vectors = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+            self.dim = vectors.shape[1]
+            self.items = [json.loads(row[2]) for row in rows]
+            self.count = len(rows)
+            self._grow(max(1024, self.count * 2))
+            self._vectors[:self.count] = vectors
+
+    def _grow(self, capacity):
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        if self._vectors is not None:
+            vectors[:self.count] = self._vectors[:self.count]
+        self.capacity = capacity
+        self._vectors = vectors
+
+    def _persist(self, start, vectors, items):
+        self.service.append_vectors(self.user_id, start, self.embedder_name,
+                                    [(vector.tobytes(), json.dumps(item, ensure_ascii=False))
+                                     for vector, item in zip(vectors, items)])
+
+    def _clear(self):
+        self.service.clear_vectors(self.user_id)
+
+
+def open_index(user_id, memory_service=None, directory="."):
+    """打开与记忆存储放在一起的索引：使用 MemoryService 时存进同一个数据库，否则与 JSONL 文件放在同一目录"""
+    if memory_service is not None:
+        return SqliteVectorIndex(memory_service, user_id)
+    return VectorIndex(os.path.join(directory, f"memory_{user_id}"))
+
+
+class SemanticMemory:
+    """单个用户全部历史对话的语义索引
+
+    - 索引记录建立时使用的嵌入器并一直沿用；它暂时不可用（如 Ollama 未启动）时只是检索不到结果，不会清空索引
+    - 尚未索引的历史对话由后台线程按批补建（start_backfill），不阻塞创建助手和对话
+    """
+
+    BATCH_SIZE = 32
+
+    def __init__(self, index, embedder=None):
+        self.index = index
+        self.embedder = embedder or default_embedder(index.embedder_name)
+        if index.embedder_name not in (None, self.embedder.name):
+            # 显式换了嵌入模型，旧向量不能混用，清空后由后台重建
+            index.reset()
+        self._lock = threading.Lock()
+        self._history = None
+        self._worker = None
+        self._pending = False
+        self._caught_up = False
+
+    @staticmethod
+    def _turn_text(conversation):
+        return f"用户: {conversation['user_input']}\n助理: {conversation['ai_response']}"
+
+    @staticmethod
+    def turn_key(conversation):
+        """标识一轮对话（时间戳 + 用户输入），用于排除已在最近对话里的轮次"""
+        return conversation.get("timestamp"), conversation["user_input"]
+
+    @staticmethod
+    def _item(conversation):
+        return {
+            "timestamp": conversation.get("timestamp"),
+            "user_input": conversation["user_input"],
+            "ai_response": conversation["ai_response"],
+        }
+
+    def _add_batch(self, conversations):
+        vectors = [self.embedder.embed(self._turn_text(conversation)) for conversation in conversations]
+        self.index.add_many(vectors, [self._item(conversation) for conversation in conversations],
+                            self.embedder.name)
+        return len(conversations)
+
+    def start_backfill(self, history):
+        """history() 返回按时间顺序的全部对话；在后台线程把尚未索引的部分分批补进索引"""
+        with self._lock:
+            self._history = history
+            self._schedule_locked()
+
+    def _schedule_locked(self):
+        self._pending = True
+        if self._worker is None and self._history is not None:
+            self._worker = threading.Thread(target=self._backfill, name="semantic-backfill", daemon=True)
+            self._worker.start()
+
+    @request_class("batch")
+    def _backfill(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._caught_up = True
+                    self._worker = None
+                    return
+                self._pending = False
+            try:
+                self.sync(self._history())
+            except Exception as e:
+                # 保留已写入的批次，下一轮对话时再从断点继续
+                print(f"⚠️ 语义索引补建中断: {e}")
+                with self._lock:
+                    self._worker = None
+                return
+
+    def wait(self, timeout=None):
+        """等待后台补建结束（测试和离线脚本用）"""
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+
+    def add_turn(self, conversation):
+        """索引新的一轮对话；后台补建还没追上时交给补建线程，保证索引始终是历史的前缀"""
+        with self._lock:
+            if not self._caught_up:
+                self._schedule_locked()
+                return
+        try:
+            vector = self.embedder.embed(self._turn_text(conversation))
+        except Exception:
+            # 嵌入器暂时不可用：这一轮留给之后的补建
+            with self._lock:
+                self._caught_up = False
+            return
+        self.index.add_many([vector], [self._item(conversation)], self.embedder.name)
+
+    def sync(self, history, batch_size=None):
+        """把尚未索引的历史对话按批补进索引（history 按时间顺序，索引是它的前缀），返回补入的条数"""
+        batch_size = batch_size or self.BATCH_SIZE
+        start = self.index.count
+        added = 0
+        batch = []
+        for position, conversation in enumerate(history):
+            if position < start:
+                continue
+            batch.append(conversation)
+            if len(batch) >= batch_size:
+                added += self._add_batch(batch)
+                batch = []
+        if batch:
+            added += self._add_batch(batch)
+        return added
+
+    def search(self, query, k=5, exclude=()):
+        """返回最相关的 k 条 (分数, 条目)；exclude 为要跳过的 turn_key 集合
+
+        按对话本身而不是索引位置排除：后台补建还没追上时，索引末尾并不是最新的几轮对话。
+        """
+        if not self.index.count:
+            return []
+        try:
+            vector = self.embedder.embed(query)
+        except Exception:
+            # 嵌入器暂时不可用时不做检索，已有索引保持不变
+            return []
+        results = [(score, item) for score, item in self.index.search(vector, k + len(exclude))
+                   if self.turn_key(item) not in exclude]
+        return results[:k]
+
+    def related_turns(self, query, k=8, exclude=(), min_score=0.2):
+        """按相关度从高到低返回相关过往对话的文本，exclude 中的轮次（通常是最近几轮）不参与检索"""
+        return [self._turn_text(item) for score, item in self.search(query, k, set(exclude))
+                if score >= min_score]
+
+    def close(self):
+        self.index.close()
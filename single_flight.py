@@ -0,0 +1,240 @@
+import asyncio
+import threading
+
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SharedStream:
+    """后台线程读取一个上游流并保存已收到的片段，每个订阅者从头重放，再跟随后续片段
+
+    所有订阅者都提前退出时停止读取上游（关闭连接，Ollama 随之停止生成）。
+    """
+
+    def __init__(self, chunks, on_done):
+        self._chunks = chunks
+        self._on_done = on_done
+        self._buffer = []
+        self._finished = False
+        self._cancelled = False
+        self._error = None
+        self._subscribers = 0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._pump, name="shared-stream", daemon=True).start()
+
+    def _pump(self):
+        try:
+            for chunk in self._chunks:
+                with self._cond:
+                    self._buffer.append(chunk)
+                    self._cond.notify_all()
+                    if self._cancelled:
+                        self._error = RuntimeError("共享的流已被所有订阅者放弃")
+                        break
+        except Exception as e:
+            self._error = e
+        finally:
+            self._chunks.close()
+            # 先从表中移除，之后到达的相同请求会发起新的上游调用
+            self._on_done()
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+
+    def subscribe(self):
+        """逐个产出片段；上游出错时在读到出错位置后抛出同样的异常"""
+        with self._cond:
+            self._subscribers += 1
+            self._cancelled = False
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self._buffer) and not self._finished:
+                        self._cond.wait()
+                    chunks = self._buffer[index:]
+                    finished, error = self._finished, self._error
+                index += len(chunks)
+                yield from chunks
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+                if not self._subscribers and not self._finished:
+                    self._cancelled = True
+
+
+class SingleFlight:
+    """合并同时进行的相同请求：同一个键同一时间只有一次上游调用，其余调用方等待并共享结果
+
+    只合并进行中的请求，完成后立即从表中移除；结果的复用由 ResponseCache 负责。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def _joined(self, kind):
+        self.coalesced += 1
+        metrics.inc("llm_coalesced_total", kind=kind)
+
+    def do(self, key, fetch):
+        """调用 fetch() 或等待已在进行的相同调用，返回其结果（异常同样共享）"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self._joined("call")
+        if leader:
+            try:
+                call.result = fetch()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stream(self, key, open_stream):
+        """open_stream() 返回上游片段的生成器；相同的流正在进行时直接订阅它"""
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                self.calls += 1
+
+                def on_done():
+                    with self._lock:
+                        if self._streams.get(key) is shared:
+                            del self._streams[key]
+
+                shared = self._streams[key] = SharedStream(open_stream(), on_done)
+            else:
+                self._joined("stream")
+        return shared.subscribe()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced,
+                    "in_flight": len(self._calls) + len(self._streams)}
+
+
+class AsyncSharedStream:
+    """SharedStream 的 asyncio 版本：由一个任务读取上游异步生成器"""
+
+    def __init__(self, chunks, on_done):
+        self._on_done = on_done
+        self._buffer = []
+        self._finished = False
+        self._error = None
+        self._subscribers = 0
+        self._changed = asyncio.Condition()
+        self._task = asyncio.ensure_future(self._pump(chunks))
+
+    async def _pump(self, chunks):
+        try:
+            async for chunk in chunks:
+                async with self._changed:
+                    self._buffer.append(chunk)
+                    self._changed.notify_all()
+        except asyncio.CancelledError:
+            self._error = RuntimeError("共享的流已被所有订阅者放弃")
+        except Exception as e:
+            self._error = e
+        finally:
+            await chunks.aclose()
+            self._on_done()
+            async with self._changed:
+                self._finished = True
+                self._changed.notify_all()
+
+    async def subscribe(self):
+        self._subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: index < len(self._buffer) or self._finished)
+                    chunks = self._buffer[index:]
+                    finished, error = self._finished, self._error
+                index += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._subscribers -= 1
+            if not self._subscribers and not self._finished:
+                self._task.cancel()
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的 asyncio 版本，供同一事件循环里的协程共享请求"""
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def _joined(self, kind):
+        self.coalesced += 1
+        metrics.inc("llm_coalesced_total", kind=kind)
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有调用方都取消时，避免“异常未被读取”的警告
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key, fetch):
+        """await fetch() 或等待已在进行的相同调用；某个调用方被取消不会影响其他调用方"""
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.calls += 1
+        else:
+            self._joined("call")
+        return await asyncio.shield(task)
+
+    def stream(self, key, open_stream):
+        """open_stream() 返回上游片段的异步生成器；相同的流正在进行时直接订阅它"""
+        shared = self._streams.get(key)
+        if shared is None:
+            self.calls += 1
+
+            def on_done():
+                if self._streams.get(key) is shared:
+                    del self._streams[key]
+
+            shared = self._streams[key] = AsyncSharedStream(open_stream(), on_done)
+        else:
+            self._joined("stream")
+        return shared.subscribe()
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._streams)}
@@ -0,0 +1,284 @@
+import argparse
+import json
+import queue
+import threading
+import time
+
+import cv2
+
+import metrics
+from batch_analyzer import load_model
+from camera_yolo import StageStats, put_latest
+from detection_summary import DetectionSummary
+
+
+class StreamReader:
+    """在独立线程里读取一路视频源，只保留最新一帧
+
+    source 可以是摄像头索引、视频文件或 RTSP 地址。视频文件默认按原始帧率读取，
+    这样可以用本地文件模拟摄像头；loop=True 时读到结尾后从头开始。
+    """
+
+    def __init__(self, name, source, loop=False, realtime=None, ready=None):
+        self.name = name
+        self.source = int(source) if str(source).isdigit() else source
+        self.loop = loop
+        is_file = isinstance(self.source, str) and "://" not in self.source
+        self.realtime = is_file if realtime is None else realtime
+        self.ready = ready or threading.Event()
+        self.frames = queue.Queue(maxsize=1)
+        self.finished = threading.Event()
+        self.stop_event = threading.Event()
+        self.read_count = 0
+        self.inferred = 0
+        self.dropped = 0
+        self.detections = 0
+        self.latency = StageStats("延迟")
+        self.started = None
+        self._thread = threading.Thread(target=self._loop, name=f"stream-{name}", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def _loop(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            print(f"❌ [{self.name}] 无法打开视频源: {self.source}")
+            self.finished.set()
+            self.ready.set()
+            return
+        interval = 0.0
+        if self.realtime:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            interval = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+        next_time = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    if self.loop and isinstance(self.source, str):
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    break
+                if interval:
+                    next_time += interval
+                    delay = next_time - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.dropped += put_latest(self.frames, (self.read_count, frame, time.perf_counter()))
+                self.read_count += 1
+                self.ready.set()
+        finally:
+            cap.release()
+            self.finished.set()
+            self.ready.set()
+
+    def take(self):
+        """取出最新一帧 (帧序号, 画面, 读取时间)，没有新帧时返回 None"""
+        try:
+            return self.frames.get_nowait()
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        self.stop_event.set()
+        self._thread.join(timeout=2)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        return {
+            "read": self.read_count,
+            "inferred": self.inferred,
+            "dropped": self.dropped,
+            "detections": self.detections,
+            "fps": self.inferred / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class JsonlSink:
+    """把每一帧的检测结果追加到 JSONL 文件，每行带上视频流名称"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, stream, frame_index, result):
+        record = {"stream": stream, "frame": frame_index, "time": time.time(),
+                  "detections": DetectionSummary.from_result(result).to_records()}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class StreamServer:
+    """多路视频共用一个已加载的 YOLO 模型
+
+    推理线程从各路视频各取最新一帧拼成一批（最多 batch_size 帧，凑批最多等 max_wait 秒），
+    一次前向计算后把每帧的结果交给对应视频流的 sink。
+    """
+
+    def __init__(self, model, readers, sinks, batch_size=8, max_wait=0.01):
+        self.model = model
+        self.readers = readers
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.ready = threading.Event()
+        for reader in readers:
+            reader.ready = self.ready
+        self.stop_event = threading.Event()
+        self.batches = 0
+        self.batch_frames = 0
+        self.infer_stats = StageStats("推理")
+        self._offset = 0
+
+    def _collect(self):
+        """轮流从各路视频取帧，凑满一批或等待超时后返回"""
+        batch = []
+        taken = set()
+        deadline = None
+        while not self.stop_event.is_set():
+            self.ready.clear()
+            # 每批从不同的视频流开始取，批次满时不会总是同几路被落下
+            order = self.readers[self._offset:] + self.readers[:self._offset]
+            for reader in order:
+                if len(batch) >= self.batch_size:
+                    break
+                if reader.name in taken:
+                    continue
+                item = reader.take()
+                if item is not None:
+                    batch.append((reader, item))
+                    taken.add(reader.name)
+            now = time.perf_counter()
+            if batch and deadline is None:
+                deadline = now + self.max_wait
+            if len(batch) >= self.batch_size or len(taken) == len(self.readers):
+                break
+            if all(reader.finished.is_set() and reader.frames.empty() for reader in self.readers):
+                break
+            timeout = 0.1 if deadline is None else deadline - now
+            if timeout <= 0:
+                break
+            self.ready.wait(timeout)
+        self._offset = (self._offset + 1) % len(self.readers)
+        return batch
+
+    def run(self, duration=None, report_every=10.0):
+        for reader in self.readers:
+            reader.start()
+        start = last_report = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                if duration and time.perf_counter() - start >= duration:
+                    break
+                batch = self._collect()
+                if not batch:
+                    if all(reader.finished.is_set() for reader in self.readers):
+                        break
+                    continue
+
+                infer_start = time.perf_counter()
+                results = self.model([frame for _, (_, frame, _) in batch], verbose=False)
+                done = time.perf_counter()
+                metrics.observe("batch_size", len(batch), source="stream")
+                metrics.observe_yolo(results, "stream")
+                self.infer_stats.add(done - infer_start)
+                self.batches += 1
+                self.batch_frames += len(batch)
+
+                for (reader, (frame_index, _, read_at)), result in zip(batch, results):
+                    reader.inferred += 1
+                    reader.detections += len(result.boxes) if result.boxes is not None else 0
+                    reader.latency.add(done - read_at)
+                    self.sinks[reader.name](reader.name, frame_index, result)
+
+                if done - last_report >= report_every:
+                    last_report = done
+                    self.print_stats()
+        except KeyboardInterrupt:
+            print("\n⏹️ 已停止")
+        finally:
+            self.stop_event.set()
+            for reader in self.readers:
+                reader.stop()
+
+    def print_stats(self):
+        average = self.batch_frames / self.batches if self.batches else 0.0
+        print(f"\n📊 批次 {self.batches}，平均每批 {average:.1f} 帧，{self.infer_stats.summary()}")
+        for reader in self.readers:
+            stats = reader.stats()
+            print(f"   [{reader.name}] 读取 {stats['read']} 帧，推理 {stats['inferred']} 帧，"
+                  f"丢弃 {stats['dropped']}，{stats['fps']:.1f} FPS，检测数 {stats['detections']}，"
+                  f"{reader.latency.summary()}")
+
+
+def load_config(path):
+    """读取视频流配置文件（JSON），例如：
+
+    {
+      "weights": "yolov8n.pt",
+      "batch_size": 8,
+      "max_wait_ms": 10,
+      "output": "stream_events.jsonl",
+      "streams": [
+        {"name": "cam0", "source": 0},
+        {"name": "door", "source": "rtsp://192.168.1.10/stream"},
+        {"name": "test", "source": "videos/test.mp4", "loop": true, "output": "test_events.jsonl"}
+      ]
+    }
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if not config.get("streams"):
+        raise ValueError("配置文件中没有 streams")
+    # 结果按名称分发到各自的 sink，重名的视频流会互相覆盖
+    seen = set()
+    for i, stream in enumerate(config["streams"]):
+        name = stream.get("name", f"stream{i}")
+        if name in seen:
+            raise ValueError(f"配置文件中视频流名称重复: {name}（第 {i + 1} 路）")
+        seen.add(name)
+    return config
+
+
+def build_server(config, model=None):
+    model = model or load_model(config.get("weights", "yolov8n.pt"))
+    readers = []
+    sinks = {}
+    files = {}
+    for i, stream in enumerate(config["streams"]):
+        name = stream.get("name", f"stream{i}")
+        readers.append(StreamReader(name, stream["source"], loop=stream.get("loop", False),
+                                    realtime=stream.get("realtime")))
+        path = stream.get("output", config.get("output", "stream_events.jsonl"))
+        # 多路视频写同一个文件时共用一个 sink
+        if path not in files:
+            files[path] = JsonlSink(path)
+        sinks[name] = files[path]
+    server = StreamServer(model, readers, sinks, batch_size=config.get("batch_size", 8),
+                          max_wait=config.get("max_wait_ms", 10) / 1000)
+    return server, list(files.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多路视频目标检测服务：所有视频流共用一个 YOLO 模型并批量推理")
+    parser.add_argument("config", help="视频流配置文件（JSON）")
+    parser.add_argument("--duration", type=float, default=None, help="运行秒数，默认一直运行到视频结束或 Ctrl+C")
+    parser.add_argument("--report-every", type=float, default=10.0, help="打印统计信息的间隔（秒）")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    print(f"🚀 启动多路检测服务，共 {len(config['streams'])} 路视频")
+    server, sinks = build_server(config)
+    server.run(duration=args.duration, report_every=args.report_every)
+    for sink in sinks:
+        sink.close()
+    server.print_stats()
+    print("🎉 检测完成!")
+
+
+if __name__ == "__main__":
+    main()
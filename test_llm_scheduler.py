@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+import llm_scheduler
+from llm_scheduler import LLMScheduler, QueueRejected
+
+
+def acquire_in_thread(scheduler, name):
+    """在后台线程里 acquire，返回 (线程, 结果列表)；结果为获得的优先级或抛出的异常"""
+    result = []
+
+    def run():
+        try:
+            result.append(scheduler.acquire(name))
+        except QueueRejected as e:
+            result.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+
+class LLMSchedulerTest(unittest.TestCase):
+    def test_interactive_not_blocked_by_background_at_capacity_one(self):
+        scheduler = LLMScheduler(capacity=1)
+        scheduler.acquire("background")
+        thread, result = acquire_in_thread(scheduler, "interactive")
+        thread.join(1)
+        self.assertEqual(result, ["interactive"])
+        # 第二个后台请求仍然要等待
+        thread, result = acquire_in_thread(scheduler, "background")
+        thread.join(0.1)
+        self.assertEqual(result, [])
+        scheduler.release("background")
+        scheduler.release("interactive")
+        thread.join(1)
+        self.assertEqual(result, ["background"])
+
+    def test_background_leaves_a_slot_for_interactive(self):
+        scheduler = LLMScheduler(capacity=4)
+        for _ in range(3):
+            scheduler.acquire("background")
+        thread, result = acquire_in_thread(scheduler, "background")
+        thread.join(0.1)
+        self.assertEqual(result, [], "后台任务不应占满全部槽位")
+        self.assertEqual(scheduler.acquire("interactive"), "interactive")
+        self.assertEqual(scheduler.stats()["interactive_active"], 1)
+        for _ in range(3):
+            scheduler.release("background")
+        thread.join(1)
+        self.assertEqual(result, ["background"])
+
+    def test_interactive_served_before_queued_batch(self):
+        scheduler = LLMScheduler(capacity=2, limits={"interactive": 2, "background": 2, "batch": 2})
+        scheduler.acquire("interactive")
+        scheduler.acquire("batch")
+        batch_thread, batch_result = acquire_in_thread(scheduler, "batch")
+        time.sleep(0.05)
+        interactive_thread, interactive_result = acquire_in_thread(scheduler, "interactive")
+        time.sleep(0.05)
+        scheduler.release("batch")
+        interactive_thread.join(1)
+        self.assertEqual(interactive_result, ["interactive"])
+        self.assertEqual(batch_result, [])
+        scheduler.release("interactive")
+        batch_thread.join(1)
+        self.assertEqual(batch_result, ["batch"])
+
+    def test_rejects_when_queue_full(self):
+        scheduler = LLMScheduler(capacity=1, queue_limits={"interactive": 1, "background": 0, "batch": 1})
+        scheduler.acquire("interactive")
+        with self.assertRaises(QueueRejected) as cm:
+            scheduler.acquire("background")
+        self.assertEqual(cm.exception.reason, "queue_full")
+
+    def test_disabled_without_server_parallelism(self):
+        with mock.patch.dict(os.environ, clear=False), mock.patch.object(llm_scheduler, "_default_scheduler", None):
+            os.environ.pop("OLLAMA_NUM_PARALLEL", None)
+            os.environ.pop("LLM_SCHEDULER", None)
+            self.assertIsNone(llm_scheduler.get_scheduler())
+            os.environ["LLM_SCHEDULER"] = "1"
+            os.environ.pop("OLLAMA_MAX_CONCURRENCY", None)
+            self.assertEqual(llm_scheduler.get_scheduler().capacity, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()